@@ -1,5 +1,390 @@
-from pathlib import Path
+"""
+Backups of Valar with mysqldump, with concurrent table dumps, a manifest, and restore verification.
+"""
+
+from __future__ import annotations
+
+import hashlib
+import json
+import logging
+import os
+import re
+import shutil
 import subprocess
+import tempfile
+from contextlib import suppress
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import asdict, dataclass, field
+from datetime import datetime
+from pathlib import Path
+from typing import Dict, List, Mapping, Optional, Sequence, Set, Tuple
+
+
+logger = logging.getLogger(__package__)
+
+# quoted strings in mysqldump output; removed before counting row separators
+_STRINGS = re.compile(rb"'(?:[^'\\]|\\.)*'")
+_INSERT = re.compile(rb"^INSERT INTO `([^`]+)`")
+
+
+class BackupError(Exception):
+    """A dump, compression, or verification step failed."""
+
+
+@dataclass(frozen=True)
+class TableDump:
+    """
+    One file of a backup.
+
+    Attributes:
+        file: The filename, relative to the manifest
+        tables: The tables in the file
+        rows: The number of rows per table
+        sha256: The SHA-256 of the (compressed) file
+        n_bytes: The size of the (compressed) file
+        low: For append-only tables, only rows with key > low; None for no lower bound
+        high: For append-only tables, only rows with key <= high
+        dump_exit: The exit code of mysqldump
+        compress_exit: The exit code of the compressor
+    """
+
+    file: str
+    tables: List[str]
+    rows: Dict[str, int]
+    sha256: str
+    n_bytes: int
+    low: Optional[int] = None
+    high: Optional[int] = None
+    dump_exit: int = 0
+    compress_exit: int = 0
+
+
+@dataclass(frozen=True)
+class BackupManifest:
+    """
+    Describes a backup: the files, and the watermarks of the append-only tables.
+    A backup with a ``base`` contains only the rows of append-only tables added since the base,
+    so restoring it requires restoring the base first.
+    """
+
+    database: str
+    started: str
+    finished: str
+    compressor: str
+    watermarks: Dict[str, int]
+    dumps: List[TableDump] = field(default_factory=list)
+    base: Optional[str] = None
+
+    @property
+    def row_counts(self) -> Dict[str, int]:
+        counts = {}
+        for dump in self.dumps:
+            for table, n in dump.rows.items():
+                counts[table] = counts.get(table, 0) + n
+        return counts
+
+    def write(self, path: Path) -> None:
+        tmp = path.with_name("." + path.name + ".tmp")
+        tmp.write_text(json.dumps(asdict(self), indent=2), encoding="utf8")
+        os.replace(tmp, path)
+
+    @classmethod
+    def read(cls, path: Path) -> BackupManifest:
+        data = json.loads(Path(path).read_text(encoding="utf8"))
+        data["dumps"] = [TableDump(**d) for d in data["dumps"]]
+        return BackupManifest(**data)
+
+
+class BackupEngine:
+    """
+    Dumps a database into a directory, with a ``manifest.json``.
+
+    Tables other than the append-only ones are dumped together
+    by one mysqldump ``--single-transaction``, so they are one consistent snapshot.
+    Append-only tables (like ``sensor_data``) are dumped concurrently,
+    each bounded by the maximum of its key.
+    The maximums are read before the snapshot starts,
+    so every row they contain refers to rows in the snapshot.
+    Rows added later are picked up by the next incremental backup.
+
+    Every dump is streamed through a multithreaded compressor (zstd or pigz if installed),
+    and both exit codes are checked.
+    """
+
+    compressors = {
+        "zstd": (".zst", lambda level, threads: ["zstd", "-q", "-c", f"-{level}", f"-T{threads}"]),
+        "pigz": (".gz", lambda level, threads: ["pigz", "-c", f"-{level}", "-p", str(threads)]),
+        "gzip": (".gz", lambda level, threads: ["gzip", "-c", f"-{level}"]),
+    }
+    decompressors = {".zst": ["zstd", "-q", "-d", "-c"], ".gz": ["gzip", "-d", "-c"]}
+
+    def __init__(
+        self,
+        database: str = "valar",
+        user: str = "root",
+        port: int = 3306,
+        append_only: Optional[Mapping[str, str]] = None,
+        exclude: Sequence[str] = (),
+        workers: int = 4,
+        compressor: Optional[str] = None,
+        level: int = 6,
+    ):
+        """
+        Constructor.
+
+        Args:
+            database: The database to dump
+            user: The MySQL user, which needs SELECT, SHOW VIEW, and LOCK TABLES
+            port: The MySQL port
+            append_only: Maps each append-only table to its auto-increment key;
+                         defaults to ``sensor_data`` and ``well_features`` by ``id``
+            exclude: Tables to skip
+            workers: The maximum number of simultaneous dumps
+            compressor: ``zstd``, ``pigz``, or ``gzip``; defaults to the first installed
+            level: The compression level
+        """
+        self.database = database
+        self.user = user
+        self.port = port
+        if append_only is None:
+            append_only = {"sensor_data": "id", "well_features": "id"}
+        self.append_only = dict(append_only)
+        self.exclude: Set[str] = set(exclude)
+        self.workers = workers
+        if compressor is None:
+            compressor = next((c for c in self.compressors if shutil.which(c)), "gzip")
+        if compressor not in self.compressors:
+            raise ValueError(f"Unknown compressor {compressor}")
+        self.compressor = compressor
+        self.level = level
+
+    def backup(self, path: Path, base: Optional[Path] = None) -> BackupManifest:
+        """
+        Dumps the database into ``path``.
+
+        Args:
+            path: An empty or nonexistent directory
+            base: The manifest of a previous backup;
+                  if set, dumps only rows of append-only tables added since it
+
+        Returns:
+            The manifest, which is also written to ``path / "manifest.json"``
+
+        Raises:
+            BackupError: If a dump or compression failed
+        """
+        path = Path(path)
+        path.mkdir(parents=True, exist_ok=True)
+        started = datetime.now().isoformat()
+        previous = {} if base is None else BackupManifest.read(base).watermarks
+        tables = [t for t in self._query("SHOW TABLES") if t not in self.exclude]
+        append_only = [t for t in tables if t in self.append_only]
+        snapshot = [t for t in tables if t not in self.append_only]
+        # must be read before the snapshot starts; see the class docstring
+        watermarks = self._watermarks(append_only)
+        # give each compressor an even share of the cores
+        threads = max(1, (os.cpu_count() or 1) // self.workers)
+        with ThreadPoolExecutor(max_workers=self.workers) as executor:
+            futures = [executor.submit(self._dump, path, "snapshot", snapshot, threads)]
+            for table in append_only:
+                low, high = previous.get(table), watermarks[table]
+                futures.append(
+                    executor.submit(self._dump, path, table, [table], threads, low, high)
+                )
+            dumps = [f.result() for f in futures]
+        manifest = BackupManifest(
+            database=self.database,
+            started=started,
+            finished=datetime.now().isoformat(),
+            compressor=self.compressor,
+            watermarks=watermarks,
+            dumps=dumps,
+            base=None if base is None else str(Path(base).absolute()),
+        )
+        manifest.write(path / "manifest.json")
+        logger.info(
+            f"Backed up {len(tables)} tables to {path}"
+            f" ({sum(d.n_bytes for d in dumps) / 1024 ** 3:.1f} GiB)"
+        )
+        return manifest
+
+    def verify(self, manifest_path: Path, scratch: str, restore: bool = True) -> Dict[str, int]:
+        """
+        Checks the files of a backup, and optionally restores it into a scratch database.
+        For an incremental backup, restores the chain of bases first.
+
+        Args:
+            manifest_path: The ``manifest.json`` of a backup
+            scratch: The name of the scratch database, which is dropped and re-created
+            restore: Restore and compare row counts; otherwise, only check the checksums
+
+        Returns:
+            The row count per table
+
+        Raises:
+            BackupError: If a checksum or row count differs, or if restoring fails
+            ValueError: If ``scratch`` is the backed-up database
+        """
+        chain = self._chain(Path(manifest_path))
+        if scratch in {m.database for _, m in chain}:
+            raise ValueError(f"Refusing to restore into source database {scratch}")
+        for directory, manifest in chain:
+            for dump in manifest.dumps:
+                digest, _ = self._hash(directory / dump.file)
+                if digest != dump.sha256:
+                    raise BackupError(f"Checksum of {directory / dump.file} does not match")
+        expected = {}
+        for _, manifest in chain:
+            for dump in manifest.dumps:
+                for table, n in dump.rows.items():
+                    # snapshots replace the tables; append-only dumps add to them
+                    expected[table] = n + (0 if dump.high is None else expected.get(table, 0))
+        if not restore:
+            return expected
+        self._query(f"DROP DATABASE IF EXISTS `{scratch}`; CREATE DATABASE `{scratch}`")
+        for directory, manifest in chain:
+            for dump in manifest.dumps:
+                self._restore(directory / dump.file, scratch)
+        actual = self._row_counts(scratch, list(expected.keys()))
+        wrong = {t: (n, actual.get(t)) for t, n in expected.items() if actual.get(t) != n}
+        if len(wrong) > 0:
+            raise BackupError(f"Row counts (expected, restored) differ for {wrong}")
+        logger.info(f"Verified {manifest_path}: restored {sum(actual.values())} rows")
+        return actual
+
+    def _dump(
+        self,
+        path: Path,
+        name: str,
+        tables: Sequence[str],
+        threads: int,
+        low: Optional[int] = None,
+        high: Optional[int] = None,
+    ) -> TableDump:
+        ext, compress_cmd = self.compressors[self.compressor]
+        bounded = high is not None
+        filename = f"{name}.{low or 0}-{high}.sql{ext}" if bounded else f"{name}.sql{ext}"
+        dump_cmd = [
+            "mysqldump",
+            "--single-transaction",
+            "--max_allowed_packet=1073741824",
+            "--hex-blob",
+            "-P",
+            str(self.port),
+            "-u",
+            self.user,
+        ]
+        if bounded:
+            key = self.append_only[name]
+            where = f"`{key}` <= {high}"
+            if low is not None:
+                where += f" AND `{key}` > {low}"
+                # restored on top of the base, so keep its table
+                dump_cmd.append("--no-create-info")
+            dump_cmd.append(f"--where={where}")
+        dump_cmd += [self.database, *tables]
+        rows = {t: 0 for t in tables}
+        tmp = path / ("." + filename + ".tmp")
+        # stderr goes to a file so that a chatty mysqldump can't block on a full pipe
+        with tmp.open("wb") as out, tempfile.TemporaryFile() as stderr:
+            dumper = subprocess.Popen(dump_cmd, stdout=subprocess.PIPE, stderr=stderr)
+            compressor = subprocess.Popen(
+                compress_cmd(self.level, threads), stdin=subprocess.PIPE, stdout=out
+            )
+            try:
+                for line in dumper.stdout:
+                    match = _INSERT.match(line)
+                    if match is not None:
+                        table = match.group(1).decode("utf8")
+                        rows[table] = rows.get(table, 0) + self._count_rows(line)
+                    compressor.stdin.write(line)
+            except BrokenPipeError:
+                # the compressor died; its exit code is reported below
+                dumper.kill()
+            finally:
+                with suppress(BrokenPipeError):
+                    compressor.stdin.close()
+                dump_exit, compress_exit = dumper.wait(), compressor.wait()
+            stderr.seek(0)
+            error = stderr.read().decode("utf8", errors="replace")[-2000:]
+        if dump_exit != 0 or compress_exit != 0:
+            tmp.unlink()
+            raise BackupError(
+                f"Dumping {name} failed"
+                f" (mysqldump: {dump_exit}, {self.compressor}: {compress_exit}):\n{error}"
+            )
+        os.replace(tmp, path / filename)
+        digest, n_bytes = self._hash(path / filename)
+        logger.info(f"Dumped {sum(rows.values())} rows of {name} to {filename}")
+        return TableDump(
+            file=filename,
+            tables=list(tables),
+            rows=rows,
+            sha256=digest,
+            n_bytes=n_bytes,
+            low=low,
+            high=high,
+            dump_exit=dump_exit,
+            compress_exit=compress_exit,
+        )
+
+    def _restore(self, file: Path, scratch: str) -> None:
+        decompressor = subprocess.Popen(
+            self.decompressors[file.suffix] + [str(file)], stdout=subprocess.PIPE
+        )
+        loader = subprocess.run(
+            ["mysql", "-P", str(self.port), "-u", self.user, "-D", scratch],
+            stdin=decompressor.stdout,
+            stderr=subprocess.PIPE,
+        )
+        decompressor.stdout.close()
+        if decompressor.wait() != 0 or loader.returncode != 0:
+            error = loader.stderr.decode("utf8", errors="replace")[-2000:]
+            raise BackupError(f"Restoring {file} into {scratch} failed:\n{error}")
+
+    def _chain(self, manifest_path: Path) -> List[Tuple[Path, BackupManifest]]:
+        # oldest first
+        chain = []
+        while manifest_path is not None:
+            manifest = BackupManifest.read(manifest_path)
+            chain.insert(0, (manifest_path.parent, manifest))
+            manifest_path = None if manifest.base is None else Path(manifest.base)
+        return chain
+
+    def _watermarks(self, tables: Sequence[str]) -> Dict[str, int]:
+        if len(tables) == 0:
+            return {}
+        sql = " UNION ALL ".join(
+            f"SELECT '{t}', COALESCE(MAX(`{self.append_only[t]}`), 0) FROM `{t}`" for t in tables
+        )
+        return {t: int(n) for t, n in (line.split("\t") for line in self._query(sql))}
+
+    def _row_counts(self, database: str, tables: Sequence[str]) -> Dict[str, int]:
+        if len(tables) == 0:
+            return {}
+        sql = " UNION ALL ".join(f"SELECT '{t}', COUNT(*) FROM `{t}`" for t in tables)
+        lines = self._query(sql, database=database)
+        return {t: int(n) for t, n in (line.split("\t") for line in lines)}
+
+    def _query(self, sql: str, database: Optional[str] = None) -> List[str]:
+        database = self.database if database is None else database
+        cmd = ["mysql", "-NBA", "-P", str(self.port), "-u", self.user, "-D", database, "-e", sql]
+        return subprocess.check_output(cmd, encoding="utf8").splitlines()
+
+    @classmethod
+    def _count_rows(cls, line: bytes) -> int:
+        # an extended INSERT has one (...) per row, separated by "),("
+        return _STRINGS.sub(b"", line).count(b"),(") + 1
+
+    @classmethod
+    def _hash(cls, path: Path) -> Tuple[str, int]:
+        h = hashlib.sha256()
+        n_bytes = 0
+        with path.open("rb") as f:
+            for block in iter(lambda: f.read(16 * 1024 * 1024), b""):
+                h.update(block)
+                n_bytes += len(block)
+        return h.hexdigest(), n_bytes
 
 
 class Backup:
@@ -9,33 +394,11 @@ class Backup:
         self._features = features
         self._gzip_level = gzip_level
 
-    def backup(self) -> None:
-        tables = subprocess.check_output(
-            ["mysql", "-NBA", "-u", "root", "-D", "valar", "-e", "show tables"], encoding="utf8"
-        ).splitlines()
-        for table in tables:
-            if (self._sensors or table != "sensor_data") and (
-                self._features or table != "feature_data"
-            ):
-                self._backup_table(table)
-
-    def _backup_table(self, table: str) -> None:
-        ps = subprocess.Popen(
-            [
-                "mysqldump",
-                "--single-transaction",
-                "--max_allowed_packet=1073741824",
-                "--hex-blob",
-                "-P",
-                "3306",
-                "-u",
-                "root",
-                "valar",
-                table,
-            ],
-            stdout=subprocess.PIPE,
-        )
-        subprocess.check_call(
-            ["gzip", "-c", f"-{self._gzip_level}", str(self._path / f"{table}.sql.gz")],
-            stdin=ps.stdout,
-        )
+    def backup(self, base: Optional[Path] = None) -> BackupManifest:
+        exclude = [] if self._sensors else ["sensor_data"]
+        exclude += [] if self._features else ["well_features"]
+        engine = BackupEngine(exclude=exclude, level=self._gzip_level)
+        return engine.backup(self._path, base=base)
+
+
+__all__ = ["Backup", "BackupEngine", "BackupError", "BackupManifest", "TableDump"]
@@ -9,6 +9,7 @@ from pathlib import Path
 
 import typer
 
+from valardagger.backup import BackupEngine
 from valardagger.watcher import Watcher
 
 
@@ -32,5 +33,14 @@ def backup(name: str) -> None:
     """
 
 
+@cli.command()
+def verify(manifest: Path, scratch: str = "valar_restore_test", restore: bool = True) -> None:
+    """
+    Checks the checksums of a backup, and restores it into a scratch database to check row counts.
+    """
+    counts = BackupEngine().verify(manifest, scratch, restore=restore)
+    logger.info(f"Verified {sum(counts.values())} rows in {len(counts)} tables")
+
+
 if __name__ == "__main__":
     cli()
@@ -0,0 +1,113 @@
+"""
+Builds a video from the frames in a 7z archive, streaming them into ffmpeg instead of extracting them first.
+Has no Airflow dependencies, so miniberry.py uses it too.
+"""
+import os, re, shutil, logging, subprocess
+from typing import List, Optional
+
+
+class VideoPipelineError(Exception):
+	pass
+
+
+class FrameVideoPipeline:
+	"""
+	Encodes the JPEG frames in frames.7z to an x265 video.
+	When possible, ``7za x -so`` writes the frames straight into ffmpeg's stdin (as a stream of JPEGs),
+	so encoding starts with the first frame and the frames never touch the disk.
+	Memory use is bounded by the pipe between the two processes.
+
+	Streaming requires that the archive contains only the frames, stored in the order that ffmpeg's glob
+	over the extracted frames would read them. If it doesn't, or if streaming fails,
+	the frames are extracted to a temporary directory and encoded from there, as before.
+	The video is written to a temporary file and renamed when complete.
+	"""
+
+	def __init__(self, crf: int, dry: bool = False) -> None:
+		self.crf = crf
+		self.dry = dry
+
+	def build(self, archive: str, video: str, tmp_frames_path: Optional[str] = None) -> str:
+		"""
+		Writes the video.
+
+		:param archive: The frames.7z file
+		:param video: The video file to write
+		:param tmp_frames_path: Where to extract frames if streaming isn't possible; defaults to next to the archive
+		:return: 'streamed' or 'extracted'
+		"""
+		if tmp_frames_path is None:
+			tmp_frames_path = os.path.join(os.path.dirname(archive), 'tmpframes')
+		tmp_video = video + '.tmp' + os.path.splitext(video)[1]
+		if self.dry:
+			return 'streamed'
+		os.makedirs(os.path.dirname(video), exist_ok=True)
+		how = 'extracted'
+		if self._is_streamable(archive):
+			try:
+				self._stream(archive, tmp_video)
+				how = 'streamed'
+			except VideoPipelineError as e:
+				logging.warning("Streaming frames from {} failed; extracting instead: {}".format(archive, e))
+		else:
+			logging.info("Frames in {} are not stored in order; extracting instead".format(archive))
+		if how == 'extracted':
+			self._extract(archive, tmp_video, tmp_frames_path)
+		os.replace(tmp_video, video)
+		return how
+
+	def _ffmpeg(self, input_args: List[str], output: str) -> List[str]:
+		return [
+			'ffmpeg',
+			*input_args,
+			'-vf', "scale=trunc(iw/2)*2:trunc(ih/2)*2",
+			'-c:v', 'libx265',
+			'-crf', str(self.crf),
+			'-pix_fmt', 'yuv420p',
+			'-y', output
+		]
+
+	def _stream(self, archive: str, output: str) -> None:
+		extractor = subprocess.Popen(['7za', 'x', '-so', archive], stdout=subprocess.PIPE, stderr=subprocess.DEVNULL)
+		encoder = subprocess.Popen(
+			self._ffmpeg(['-f', 'image2pipe', '-c:v', 'mjpeg', '-i', '-'], output),
+			stdin=extractor.stdout, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE
+		)
+		# let 7za get SIGPIPE if ffmpeg exits early
+		extractor.stdout.close()
+		_, err = encoder.communicate()
+		extract_code = extractor.wait()
+		if extract_code != 0 or encoder.returncode != 0:
+			if os.path.exists(output):
+				os.remove(output)
+			raise VideoPipelineError("7za exited with {}; ffmpeg exited with {}:\n{}".format(
+				extract_code, encoder.returncode, err.decode('utf8', errors='replace')[-2000:]
+			))
+
+	def _extract(self, archive: str, output: str, tmp_frames_path: str) -> None:
+		subprocess.check_call(['7za', 'x', archive, "-o{}".format(tmp_frames_path), '-aos'], stdout=subprocess.DEVNULL)
+		try:
+			subprocess.check_call(
+				self._ffmpeg(['-pattern_type', 'glob', '-i', "{}/**/*.jpg".format(tmp_frames_path), '-safe', '0'], output),
+				stdout=subprocess.DEVNULL
+			)
+		finally:
+			shutil.rmtree(tmp_frames_path, ignore_errors=True)
+
+	def _is_streamable(self, archive: str) -> bool:
+		# the glob in _extract matches dir/frame.jpg, sorted; the stream must contain exactly those, in that order
+		listing = subprocess.check_output(['7za', 'l', '-slt', archive], encoding='utf8')
+		files = []
+		for block in listing.split('\n\n'):
+			path = re.search(r'^Path = (.+)$', block, re.MULTILINE)
+			is_dir = re.search(r'^Attributes = D', block, re.MULTILINE) or re.search(r'^Folder = \+', block, re.MULTILINE)
+			# the first block with a Path describes the archive itself
+			if path is not None and not is_dir and re.search(r'^Size = ', block, re.MULTILINE):
+				files.append(path.group(1).replace('\\', '/'))
+		if len(files) == 0:
+			return False
+		frames = [f for f in files if re.fullmatch(r'[^/]+/[^/]+\.jpg', f)]
+		return frames == files and frames == sorted(frames)
+
+
+__all__ = ['FrameVideoPipeline', 'VideoPipelineError']
@@ -14,7 +14,9 @@ from typing import Set, Optional
 import re
 import argparse
 import socketserver
-from typing import Optional, Iterator, Callable, List, Union
+from typing import Optional, Iterator, Callable, Dict, List, Union
+import sqlite3
+import threading
 from enum import Enum
 from websocket import WebSocketConnectionClosedException
 
@@ -36,6 +38,7 @@ from klgists.files.file_hasher import FileHasher
 
 from valarpy.Valar import Valar
 from valarpy.global_connection import db as global_db
+from goldberry_airflow.dag_tasks.video_pipeline import FrameVideoPipeline
 colorama.init(autoreset=True)
 
 
@@ -70,6 +73,7 @@ class GoldberryPaths:
         _store_root = pjoin('/', 'samba', 'shire', 'store')
         _trash_root = pjoin('/', 'trash', 'goldberry-tmp-data')
         _log_root = pjoin('/', 'var', 'log', 'goldberry')
+        _state_root = pjoin('/', 'var', 'lib', 'goldberry')
         _repo_root = pjoin('/', 'data', 'repos')
 
         def upload_path(self, lookup_hash: str) -> str:
@@ -108,6 +112,9 @@ class GoldberryPaths:
         def lorien_repo_path(self) -> str:
                 return pjoin(GoldberryPaths._repo_root, 'lorien')
 
+        def queue_path(self) -> str:
+                return pjoin(GoldberryPaths._state_root, 'queue.sqlite')
+
         def goldberry_root_log_path(self) -> str:
                 return pjoin(GoldberryPaths._log_root, 'goldberry.log')
 
@@ -165,7 +172,7 @@ class GoldberryProcessor:
                         self.run = Runs.select().where(Runs.submission_id == self.sub_obj.id).first()
                 return self.run
 
-        def insert(self):
+        def insert(self, archive: bool = True):
                 path = self.find()
                 sub = self.sub
                 _log_global(sub, "Importing new submission at path {}".format(path), 'info')
@@ -182,7 +189,7 @@ class GoldberryProcessor:
                         raise InsertionError("Failed to insert into Valar:\n{}".format(str(e))) from e
                 try:
                         self._annotate(path)
-                        if path == PATHS.upload_path(sub):
+                        if archive and path == PATHS.upload_path(sub):
                                 self.archive()
                 except ExternalCommandFailed as e:
                         raise UploadFailedError("Failed to move {}:\n{}".format(sub, e.extended_message())) from e
@@ -311,27 +318,11 @@ class GoldberryProcessor:
                 v_path = PATHS.video_file(path)
                 sz_path = pjoin(path, 'frames.7z')
                 if pexists(v_path) or not pexists(sz_path): return
-                yz_path = pjoin(path, 'frames.7z')
-                tmp_frames_path = pjoin(path, "tmpframes")
+                _log_global(sub, "Making video at {}".format(v_path), 'debug')
+                how = FrameVideoPipeline(PATHS.crf(), dry=self._dry).build(sz_path, v_path, pjoin(path, "tmpframes"))
+                _log_global(sub, "Made video ({} frames)".format(how), 'debug')
                 if not self._dry:
-                        _log_global(sub, "Extracting frames to {}".format(yz_path), 'debug')
-                        wrap_cmd_call(['7za', 'x', sz_path, "-o{}".format(tmp_frames_path), '-aos'])
-                if pexists(tmp_frames_path) and not self._dry:
-                        _log_global(sub, "Making video at {}".format(v_path), 'debug')
-                        make_dirs(os.path.dirname(v_path))
-                        wrap_cmd_call([
-                                        'ffmpeg',
-                                        '-pattern_type', 'glob',
-                                        '-i', "{}/**/*.jpg".format(tmp_frames_path),
-                                        '-safe', '0',
-                                        '-vf', "scale=trunc(iw/2)*2:trunc(ih/2)*2",
-                                        '-c:v', 'libx265',
-                                        '-crf', str(PATHS.crf()),
-                                        '-pix_fmt', 'yuv420p',
-                                        '-y', v_path
-                        ])
                         hasher.add_hash(v_path)
-                        shutil.rmtree(tmp_frames_path)
 
 
         def _datetime_started(self, path) -> datetime:
@@ -343,54 +334,172 @@ class GoldberryProcessor:
 
 
 class GoldberryQueue:
-        def __init__(self, max_workers: int, notify_callback: Callable[[str, Optional[Exception]], None]):
-                self.pending = []
-                self.running = []
-                self.max_workers = max_workers
-                self.executor = ThreadPoolExecutor(max_workers=max_workers)
+        """
+        Submissions waiting to be processed, stored in a SQLite file so that they survive restarts.
+        Each task moves from pending to running to done or failed, and each transition is timestamped.
+        Pending tasks run in order of priority, then first-in first-out.
+        Tasks that encode video or calculate features are limited by limits['cpu'];
+        tasks that only move files (archive and unarchive) are limited separately by limits['io'].
+        Tasks that were running when the process stopped are pending again on restart.
+        """
+
+        _resources = {'insert': 'cpu', 'calculate': 'cpu', 'archive': 'io', 'unarchive': 'io', 'delete': 'io'}
+
+        def __init__(self, limits: Dict[str, int], notify_callback: Callable[[str, Optional[Exception]], None], path: Optional[str] = None):
+                self.limits = dict(limits)
                 self.notify_callback = notify_callback
-                print(Fore.GREEN + "Started queue. Found {} pending submissions.".format(len(PATHS.pending_subs())))
+                self.path = PATHS.queue_path() if path is None else path
+                make_dirs(os.path.dirname(self.path))
+                self._lock = threading.RLock()
+                self._db = sqlite3.connect(self.path, check_same_thread=False, isolation_level=None)
+                self._db.execute("""
+                        CREATE TABLE IF NOT EXISTS tasks (
+                                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                                sub TEXT NOT NULL,
+                                kind TEXT NOT NULL,
+                                args TEXT NOT NULL,
+                                resource TEXT NOT NULL,
+                                priority INTEGER NOT NULL DEFAULT 0,
+                                state TEXT NOT NULL,
+                                error TEXT,
+                                created REAL NOT NULL,
+                                started REAL,
+                                finished REAL
+                        )
+                """)
+                self._db.execute("CREATE INDEX IF NOT EXISTS tasks_state ON tasks (state, resource, priority, id)")
+                self.executor = ThreadPoolExecutor(max_workers=max(1, sum(self.limits.values())))
+                n_resumed = self._db.execute("UPDATE tasks SET state='pending', started=NULL WHERE state='running'").rowcount
+                print(Fore.GREEN + "Started queue at {}. Resuming {} interrupted and {} pending tasks. Found {} pending submissions.".format(
+                        self.path, n_resumed, len(self.pending) - n_resumed, len(PATHS.pending_subs())
+                ))
+                self.maybe_run_next()
 
         def insert(self, sub):
-                self._submit(sub, (GoldberryProcessor(sub, force=False).insert, ))
+                self._submit(sub, 'insert', force=False)
 
         def archive(self, sub, force: bool = False):
-                self._submit(sub, (GoldberryProcessor(sub).archive, force))
+                self._submit(sub, 'archive', force=force)
 
         def unarchive(self, sub, force: bool = False):
-                self._submit(sub, (GoldberryProcessor(sub).unarchive, force))
+                self._submit(sub, 'unarchive', force=force)
 
         def calculate(self, sub, feature):
-                self._submit(sub, (GoldberryProcessor(sub).calculate, feature))
+                self._submit(sub, 'calculate', feature=feature)
 
         def delete(self, sub, feature):
-                self._submit(sub, (GoldberryProcessor(sub).delete,))
+                self._submit(sub, 'delete')
 
         def reinsert(self, sub):
-                path = PATHS.store_path(sub)
-                self._submit(sub, (GoldberryProcessor(sub, force=True).insert, ))
-
-        def _submit(self, sub, task):
-                if sub in self: raise AlreadyInQueueError("Can't add {}: already pending or in queue".format(sub))
-                self.pending.append((sub, task))
+                self._submit(sub, 'insert', force=True)
+
+        @property
+        def pending(self) -> List[str]:
+                """The pending submissions, in the order they will run."""
+                return self._subs("SELECT sub FROM tasks WHERE state='pending' ORDER BY priority DESC, id")
+
+        @property
+        def running(self) -> List[str]:
+                return self._subs("SELECT sub FROM tasks WHERE state='running' ORDER BY started")
+
+        def remove(self, sub) -> bool:
+                """Cancels a pending submission. Returns whether it was pending."""
+                return self._finish_pending("WHERE state='pending' AND sub=?", sub) > 0
+
+        def clear(self) -> int:
+                """Cancels every pending submission. Returns the number cancelled."""
+                return self._finish_pending("WHERE state='pending'")
+
+        def prioritize(self, sub) -> bool:
+                """Moves a pending submission ahead of every other. Returns whether it was pending."""
+                with self._lock:
+                        top = self._db.execute("SELECT COALESCE(MAX(priority), 0) FROM tasks WHERE state='pending'").fetchone()[0]
+                        n = self._db.execute("UPDATE tasks SET priority=? WHERE state='pending' AND sub=?", (top + 1, sub)).rowcount
+                return n > 0
+
+        def stats(self, since: timedelta = timedelta(days=1)) -> Dict[str, Dict[str, float]]:
+                """
+                Queue depth and wait times for monitoring, per resource ('cpu' or 'io').
+                Returns for each resource:
+                        - pending: The number of pending tasks
+                        - running: The number of running tasks
+                        - oldest_wait: Seconds since the oldest pending task was queued (0 if none)
+                        - mean_wait: Mean seconds between queueing and starting for tasks started after ``since`` ago
+                        - failed: The number of tasks that failed after ``since`` ago
+                """
+                now = time.time()
+                cutoff = now - since.total_seconds()
+                stats = {}
+                with self._lock:
+                        for resource in self.limits.keys():
+                                pending, oldest = self._db.execute(
+                                        "SELECT COUNT(*), MIN(created) FROM tasks WHERE state='pending' AND resource=?", (resource, )
+                                ).fetchone()
+                                running = self._db.execute("SELECT COUNT(*) FROM tasks WHERE state='running' AND resource=?", (resource, )).fetchone()[0]
+                                mean_wait = self._db.execute(
+                                        "SELECT AVG(started - created) FROM tasks WHERE started IS NOT NULL AND started > ? AND resource=?", (cutoff, resource)
+                                ).fetchone()[0]
+                                failed = self._db.execute(
+                                        "SELECT COUNT(*) FROM tasks WHERE state='failed' AND finished > ? AND resource=?", (cutoff, resource)
+                                ).fetchone()[0]
+                                stats[resource] = dict(
+                                        pending=pending, running=running,
+                                        oldest_wait=0 if oldest is None else now - oldest,
+                                        mean_wait=0 if mean_wait is None else mean_wait,
+                                        failed=failed
+                                )
+                return stats
+
+        def _submit(self, sub, kind, **args):
+                with self._lock:
+                        if sub in self: raise AlreadyInQueueError("Can't add {}: already pending or in queue".format(sub))
+                        self._db.execute(
+                                "INSERT INTO tasks (sub, kind, args, resource, state, created) VALUES (?, ?, ?, ?, 'pending', ?)",
+                                (sub, kind, json.dumps(args), GoldberryQueue._resources[kind], time.time())
+                        )
                 self.maybe_run_next()
 
         def maybe_run_next(self):
-                if len(self.pending) == 0: return
-                if len(self.running) > self.max_workers: return
-                sub, task = self.pending.pop()
-                _log_global(sub, 'Popped from queue', 'debug')
-                future = self.executor.submit(*task)
-                future.add_done_callback(functools.partial(self.finished, sub))
-                self.running.append(sub)
-
-        def finished(self, arg, fn: Future):
+                with self._lock:
+                        for resource, limit in self.limits.items():
+                                n_running = self._db.execute("SELECT COUNT(*) FROM tasks WHERE state='running' AND resource=?", (resource, )).fetchone()[0]
+                                while n_running < limit:
+                                        row = self._db.execute(
+                                                "SELECT id, sub, kind, args FROM tasks WHERE state='pending' AND resource=? ORDER BY priority DESC, id LIMIT 1", (resource, )
+                                        ).fetchone()
+                                        if row is None: break
+                                        task_id, sub, kind, args = row
+                                        self._db.execute("UPDATE tasks SET state='running', started=? WHERE id=?", (time.time(), task_id))
+                                        _log_global(sub, 'Popped {} from queue'.format(kind), 'debug')
+                                        future = self.executor.submit(self._run, sub, kind, json.loads(args))
+                                        future.add_done_callback(functools.partial(self.finished, task_id, sub))
+                                        n_running += 1
+
+        def _run(self, sub, kind, args):
+                if kind == 'insert':
+                        # archived by a separate io task, so the next video can start encoding during the move
+                        GoldberryProcessor(sub, force=args['force']).insert(archive=False)
+                elif kind == 'calculate':
+                        GoldberryProcessor(sub).calculate(args['feature'])
+                elif kind == 'archive':
+                        GoldberryProcessor(sub).archive(args['force'])
+                elif kind == 'unarchive':
+                        GoldberryProcessor(sub).unarchive(args['force'])
+                elif kind == 'delete':
+                        GoldberryProcessor(sub).delete()
+                else:
+                        raise ValueError("Unknown task {}".format(kind))
+
+        def finished(self, task_id, arg, fn: Future):
                 if not fn.cancelled() and not fn.done(): return
+                error = None
                 if fn.cancelled():
-                        self.notify_callback(arg, ValueError("Cancelled"))
+                        error = ValueError("Cancelled")
+                        self.notify_callback(arg, error)
                         _log_global(arg, 'Canceled', 'warn')
                 elif fn.done():
                         if fn.exception():
+                                error = fn.exception()
                                 self.notify_callback(arg, fn.exception())
                                 print('-'*60)
                                 _log_global(arg, 'Caught exception. Stack trace below:', 'warn')
@@ -403,14 +512,31 @@ class GoldberryQueue:
                         else:
                                 self.notify_callback(arg, None)
                                 _log_global(arg, 'Finished', 'info')
-                self.running = [r for r in self.running if r != arg]
-                self.maybe_run_next()  # TODO
+                with self._lock:
+                        self._db.execute(
+                                "UPDATE tasks SET state=?, error=?, finished=? WHERE id=?",
+                                ('done' if error is None else 'failed', None if error is None else str(error), time.time(), task_id)
+                        )
+                        kind = self._db.execute("SELECT kind FROM tasks WHERE id=?", (task_id, )).fetchone()[0]
+                        if error is None and kind == 'insert' and pexists(PATHS.upload_path(arg)) and arg not in self:
+                                self._submit(arg, 'archive', force=False)
+                self.maybe_run_next()
+
+        def _finish_pending(self, where, *params) -> int:
+                with self._lock:
+                        return self._db.execute("UPDATE tasks SET state='cancelled', finished=? " + where, (time.time(), *params)).rowcount
+
+        def _subs(self, query) -> List[str]:
+                with self._lock:
+                        return [sub for sub, in self._db.execute(query)]
 
         def __len__(self):
-                return len(self.pending) + len(self.running)
+                with self._lock:
+                        return self._db.execute("SELECT COUNT(*) FROM tasks WHERE state IN ('pending', 'running')").fetchone()[0]
 
         def __contains__(self, sub):
-                return sub in [x for x,y in self.pending] or sub in self.running
+                with self._lock:
+                        return self._db.execute("SELECT 1 FROM tasks WHERE state IN ('pending', 'running') AND sub=?", (sub, )).fetchone() is not None
 
 
 class ResponseType(Enum):
@@ -431,8 +557,8 @@ class Response:
 
 
 class Goldberry:
-        def __init__(self, max_workers: int, notify_callback: Callable[[str, Optional[Exception]], None]):
-                self.queue = GoldberryQueue(max_workers, notify_callback)
+        def __init__(self, limits: Dict[str, int], notify_callback: Callable[[str, Optional[Exception]], None]):
+                self.queue = GoldberryQueue(limits, notify_callback)
 
         def reinsert(self, sub) -> Response:
                 run = Runs.select(Runs, Submissions).join(Submissions).where(Submissions.lookup_hash == sub).first()
@@ -572,18 +698,17 @@ class Goldberry:
         def pause(self, sub):
                 r = self._only(sub)
                 if r is not None: return r
-                self.queue.pending = [s for s in self.queue.pending if s != sub]
+                self.queue.remove(sub)
                 return self._respond(ResponseType.SUCCESS, "I removed {} from the queue.".format(sub)) 
 
         def clear(self):
-                n = len(self.queue.pending)
-                self.queue.pending = []
+                n = self.queue.clear()
                 return self._respond(ResponseType.SUCCESS, "I removed {} submissions from the queue.".format(n)) 
 
         def prioritize(self, sub):
                 r = self._only(sub)
                 if r is not None: return r
-                self.queue.pending = [sub, *[s for s in self.queue.pending if s != sub]]
+                self.queue.prioritize(sub)
                 return self._respond(ResponseType.SUCCESS, "I’ll insert {} next.".format(sub)) 
 
         def _only(self, sub):
@@ -604,7 +729,7 @@ class Goldberry:
 
 class Bot:
         def __init__(self, slack_token: str):
-                self.goldberry = Goldberry(2, self.notify_job_status)
+                self.goldberry = Goldberry({'cpu': 2, 'io': 2}, self.notify_job_status)
                 self.slack_token = slack_token
 
         def __enter__(self):
@@ -686,8 +811,14 @@ class Bot:
                                         for s in lst
                                 ])
                         self.reply("Running: {}".format(names(self.goldberry.queue.running)), user, channel)
-                        self.reply("Pending: {}".format(names([x for x,y in self.goldberry.queue.pending])), user, channel)
+                        self.reply("Pending: {}".format(names(self.goldberry.queue.pending)), user, channel)
                         self.reply("Not queued: {}".format(names([s for s in PATHS.pending_subs() if s not in self.goldberry.queue])), user, channel)
+                        self.reply("Queue: {}".format(', '.join([
+                                "{} {} pending (oldest {:.0f} min), {} running, mean wait {:.0f} min, {} failed today".format(
+                                        r, s['pending'], s['oldest_wait'] / 60, s['running'], s['mean_wait'] / 60, s['failed']
+                                )
+                                for r, s in self.goldberry.queue.stats().items()
+                        ])), user, channel)
                         if len(self.goldberry.queue.running) + len(PATHS.pending_subs()) >= 10:
                                 self.reply("That’s too many! :fearful: Humans need to fix this ASAP.", user, channel)
                 elif any([message.startswith(t) for t in {'hold off on', 'stall', 'pause', 'wait to insert', "don’t insert", 'dequeue'}]):
@@ -13,6 +13,8 @@ from klgists.common.timestamp import timestamp
 from klgists.files.find_only_file_matching import find_only_file_matching
 from klgists.files.scantree import walk_until, walk_until_level
 
+from run_index import RunIndex, Checkpoint, ArchiveDiff, scan_dirs
+
 colorama.init(autoreset=True)
 
 
@@ -25,47 +27,42 @@ class OrphanFinder:
 		self.follow = follow
 		self.verbose = verbose
 
-
-	def walk(self, path: str) -> Iterator[str]:
-		# TODO get all dirs under /alpha/plates/ with depth=3
-		for root, dirs, files in walk_until_level(path, 3):
-			depth = root[len(path) + len(os.path.sep):].count(os.path.sep)
-			if depth == 2:
-				yield root
-
-	def search(self, root: str):
+	def search(self, root: str, checkpoint_path: Optional[str] = None):
 		with Valar():
-			import valarpy.model as model
-			print("Connected to Valar. Found {} plate runs.".format(len(model.PlateRuns.select())))
+			index = RunIndex.load()
+			print("Connected to Valar. Found {} runs.".format(len(index.runs)))
 			print("Listing orphans under {}".format(root))
-			for path in self.walk(root):
-				run = os.path.basename(path)
-				if not run.isdigit():
-					if self.verbose: print(('-' * 80))
+			checkpoint = Checkpoint(checkpoint_path)
+			found = scan_dirs(root, 3, checkpoint=checkpoint)
+			diff = ArchiveDiff(index, found, lambda run: self._expected(root, run))
+			checkpoint.finish()
+			for run, path, expected in diff.renames:
+				print(Fore.YELLOW + '[moved]   r{} /// {} → {}'.format(run.id, path, expected))
+			for path in diff.orphans:
+				if self.verbose: print(('-' * 80))
+				env_file = pjoin(path, 'environment.properties')
+				if not pexists(env_file):
 					print(Fore.MAGENTA + '[invalid] ' + path)
-					if self.verbose: print(('-' * 80) + '\n')
-					continue
-				match = model.PlateRuns.select().where(model.PlateRuns.id == int(run)).first()
-				if match is None:
-					if self.verbose: print(('-' * 80))
-					sub_hash_file = pjoin(path, 'submission_hash.txt')
-					if not pexists(sub_hash_file):
-						print(Fore.MAGENTA + "[invalid] {} does not exist!".format(sub_hash_file))
-					else:
-						with open(sub_hash_file) as f:
-							sub_hash = f.read().strip()
-						print(Fore.RED + '[orphan]  ' + sub_hash + ' /// '  + path)
-						if self.verbose:
-							with open(pjoin(path, 'environment.properties')) as f:
-								print(f.read())
-					if self.verbose: print(('-' * 80) + '\n')
+				else:
+					print(Fore.RED + '[orphan]  ' + path)
+					if self.verbose:
+						with open(env_file) as f:
+							print(f.read())
+				if self.verbose: print(('-' * 80) + '\n')
+			print(Fore.BLUE + diff.report().splitlines()[-1])
+
+	def _expected(self, root: str, run) -> str:
+		year = str(run.datetime_run.year).zfill(4)
+		month = str(run.datetime_run.month).zfill(2)
+		return pjoin(root, year, month, run.tag)
 
 
 if __name__ == '__main__':
-	parser = argparse.ArgumentParser("Scans for directories ")
+	parser = argparse.ArgumentParser("Scans the store (year/month/tag) for directories that don't belong to runs")
+	parser.add_argument("root", nargs='?', default='/shire/store', help="The store directory")
 	parser.add_argument("--follow", action='store_true', help="Follow symlinks.")
 	parser.add_argument("--verbose", action='store_true', help="Output full environment info")
+	parser.add_argument("--checkpoint", help="Save directory listings to this file, and resume from it if it exists")
 	args = parser.parse_args()
 	finder = OrphanFinder(args.follow, args.verbose)
-	finder.search('/alpha/plates')
-
+	finder.search(args.root, args.checkpoint)
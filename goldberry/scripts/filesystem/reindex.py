@@ -13,6 +13,8 @@ from klgists.common.exceptions import *
 from klgists.files import make_dirs, pjoin_sanitized_abs
 from klgists.files.scantree import walk_until
 
+from run_index import RunIndex, Checkpoint, ArchiveDiff, scan_dirs
+
 colorama.init(autoreset=True)
 
 
@@ -24,50 +26,51 @@ class Reindexer:
 		self._overwrite = overwrite
 		self._dry = dry
 
-	def reindex_all(self) -> None:
-		import valarpy.model as model
-		n_reindexed = 0; i = 0
-		for i, match in enumerate(self._query()):
-			n_reindexed += 1
-			self._build_symlinks(match, self._symlink_list_of(match))
-		n_total = len(model.Runs)
-		print(Fore.BLUE + "Reindexed {}/{} runs.".format(n_reindexed, n_total))
+	_store_root = '/shire/store'
+
+	def reindex_all(self, checkpoint_path: Optional[str] = None) -> None:
+		checkpoint = Checkpoint(checkpoint_path)
+		index = RunIndex.load()
+		diff = self.diff(index, checkpoint)
+		existing = diff.existing()
+		last_run_id = checkpoint.get('last_run_id', 0)
+		todo = [r for r in index.runs if r.id > last_run_id]
+		n_reindexed = 0
+		for i, match in enumerate(todo):
+			if match.id in existing:
+				n_reindexed += 1
+				self._build_symlinks(existing[match.id], self._symlink_list_of(match, index))
+			if i % 100 == 99 or i == len(todo) - 1:
+				checkpoint.set('last_run_id', match.id)
+		checkpoint.finish()
+		print(Fore.BLUE + "Reindexed {}/{} runs.".format(n_reindexed, len(todo)))
+		if len(diff.renames) > 0 or len(diff.orphans) > 0:
+			print(Fore.YELLOW + diff.report())
 
 	def reindex(self, run_id: int) -> None:
-		import valarpy.model as model
-		match = self._query().where(model.Runs.id == run_id).first()
+		index = RunIndex.load(run_ids=[run_id])
+		match = index.by_id.get(run_id)
 		if match is None:
 			raise KeyError("No run with ID {} exists".format(run_id))
-		else:
-			self._build_symlinks(match, self._symlink_list_of(match))
+		elif pexists(self._find(match)):
+			self._build_symlinks(self._find(match), self._symlink_list_of(match, index))
+
+	def diff(self, index: RunIndex, checkpoint: Optional[Checkpoint] = None) -> ArchiveDiff:
+		"""Compares the store (year/month/tag) to where the runs should be."""
+		return ArchiveDiff(index, scan_dirs(self._store_root, 3, checkpoint=checkpoint), self._find)
 
 	def _find(self, match) -> str:
 		year = str(match.datetime_run.year).zfill(4)
 		month = str(match.datetime_run.month).zfill(2)
-		return "/shire/store/{}/{}/{}".format(year, month, match.tag)
+		return "{}/{}/{}/{}".format(self._store_root, year, month, match.tag)
 		#return pjoin('/', 'samba', 'shire', 'store', year, month, match.tag)
 
-	def _query(self) -> peewee.Expression:
-		import valarpy.model as model
-		return (
-			model.Runs
-			.select(model.Runs, model.Experiments, model.Superprojects, model.ProjectTypes, model.Users, model.Submissions, model.Batteries, model.TemplatePlates, model.PlateTypes, model.SauronConfigs, model.Saurons)
-		 	.join(model.Experiments).join(model.Superprojects, model.JOIN.LEFT_OUTER).join(model.ProjectTypes, model.JOIN.LEFT_OUTER)
-			.switch(model.Experiments).join(model.Batteries, model.JOIN.LEFT_OUTER)
-			.switch(model.Experiments).join(model.TemplatePlates, model.JOIN.LEFT_OUTER).join(model.PlateTypes, model.JOIN.LEFT_OUTER)
-			.switch(model.Runs).join(model.SauronConfigs, model.JOIN.LEFT_OUTER).join(model.Saurons)
-		 	.switch(model.Runs).join(model.Users)
-		 	.switch(model.Runs).join(model.Submissions, model.JOIN.LEFT_OUTER)
-		)
-
-	def _symlink_list_of(self, match) -> List[str]:
-		import valarpy.model as model
-
+	def _symlink_list_of(self, match, index: RunIndex) -> List[str]:
 		rid = match.id
 		sid = match.submission_id
-		sauronx_version = model.RunTags.select().where(model.RunTags.run_id == rid).where(model.RunTags.name == 'sauronx_version').first()
-		sauronx_hash = model.RunTags.select().where(model.RunTags.run_id == rid).where(model.RunTags.name == 'sauronx_hash').first()
-		fps = model.RunTags.select().where(model.RunTags.run_id == rid).where(model.RunTags.name == 'video:fps').first()
+		sauronx_version = index.tag(match, 'sauronx_version')
+		sauronx_hash = index.tag(match, 'sauronx_hash')
+		fps = index.tag(match, 'video:fps')
 		year = str(match.datetime_run.year).zfill(4)
 		month = str(year) + '-' + str(match.datetime_run.month).zfill(2)
 		dt_run = match.datetime_run
@@ -122,11 +125,11 @@ class Reindexer:
 				add('projects', 'by-id', superproject.id, t, thing)
 				add('projects', 'by-name', superproject.name, t, thing)
 			if sauronx_version is not None:
-				add('info', 'sauronx-versions', sauronx_version.value, t, thing)
+				add('info', 'sauronx-versions', sauronx_version, t, thing)
 			if sauronx_hash is not None:
-				add('info', 'sauronx-hashes', sauronx_hash.value, t, thing)
+				add('info', 'sauronx-hashes', sauronx_hash, t, thing)
 			if fps is not None and sub is not None:
-				add('info', 'sauronx-framerates', fps.value, t, thing)
+				add('info', 'sauronx-framerates', fps, t, thing)
 			if generation is not None:
 				add('generations', generation, t, thing)
 		# and finally do this for each of the by-xxx:
@@ -166,11 +169,7 @@ class Reindexer:
 			if self._overwrite:
 				self._write_symlink(target, link)
 
-	def _build_symlinks(self, match, symlinks: List[str]) -> None:
-		target = self._find(match)
-		if not pexists(target):
-			#print(Fore.RED + "{} not found".format(match.tag))
-			return
+	def _build_symlinks(self, target: str, symlinks: List[str]) -> None:
 		for link in symlinks:
 			if not os.path.lexists(link):
 				self._build_symlink(target, link)
@@ -181,9 +180,10 @@ if __name__ == '__main__':
 	parser.add_argument("--verbose", action='store_true')
 	parser.add_argument("--dry", action='store_true')
 	parser.add_argument("--overwrite", action='store_true')
+	parser.add_argument("--checkpoint", help="Save progress to this file, and resume from it if it exists")
 	args = parser.parse_args()
 	with Valar() as valar:
-		Reindexer(valar, args.verbose, args.overwrite, args.dry).reindex_all()
+		Reindexer(valar, args.verbose, args.overwrite, args.dry).reindex_all(args.checkpoint)
 
 
 __all__ = ['Reindexer']
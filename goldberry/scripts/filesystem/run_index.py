@@ -0,0 +1,194 @@
+#!/usr/bin/env python3
+"""
+Loads runs, submissions, and run tags in bulk, and compares them to the archive on disk.
+Used by reindex.py and find-orphans.py.
+"""
+import os, json
+from os.path import basename
+from concurrent.futures import ThreadPoolExecutor
+from typing import Optional, Callable, Dict, List, Sequence, Tuple
+
+import peewee
+
+
+class RunIndex:
+	"""
+	Every run with everything reindex.py needs, loaded in two queries instead of several per run:
+	one for the runs (joined with their experiments, submissions, plates, saurons, etc.),
+	and one for the run tags named in ``tag_names``.
+	"""
+
+	tag_names = ('sauronx_version', 'sauronx_hash', 'video:fps')
+
+	def __init__(self, runs: list, tags: Dict[int, Dict[str, str]]) -> None:
+		self.runs = runs
+		self.tags = tags
+		self.by_id = {r.id: r for r in runs}
+		self.by_tag = {r.tag: r for r in runs if r.tag is not None}
+		self.by_hash = {r.submission.lookup_hash: r for r in runs if r.submission is not None}
+
+	@classmethod
+	def load(cls, run_ids: Optional[Sequence[int]] = None) -> 'RunIndex':
+		"""
+		Loads all runs in order of ID, or only the runs in ``run_ids``.
+		"""
+		import valarpy.model as model
+		query = cls.query().order_by(model.Runs.id)
+		tag_query = (
+			model.RunTags.select(model.RunTags.run, model.RunTags.name, model.RunTags.value)
+			.where(model.RunTags.name << list(cls.tag_names))
+		)
+		if run_ids is not None:
+			query = query.where(model.Runs.id << list(run_ids))
+			tag_query = tag_query.where(model.RunTags.run << list(run_ids))
+		runs = list(query)
+		tags = {}  # type: Dict[int, Dict[str, str]]
+		for run_id, name, value in tag_query.tuples():
+			tags.setdefault(run_id, {})[name] = value
+		print("Loaded {} runs and {} tags.".format(len(runs), sum(len(t) for t in tags.values())))
+		return RunIndex(runs, tags)
+
+	@classmethod
+	def query(cls) -> peewee.Expression:
+		import valarpy.model as model
+		PlatePlateTypes = model.PlateTypes.alias()
+		return (
+			model.Runs
+			.select(model.Runs, model.Experiments, model.Superprojects, model.ProjectTypes, model.Users, model.Submissions, model.Batteries, model.TemplatePlates, model.PlateTypes, model.SauronConfigs, model.Saurons, model.Plates, PlatePlateTypes)
+			.join(model.Experiments).join(model.Superprojects, model.JOIN.LEFT_OUTER).join(model.ProjectTypes, model.JOIN.LEFT_OUTER)
+			.switch(model.Experiments).join(model.Batteries, model.JOIN.LEFT_OUTER)
+			.switch(model.Experiments).join(model.TemplatePlates, model.JOIN.LEFT_OUTER).join(model.PlateTypes, model.JOIN.LEFT_OUTER)
+			.switch(model.Runs).join(model.SauronConfigs, model.JOIN.LEFT_OUTER).join(model.Saurons)
+			.switch(model.Runs).join(model.Users)
+			.switch(model.Runs).join(model.Submissions, model.JOIN.LEFT_OUTER)
+			.switch(model.Runs).join(model.Plates).join(PlatePlateTypes, model.JOIN.LEFT_OUTER)
+		)
+
+	def tag(self, run, name: str) -> Optional[str]:
+		return self.tags.get(run.id, {}).get(name)
+
+	def identify(self, path: str):
+		"""
+		Finds the run that a directory in the archive belongs to, or None.
+		Uses the directory name (a run tag), then the ``.id`` file that Goldberry writes,
+		then ``submission_hash.txt``.
+		"""
+		if basename(path) in self.by_tag:
+			return self.by_tag[basename(path)]
+		id_file = os.path.join(path, '.id')
+		if os.path.exists(id_file):
+			with open(id_file) as f:
+				ids = dict(line.strip().split('=', 1) for line in f if '=' in line)
+			if ids.get('runs.id', '').isdigit() and int(ids['runs.id']) in self.by_id:
+				return self.by_id[int(ids['runs.id'])]
+			if ids.get('submissions.lookup_hash') in self.by_hash:
+				return self.by_hash[ids['submissions.lookup_hash']]
+		hash_file = os.path.join(path, 'submission_hash.txt')
+		if os.path.exists(hash_file):
+			with open(hash_file) as f:
+				return self.by_hash.get(f.read().strip())
+		return None
+
+
+class Checkpoint:
+	"""
+	A small JSON file of progress, so that a long job can restart where it stopped.
+	Writes are atomic.
+	"""
+
+	def __init__(self, path: Optional[str]) -> None:
+		self.path = path
+		self.state = {}  # type: Dict[str, object]
+		if path is not None and os.path.exists(path):
+			with open(path) as f:
+				self.state = json.load(f)
+			print("Resuming from checkpoint {}".format(path))
+
+	def get(self, key: str, default=None):
+		return self.state.get(key, default)
+
+	def set(self, key: str, value) -> None:
+		self.state[key] = value
+		if self.path is not None:
+			tmp = self.path + '.tmp'
+			with open(tmp, 'w') as f:
+				json.dump(self.state, f)
+			os.replace(tmp, self.path)
+
+	def finish(self) -> None:
+		if self.path is not None and os.path.exists(self.path):
+			os.remove(self.path)
+
+
+def _subdirs(path: str) -> List[str]:
+	try:
+		with os.scandir(path) as it:
+			return sorted(e.path for e in it if e.is_dir(follow_symlinks=False))
+	except (FileNotFoundError, PermissionError, NotADirectoryError):
+		return []
+
+
+def scan_dirs(root: str, depth: int, n_workers: int = 16, checkpoint: Optional[Checkpoint] = None) -> List[str]:
+	"""
+	Lists the directories exactly ``depth`` levels under ``root``, listing up to ``n_workers`` directories at once.
+	Listings are slow on network filesystems, so listing them concurrently is much faster than ``os.walk``.
+	With a checkpoint, the listings of the last level are saved as they finish, and not repeated on restart.
+	"""
+	listed = {} if checkpoint is None else dict(checkpoint.get('listed', {}))
+	level = [root]
+	with ThreadPoolExecutor(max_workers=n_workers) as executor:
+		for i in range(depth):
+			if i < depth - 1:
+				level = [c for children in executor.map(_subdirs, level) for c in children]
+				continue
+			todo = [p for p in level if p not in listed]
+			for n, (parent, children) in enumerate(zip(todo, executor.map(_subdirs, todo))):
+				listed[parent] = children
+				if checkpoint is not None and (n % 20 == 19 or n == len(todo) - 1):
+					checkpoint.set('listed', listed)
+			level = [c for p in level for c in listed[p]]
+	return level
+
+
+class ArchiveDiff:
+	"""
+	How the directories in the archive differ from where the runs should be.
+
+	Attributes:
+		ok: (run, path) pairs where the directory is where it should be
+		renames: (run, found path, expected path) for directories of known runs in the wrong place
+		orphans: Directories that don't belong to any run
+		missing: Runs without a directory
+	"""
+
+	def __init__(self, index: RunIndex, found: Sequence[str], expected: Callable[[object], str]) -> None:
+		self.ok = []  # type: List[Tuple[object, str]]
+		self.renames = []  # type: List[Tuple[object, str, str]]
+		self.orphans = []  # type: List[str]
+		seen = set()
+		for path in found:
+			run = index.identify(path)
+			if run is None:
+				self.orphans.append(path)
+			elif os.path.normpath(path) == os.path.normpath(expected(run)):
+				self.ok.append((run, path))
+				seen.add(run.id)
+			else:
+				self.renames.append((run, path, expected(run)))
+				seen.add(run.id)
+		self.missing = [r for r in index.runs if r.id not in seen]
+
+	def existing(self) -> Dict[int, str]:
+		"""Maps run IDs to the directories that are where they should be."""
+		return {run.id: path for run, path in self.ok}
+
+	def report(self) -> str:
+		lines = ['mv {} {}  # r{}'.format(found, expected, run.id) for run, found, expected in self.renames]
+		lines += ['? {}'.format(path) for path in self.orphans]
+		lines.append("{} ok, {} to rename, {} orphaned, {} runs without directories".format(
+			len(self.ok), len(self.renames), len(self.orphans), len(self.missing)
+		))
+		return '\n'.join(lines)
+
+
+__all__ = ['RunIndex', 'Checkpoint', 'ArchiveDiff', 'scan_dirs']
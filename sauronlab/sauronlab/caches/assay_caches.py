@@ -47,7 +47,7 @@ class AssayFrameCache(AAssayCache):
     @abcd.overrides
     def load(self, battery: BatteryLike) -> AssayFrame:
         battery = Batteries.fetch(battery)
-        self.download(battery)
+        self._catalogued(battery)
         return AssayFrame.read_feather(self.path_of(battery.id))
 
     @abcd.overrides
@@ -33,7 +33,7 @@ class AudioStimulusCache(AnAudioStimulusCache):
     @abcd.overrides
     def load(self, stimulus: StimulusLike) -> Path:
         stimulus = Stimuli.fetch(stimulus)
-        self.download(stimulus)
+        self._catalogued(stimulus)
         return self.path_of(stimulus)
 
     @abcd.overrides
@@ -1,5 +1,6 @@
 from sauronlab.caches.caching_wfs import *
 from sauronlab.caches.sensor_caches import *
+from sauronlab.caches.shared_frames import SharedFrames
 from sauronlab.caches.wf_caches import *
 from sauronlab.core.core_imports import *
 from sauronlab.model.compound_names import *
@@ -9,40 +10,182 @@ from sauronlab.model.well_names import *
 from sauronlab.model.wf_tools import *
 
 
+@dataclass(frozen=True)
+class DatasetManifest:
+    """
+    What a stored dataset was built from, saved next to it so that it can be refreshed.
+
+    Attributes:
+        as_of: Runs inserted after this were not considered (None if unknown)
+        runs: The IDs of the runs that matched
+        built: When the dataset was last built or refreshed
+    """
+
+    as_of: Optional[datetime]
+    runs: FrozenSet[int]
+    built: datetime
+
+    def to_json(self) -> str:
+        return json.dumps(
+            dict(
+                as_of=None if self.as_of is None else self.as_of.isoformat(),
+                runs=sorted(self.runs),
+                built=self.built.isoformat(),
+            ),
+            indent=2,
+        )
+
+    @classmethod
+    def from_json(cls, text: str) -> DatasetManifest:
+        data = json.loads(text)
+        as_of = data["as_of"]
+        return DatasetManifest(
+            as_of=None if as_of is None else datetime.fromisoformat(as_of),
+            runs=frozenset(data["runs"]),
+            built=datetime.fromisoformat(data["built"]),
+        )
+
+
 class Dataset(metaclass=abc.ABCMeta):
-    """ """
+    """
+    A WellFrame that is built once, stored in ``sauronlab_env.dataset_cache_dir``, and then read.
+    Subclasses that implement ``_matching_runs`` and ``_build``, like those from ``Datasets.create``,
+    can be refreshed incrementally:
+    only new runs are queried, and runs that no longer match are dropped.
+    """
 
-    def fetch(self) -> WellFrame:
-        if self.path.exists():
+    def fetch(self, shared: bool = False) -> WellFrame:
+        """
+        Reads the dataset from the cache, or downloads and stores it.
+
+        Args:
+            shared: If it is cached, attach to a read-only copy in shared memory
+                    (see ``SharedFrames``), publishing it first if no other process has
+        """
+        if shared and self.path.exists():
+            key = SharedFrames.key_for(f"dataset-{self.name.lower()}", self.path.stat().st_mtime_ns)
+            df = SharedFrames().attach_or_publish(key, self.read)
+            how = "Attached shared"
+        elif self.path.exists():
             df = self.read()
             how = "Loaded cached"
         else:
             logger.notice(f"Downloading {self.name}...")
-            df = self._download()
+            df, runs = self._build_all(self.as_of)
+            self.save(df, self.as_of, runs)
             how = "Downloaded"
         logger.notice(
             f"{how} {self.name} w/ {len(df.unique_runs())} runs, {len(df.unique_names())} names, {len(df)} wells."
         )
         return df
 
+    def refresh(self, as_of: Optional[datetime] = None) -> WellFrame:
+        """
+        Adds runs that now match the query and removes those that no longer do.
+        Datasets that can't be refreshed incrementally are rebuilt in full.
+
+        Args:
+            as_of: Consider runs inserted before this time; defaults to a minute ago
+
+        Returns:
+            The refreshed dataset, which is also stored
+        """
+        as_of = datetime.now() - timedelta(minutes=1) if as_of is None else as_of
+        manifest = self.manifest
+        if not self.is_incremental or manifest is None or not self.path.exists():
+            logger.notice(f"Rebuilding {self.name} in full...")
+            as_of = as_of if self.is_incremental else self.as_of
+            df, runs = self._build_all(as_of)
+            self.save(df, as_of, runs)
+            return df
+        t0 = time.monotonic()
+        current = set(self._matching_runs(as_of))
+        added, removed = current - manifest.runs, manifest.runs - current
+        df = self.read()
+        if len(removed) > 0:
+            df = df.without_run(removed)
+        if len(added) > 0:
+            df = WellFrame.concat(df, self._build(added, as_of)).sort_standard()
+        self.save(df, as_of, current)
+        logger.notice(
+            f"Refreshed {self.name}: added {len(added)} and removed {len(removed)} runs"
+            f" in {round(time.monotonic() - t0, 1)}s"
+        )
+        return df
+
+    def _build_all(self, as_of: Optional[datetime]) -> Tup[WellFrame, Set[int]]:
+        """
+        Builds the whole dataset.
+
+        Args:
+            as_of: Consider runs inserted before this time (only if incremental)
+
+        Returns:
+            The dataset and the runs to record in its manifest
+        """
+        if not self.is_incremental:
+            df = self._download()
+            return df, set(df.unique_runs())
+        # record the runs that matched, not those left after subsetting and post-processing,
+        # so that refresh compares like with like
+        runs = self._matching_runs(as_of)
+        return self._build(runs, as_of), runs
+
     def read(self) -> WellFrame:
         df = SerializedWellFrame.read_feather(self.path)
-        return WellFrame.deseralize(WellFrameColumnTools.set_useless_cols(df))
+        return WellFrame.deserialize(WellFrameColumnTools.set_useless_cols(df))
+
+    def save(self, df: WellFrame, as_of: Optional[datetime], runs: Iterable[int]) -> None:
+        """Stores the dataset and its manifest, replacing both atomically."""
+        tmp = self.path.with_name("." + self.path.name + ".tmp")
+        df.serialize().to_feather(str(tmp), version=2, compression="lz4")
+        os.replace(tmp, self.path)
+        manifest = DatasetManifest(as_of, frozenset(int(r) for r in runs), datetime.now())
+        self.manifest_path.write_text(manifest.to_json(), encoding="utf8")
+
+    @property
+    def manifest(self) -> Optional[DatasetManifest]:
+        """The manifest, or None if the dataset was stored without one."""
+        if not self.manifest_path.exists():
+            return None
+        return DatasetManifest.from_json(self.manifest_path.read_text(encoding="utf8"))
 
     @property
     def path(self) -> Path:
         return sauronlab_env.dataset_cache_dir / (self.name.lower() + ".feather")
 
+    @property
+    def manifest_path(self) -> Path:
+        # named after the feather file so they're deleted together
+        return self.path.with_name(self.path.name + ".json")
+
     @property
     @abcd.override_recommended
     def name(self) -> str:
         """ """
         return self.__class__.__name__
 
+    @property
+    def as_of(self) -> Optional[datetime]:
+        """The time before which runs are included in a full build, if fixed."""
+        return None
+
+    @property
+    def is_incremental(self) -> bool:
+        return False
+
     def _download(self):
         """ """
         raise NotImplementedError()
 
+    def _matching_runs(self, as_of: datetime) -> Set[int]:
+        """The IDs of the runs that belong in the dataset."""
+        raise NotImplementedError()
+
+    def _build(self, runs: Iterable[int], as_of: datetime) -> WellFrame:
+        """Builds the part of the dataset for ``runs``."""
+        raise NotImplementedError()
+
 
 class Datasets:
     @classmethod
@@ -55,25 +198,66 @@ class Datasets:
         namer: WellNamer = WellNamers.well(),
         compound_namer: CompoundNamer = CompoundNamers.inchikey(),
         post_process: Optional[Callable[[WellFrame], WellFrame]] = None,
-    ):
+    ) -> Dataset:
+        """
+        Creates a dataset of the wells matching ``wheres``.
+
+        Args:
+            name: A unique name, which determines the filename
+            feature: The feature
+            today: Only include runs inserted before this time (unless refreshed)
+            wheres: Peewee expressions, which can reference any table in a WellFrame query
+            namer: Names the wells
+            compound_namer: Names the compounds
+            post_process: A function applied to the built WellFrame;
+                          with ``refresh``, it is applied to only the new runs,
+                          so it must not depend on other runs
+        """
         sensor_cache = SensorCache()
         cache = WellCache(feature, sensor_cache=sensor_cache)
 
+        def not_trash() -> peewee.Expression:
+            # built only when querying, so that loading a stored dataset never touches Valar
+            trash = [c.id for c in ValarTools.trash_controls()]
+            return Wells.control_type.is_null() | Wells.control_type.not_in(trash)
+
         class X(Dataset):
             @property
             @abcd.overrides
             def name(self) -> str:
                 return name
 
+            @property
+            @abcd.overrides
+            def as_of(self) -> Optional[datetime]:
+                return today
+
+            @property
+            @abcd.overrides
+            def is_incremental(self) -> bool:
+                return True
+
             def _download(self):
+                return self._build(None, today)
+
+            def _matching_runs(self, as_of: datetime) -> Set[int]:
+                query = WellFrameQuery().build([Wells.run_id]).where(not_trash())
+                query = query.where(Runs.created < as_of)
+                for where in wheres:
+                    query = query.where(where)
+                return {run_id for (run_id,) in query.distinct().tuples()}
+
+            def _build(self, runs: Optional[Iterable[int]], as_of: datetime) -> WellFrame:
                 query = (
-                    CachingWellFrameBuilder(cache, today)
+                    CachingWellFrameBuilder(cache, as_of)
                     .with_feature(feature)
                     .with_sensor_cache(sensor_cache)
                     .with_compound_names(compound_namer)
                     .with_names(namer)
-                    .where((~ControlTypes << ValarTools.trash_controls()))
+                    .where(not_trash())
                 )
+                if runs is not None:
+                    query = query.where(Runs.id << set(runs))
                 for where in wheres:
                     query = query.where(where)
                 df = query.build().subset(1, 101998)
@@ -86,4 +270,4 @@ class Datasets:
         return X()
 
 
-__all__ = ["Dataset", "Datasets"]
+__all__ = ["Dataset", "DatasetManifest", "Datasets"]
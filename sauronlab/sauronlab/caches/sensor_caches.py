@@ -103,7 +103,9 @@ class SensorCache(ASensorCache):
         run = Runs.fetch(run)
         for component in sensor_name.components:
             logger.debug(f"Finding component {component} for {sensor_name}, run {run.id}")
+            hit = self.path_of((component, run)).exists()
             self._download_raw(component, run)
+            self._record_access((component, run), hit)
         # okay, now fetch the real one
         if sensor_name.is_audio_waveform:
             return self._load_audio_waveform(run)
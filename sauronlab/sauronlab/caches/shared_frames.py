@@ -0,0 +1,247 @@
+"""
+Read-only WellFrames whose feature blocks live in memory-mapped files,
+so that processes on one host share a single copy in RAM.
+"""
+from __future__ import annotations
+
+import socket
+import weakref
+
+from sauronlab.core.core_imports import *
+from sauronlab.model.well_frames import *
+
+
+class SharedFrames:
+    """
+    Publishes the feature blocks of WellFrames as uncompressed, memory-mapped ``.npy`` files.
+    The first process to need a frame publishes it; the others attach to it.
+    Attaching reads only the small metadata (the index);
+    the features are a read-only ``np.memmap`` whose pages the OS shares between processes.
+    With the default directory in ``/dev/shm``, the file lives in RAM and is never written to disk.
+
+    Each attached process leaves a reference file named after its host and PID in ``<key>.refs``,
+    which is removed when the process exits or the frame is garbage-collected.
+    ``collect`` deletes frames that no live process refers to.
+    It runs before each ``publish``, which also deletes the least recently published unused frames
+    as needed to stay under ``max_bytes`` (``sauronlab_env.shared_frames_max_gb``).
+    If that isn't enough, ``attach_or_publish`` returns the loaded frame without sharing it.
+    ``sauronlab cache collect-shared`` runs ``collect`` by hand.
+
+    Note that the features of an attached WellFrame cannot be modified in place.
+    Methods that return new WellFrames, like ``z_score`` or ``smooth``, work normally (and copy).
+    """
+
+    def __init__(self, directory: Optional[PathLike] = None, max_bytes: Optional[int] = None):
+        """
+        Constructor.
+
+        Args:
+            directory: Where to put the files; defaults to ``sauronlab_env.shared_frames_dir``
+            max_bytes: The most that published frames may take up;
+                       defaults to ``sauronlab_env.shared_frames_max_gb`` (no limit if unset)
+        """
+        self.directory = Tools.prepped_dir(
+            sauronlab_env.shared_frames_dir if directory is None else directory
+        )
+        if max_bytes is None and sauronlab_env.shared_frames_max_gb is not None:
+            max_bytes = int(sauronlab_env.shared_frames_max_gb * 1024 ** 3)
+        self.max_bytes = max_bytes
+        try:
+            # sticky and world-writable, like /tmp, so every user on the host can publish
+            self.directory.chmod(0o1777)
+        except PermissionError:
+            pass
+
+    def attach_or_publish(self, key: str, loader: Callable[[], WellFrame]) -> WellFrame:
+        """
+        Attaches to a frame, or publishes it first if no process has.
+
+        Args:
+            key: A name that identifies the contents exactly;
+                 include anything that could change them, such as source modification times
+            loader: Loads the WellFrame in full; called only if it is not yet published
+
+        Returns:
+            A WellFrame with read-only features,
+            or the loaded WellFrame itself if it doesn't fit under ``max_bytes``
+        """
+        if not self.is_published(key):
+            df = loader()
+            if not self.publish(key, df):
+                return df
+        return self.attach(key)
+
+    def is_published(self, key: str) -> bool:
+        return self._features_path(key).exists()
+
+    def publish(self, key: str, df: WellFrame) -> bool:
+        """
+        Writes the metadata and features of ``df``, first deleting unused frames to make room.
+        Writes go to temporary files that are then renamed,
+        so concurrent publishers of the same key are safe.
+
+        Returns:
+            False, without writing anything, if ``df`` would not fit under ``max_bytes``
+        """
+        self.collect()
+        if not self._make_room(df.values.nbytes):
+            logger.warning(
+                f"Not sharing {key}: {round(df.values.nbytes / 1024 ** 2, 1)} MB would exceed"
+                f" the limit of {round(self.max_bytes / 1024 ** 2, 1)} MB in {self.directory}"
+            )
+            return False
+        t0 = time.monotonic()
+        tmp = f".{socket.gethostname()}-{os.getpid()}.tmp"
+        meta_path, features_path = self._meta_path(key), self._features_path(key)
+        columns_path = self._columns_path(key)
+        WellFrame(df.iloc[:, :0]).serialize().to_feather(str(meta_path) + tmp)
+        with open(str(columns_path) + tmp, "wb") as f:
+            np.save(f, np.asarray(df.columns, dtype=np.int64))
+        values = df.values
+        mm = np.lib.format.open_memmap(
+            str(features_path) + tmp, mode="w+", dtype=values.dtype, shape=values.shape
+        )
+        mm[:] = values
+        mm.flush()
+        del mm
+        os.replace(str(meta_path) + tmp, meta_path)
+        os.replace(str(columns_path) + tmp, columns_path)
+        # the features file is the marker that the frame is complete
+        os.replace(str(features_path) + tmp, features_path)
+        logger.info(
+            f"Published {key} ({round(values.nbytes / 1024 ** 2, 1)} MB)"
+            f" in {round(time.monotonic() - t0, 1)}s"
+        )
+        return True
+
+    def attach(self, key: str) -> WellFrame:
+        """
+        Maps the features of a published frame and reads its metadata.
+
+        Raises:
+            CacheLoadError: If ``key`` is not published
+        """
+        if not self.is_published(key):
+            raise CacheLoadError(f"{key} is not published in {self.directory}")
+        features = np.load(self._features_path(key), mmap_mode="r")
+        meta = WellFrame.deserialize(SerializedWellFrame.read_feather(self._meta_path(key)))
+        columns = pd.Index(np.load(self._columns_path(key)))
+        df = WellFrame(pd.DataFrame(features, index=meta.index, columns=columns, copy=False))
+        ref = self._refs_dir(key) / f"{socket.gethostname()}-{os.getpid()}-{id(features)}"
+        ref.parent.mkdir(parents=True, exist_ok=True)
+        ref.touch()
+        weakref.finalize(features, _unlink_quietly, ref)
+        logger.debug(f"Attached to {key} in {self.directory}")
+        return df
+
+    def keys(self) -> Sequence[str]:
+        paths = self.directory.glob("*.npy")
+        return [p.name[: -len(".npy")] for p in paths if not p.name.endswith(".columns.npy")]
+
+    def n_references(self, key: str) -> int:
+        """Counts the live processes on this host that are attached to ``key``."""
+        return len([r for r in self._refs(key) if self._is_alive(r)])
+
+    def collect(self, min_age_seconds: float = 60) -> Sequence[str]:
+        """
+        Deletes frames that no live process on this host is attached to.
+
+        Args:
+            min_age_seconds: Skip frames published more recently than this,
+                             which a process might be about to attach to
+
+        Returns:
+            The deleted keys
+        """
+        deleted = [k for k in self._unused(min_age_seconds) if self._delete(k)]
+        if len(deleted) > 0:
+            logger.info(f"Deleted {len(deleted)} unused shared frames from {self.directory}")
+        return deleted
+
+    def n_bytes(self, key: str) -> int:
+        paths = [self._features_path(key), self._meta_path(key), self._columns_path(key)]
+        return sum(p.stat().st_size for p in paths if p.exists())
+
+    @classmethod
+    def key_for(cls, prefix: str, *parts: Any) -> str:
+        """Makes a filename-safe key from a readable prefix and a hash of anything else."""
+        prefix = regex.sub(r"[^A-Za-z0-9._()\-]+", "_", prefix, flags=regex.V1)
+        digest = hashlib.sha1(json.dumps([str(p) for p in parts]).encode("utf8")).hexdigest()
+        return f"{prefix}-{digest[:16]}"
+
+    def _make_room(self, n_bytes: int) -> bool:
+        # deletes frames that are unused (but too new for collect), oldest first, until n_bytes fit
+        if self.max_bytes is None:
+            return True
+        used = sum(self.n_bytes(k) for k in self.keys())
+        for key in self._unused(0):
+            if used + n_bytes <= self.max_bytes:
+                break
+            size = self.n_bytes(key)
+            if self._delete(key):
+                used -= size
+        return used + n_bytes <= self.max_bytes
+
+    def _unused(self, min_age_seconds: float) -> Sequence[str]:
+        # unreferenced keys at least min_age_seconds old, oldest first
+        found = []
+        for key in self.keys():
+            try:
+                mtime = self._features_path(key).stat().st_mtime
+            except FileNotFoundError:
+                continue  # deleted by another process
+            if time.time() - mtime >= min_age_seconds and self.n_references(key) == 0:
+                found.append((mtime, key))
+        return [key for _, key in sorted(found)]
+
+    def _delete(self, key: str) -> bool:
+        path = self._features_path(key)
+        if not path.exists():
+            return False
+        for p in [path, self._meta_path(key), self._columns_path(key), *self._refs(key)]:
+            _unlink_quietly(p)
+        try:
+            self._refs_dir(key).rmdir()
+        except OSError:
+            pass
+        return True
+
+    def _refs(self, key: str) -> Sequence[Path]:
+        d = self._refs_dir(key)
+        return list(d.iterdir()) if d.exists() else []
+
+    def _is_alive(self, ref: Path) -> bool:
+        host, pid, _ = ref.name.rsplit("-", 2)
+        if host != socket.gethostname():
+            # can't check; assume it's alive
+            return True
+        try:
+            os.kill(int(pid), 0)
+        except ProcessLookupError:
+            return False
+        except PermissionError:
+            # it exists but belongs to another user
+            return True
+        return True
+
+    def _features_path(self, key: str) -> Path:
+        return self.directory / (key + ".npy")
+
+    def _columns_path(self, key: str) -> Path:
+        return self.directory / (key + ".columns.npy")
+
+    def _meta_path(self, key: str) -> Path:
+        return self.directory / (key + ".meta.feather")
+
+    def _refs_dir(self, key: str) -> Path:
+        return self.directory / (key + ".refs")
+
+
+def _unlink_quietly(path: Path) -> None:
+    try:
+        path.unlink()
+    except OSError:
+        pass
+
+
+__all__ = ["SharedFrames"]
@@ -3,6 +3,7 @@ from __future__ import annotations
 from sauronlab.core.core_imports import *
 from sauronlab.model.audio import Waveform
 from sauronlab.model.cache_interfaces import AStimCache
+from sauronlab.model.compact_stim_frames import CompactStimFrames
 from sauronlab.model.stim_frames import BatteryStimFrame
 
 DEFAULT_UNEXPANDED_CACHE_DIR = sauronlab_env.cache_dir / "batteries" / "unexpanded"
@@ -14,6 +15,8 @@ DEFAULT_EXPANDED_CACHE_DIR = sauronlab_env.cache_dir / "batteries" / "expanded"
 class StimframeCache(AStimCache):
     """
     A cache for BatteryStimFrames.
+    Batteries are stored in the ``CompactStimFrames`` format,
+    so ``load_window`` reads only the milliseconds requested, even for hour-long batteries.
     """
 
     def __init__(
@@ -48,23 +51,48 @@ class StimframeCache(AStimCache):
     def path_of(self, battery: BatteryLike) -> Path:
         if not isinstance(battery, int):  # avoid query
             battery = Batteries.fetch(battery).id
-        return self.cache_dir / (str(battery) + ".feather")
+        return self.cache_dir / (str(battery) + ".stimframes")
 
     @abcd.overrides
     def key_from_path(self, path: PathLike) -> BatteryLike:
         path = Path(path).relative_to(self.cache_dir)
-        return int(regex.compile(r"^([0-9]+)\.csv\.gz", flags=regex.V1).fullmatch(path.name).group(1))
+        match = regex.compile(r"^([0-9]+)\.stimframes", flags=regex.V1).fullmatch(path.name)
+        return None if match is None else int(match.group(1))
 
     @abcd.overrides
     def load(self, battery: BatteryLike) -> BatteryStimFrame:
-        self.download(battery)
+        self._catalogued(battery)
         return self._load(battery)
 
+    @abcd.overrides
+    def load_window(
+        self, battery: BatteryLike, start_ms: Optional[int] = None, end_ms: Optional[int] = None
+    ) -> BatteryStimFrame:
+        """
+        Loads the stimframes between two times, downloading the battery if necessary.
+        This is equivalent to ``load(battery).slice_ms(battery, start_ms, end_ms)``,
+        but reads only the rows in the window.
+
+        Args:
+            battery: A battery name, ID, or instance
+            start_ms: The first millisecond, or None for the start
+            end_ms: The millisecond after the last, or None for the end
+        """
+        battery = Batteries.fetch(battery)
+        self._catalogued(battery)
+        # legacy batteries have a row every 40 ms (25 fps)
+        rows_per_ms = 25 / 1000 if ValarTools.battery_is_legacy(battery) else 1
+        start = None if start_ms is None else int(rows_per_ms * start_ms)
+        end = None if end_ms is None else int(rows_per_ms * end_ms)
+        return self._load(battery, start, end)
+
     @abcd.overrides
     def download(self, *batteries: BatteryLike) -> None:
         for battery in batteries:
             battery = Batteries.fetch(battery)
             is_legacy = ValarTools.battery_is_legacy(battery)
+            if battery not in self and self._convert_legacy_file(battery):
+                continue
             if battery not in self:
                 logger.trace(f"Downloading battery {battery.id} ({battery.name})") #No logging.minor can be found -CH
                 stimframes = BatteryStimFrame.of(battery)
@@ -74,24 +102,38 @@ class StimframeCache(AStimCache):
                 # noinspection PyTypeChecker
                 self._save(battery, stimframes)
 
-    def _load(self, battery: BatteryLike) -> BatteryStimFrame:
+    def _load(
+        self, battery: BatteryLike, start: Optional[int] = None, end: Optional[int] = None
+    ) -> BatteryStimFrame:
         battery = Batteries.fetch(battery)
         try:
-            logger.debug(f"Loading cached battery battery {battery.id}")
-            df = pd.read_feather(self.path_of(battery.id))
+            logger.debug(f"Loading cached battery battery {battery.id} (rows {start}–{end})")
+            df = CompactStimFrames.read(self.path_of(battery.id), start, end)
         except Exception as e:
             raise CacheLoadError(f"Failed to load stimframes for battery {battery.id}") from e
-        return BatteryStimFrame._gen_from(battery).convert(df)
+        return BatteryStimFrame._gen_from(battery).convert(df.reset_index())
 
     def _save(self, battery, bsf) -> None:
         try:
             with Tools.silenced(no_stderr=True, no_stdout=True):
                 saved_to = self.path_of(battery.id)
                 logger.info(f"Saving battery {battery.id} to {saved_to}")
-                bsf.reset_index().to_feather(str(saved_to))
+                # the row number is the ms, so it isn't stored
+                CompactStimFrames.write(saved_to, bsf.drop(columns=["ms"], errors="ignore"))
         except Exception as e:
             raise XValueError(f"Failed to save stimframes for battery {battery.id}") from e
 
+    def _convert_legacy_file(self, battery: Batteries) -> bool:
+        # batteries used to be stored as feather files; convert them rather than downloading again
+        legacy = self.cache_dir / (str(battery.id) + ".feather")
+        if not legacy.exists():
+            return False
+        logger.debug(f"Converting {legacy} to {self.path_of(battery.id)}")
+        df = pd.read_feather(legacy)
+        self._save(battery, df.set_index("ms") if "ms" in df.columns else df)
+        legacy.unlink()
+        return True
+
     def __repr__(self):
         return f"{type(self).__name__}('{self.cache_dir}'/{self.is_expanded})"
 
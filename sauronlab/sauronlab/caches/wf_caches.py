@@ -2,6 +2,7 @@ from __future__ import annotations
 
 import warnings
 
+from sauronlab.caches.shared_frames import SharedFrames
 from sauronlab.core.core_imports import *
 from sauronlab.model.cache_interfaces import ASensorCache, AWellCache
 from sauronlab.model.features import FeatureType, FeatureTypes
@@ -67,15 +68,34 @@ class WellCache(AWellCache):
         return int(regex.compile(r"^([0-9]+)\.feather", flags=regex.V1).fullmatch(path.name).group(1))
 
     @abcd.overrides
-    def load_multiple(self, runs: RunsLike) -> WellFrame:
+    def load_multiple(self, runs: RunsLike, shared: bool = False) -> WellFrame:
+        """
+        Loads runs, downloading any that are missing.
+
+        Args:
+            runs: Any number of runs
+            shared: Attach to a read-only copy in shared memory (see ``SharedFrames``),
+                    publishing it first if no other process has
+        """
         runs = Tools.runs(runs)
-        self.download(*runs)
-        return WellFrame.concat(*[self.load(r) for r in runs])
+        # keep ``sauronlab cache evict`` away from the runs while they download and are read
+        with self.pinned(runs):
+            self.download(*runs)
+            if shared:
+                paths = [self.path_of(r) for r in runs]
+                feature = "-" if self.feature is None else self.feature.internal_name
+                key = SharedFrames.key_for(
+                    f"wells-{feature}",
+                    self._dtype,
+                    *[(p.name, p.stat().st_mtime_ns) for p in paths],
+                )
+                return SharedFrames().attach_or_publish(key, lambda: self._load(runs))
+            return WellFrame.concat(*[self.load(r) for r in runs])
 
     @abcd.overrides
     def load(self, run: RunLike) -> WellFrame:
         run = Tools.run(run)
-        self.download(run)
+        self._catalogued(run)
         return self._load(run)
 
     @abcd.overrides
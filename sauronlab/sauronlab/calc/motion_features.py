@@ -0,0 +1,358 @@
+"""
+Native calculation of consecutive-frame features (MI and cd(τ)) from SauronX videos or raw frames.
+This replaces the JVM-based ``kokellab.lorien.simple.FeatureProcessor`` for those two features.
+"""
+import subprocess
+
+import joblib
+
+from sauronlab.core.core_imports import *
+
+
+class FrameDecodingError(AlgorithmError):
+    """Frames could not be read from a video or from a raw frames directory."""
+
+
+@dataclass(frozen=True)
+class ConsecutiveFrameFeatureDef:
+    """
+    Defines a feature that is calculated from the absolute differences between consecutive frames.
+
+    Attributes:
+        name: The name in ``valar.features``, such as ``MI`` or ``cd(10)``
+        tau: If None, the feature sums the absolute differences in each ROI (MI);
+             otherwise, it counts the pixels in each ROI whose absolute difference exceeds ``tau``
+    """
+
+    name: str
+    tau: Optional[int]
+
+    @classmethod
+    def of(cls, name: str) -> ConsecutiveFrameFeatureDef:
+        """
+        Parses a feature name such as ``MI`` or ``cd(10)``.
+
+        Raises:
+            UnsupportedOpError: If the feature is not a consecutive-frame feature
+        """
+        if name == "MI":
+            return ConsecutiveFrameFeatureDef(name, None)
+        match = regex.compile(r"^cd\(([0-9]+)\)$", flags=regex.V1).fullmatch(name)
+        if match is None:
+            raise UnsupportedOpError(f"Feature {name} is not a known consecutive-frame feature")
+        return ConsecutiveFrameFeatureDef(name, int(match.group(1)))
+
+    def reduce(self, diffs: np.array) -> np.array:
+        """
+        Converts absolute frame differences into per-pixel contributions.
+
+        Args:
+            diffs: An int16 array of absolute differences
+
+        Returns:
+            An int32 array with the same shape
+        """
+        if self.tau is None:
+            return diffs.astype(np.int32)
+        return (diffs > self.tau).astype(np.int32)
+
+
+class _FrameSource(metaclass=abc.ABCMeta):
+    """A source of 8-bit grayscale frames that can be read from any frame index."""
+
+    def __init__(self, width: int, height: int):
+        self.width, self.height = width, height
+
+    @property
+    def n_frames(self) -> int:
+        raise NotImplementedError()
+
+    def read(self, start: int, stop: int, batch_size: int) -> Iterator[np.array]:
+        """
+        Yields uint8 arrays of shape (≤batch_size, height, width) covering frames ``start`` to ``stop``.
+        """
+        raise NotImplementedError()
+
+
+class RawFrameSource(_FrameSource):
+    """
+    Reads the ``%08d.raw`` frames that SauronX writes before encoding.
+    Each file is a single 8-bit grayscale frame with no header.
+    """
+
+    def __init__(self, directory: PathLike, width: int, height: int):
+        super().__init__(width, height)
+        self.directory = Path(directory)
+        self.files = sorted(p for p in self.directory.iterdir() if p.suffix == ".raw")
+        if len(self.files) == 0:
+            raise FrameDecodingError(f"No raw frames in {self.directory}")
+
+    @property
+    def n_frames(self) -> int:
+        return len(self.files)
+
+    def read(self, start: int, stop: int, batch_size: int) -> Iterator[np.array]:
+        for i in range(start, stop, batch_size):
+            files = self.files[i : min(i + batch_size, stop)]
+            batch = np.empty((len(files), self.height, self.width), dtype=np.uint8)
+            for j, f in enumerate(files):
+                frame = np.fromfile(str(f), dtype=np.uint8)
+                if len(frame) != self.width * self.height:
+                    raise FrameDecodingError(
+                        f"Frame {f} has {len(frame)} bytes; expected {self.width}×{self.height}"
+                    )
+                batch[j] = frame.reshape(self.height, self.width)
+            yield batch
+
+
+class VideoFrameSource(_FrameSource):
+    """
+    Decodes a video (normally the Shire-native HEVC MKV) by piping rawvideo out of ffmpeg.
+    Chunks are located with an input seek, so workers never decode the frames before their chunk.
+    """
+
+    def __init__(self, path: PathLike, fps: int, width: int, height: int, n_frames: int):
+        super().__init__(width, height)
+        self.path = Path(path)
+        self.fps = fps
+        self._n_frames = n_frames
+
+    @classmethod
+    def probe(cls, path: PathLike, fps: int) -> VideoFrameSource:
+        """
+        Creates a VideoFrameSource, getting the dimensions and number of frames with ffprobe.
+        """
+        cmd = [
+            "ffprobe",
+            "-v",
+            "error",
+            "-select_streams",
+            "v:0",
+            "-count_packets",
+            "-show_entries",
+            "stream=width,height,nb_read_packets",
+            "-of",
+            "csv=p=0",
+            str(path),
+        ]
+        try:
+            out = subprocess.run(cmd, check=True, capture_output=True, encoding="utf8").stdout
+            width, height, n_frames = [int(s) for s in out.strip().split(",")[:3]]
+        except (subprocess.CalledProcessError, ValueError) as e:
+            raise FrameDecodingError(f"Could not probe video {path}") from e
+        return VideoFrameSource(path, fps, width, height, n_frames)
+
+    @property
+    def n_frames(self) -> int:
+        return self._n_frames
+
+    def read(self, start: int, stop: int, batch_size: int) -> Iterator[np.array]:
+        frame_bytes = self.width * self.height
+        cmd = ["ffmpeg", "-loglevel", "error", "-nostdin"]
+        if start > 0:
+            # seek to half a frame before the first one we want; accurate seeking discards earlier frames
+            cmd += ["-ss", str((start - 0.5) / self.fps)]
+        cmd += ["-i", str(self.path), "-frames:v", str(stop - start)]
+        cmd += ["-f", "rawvideo", "-pix_fmt", "gray", "pipe:1"]
+        proc = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+        remaining = stop - start
+        try:
+            while remaining > 0:
+                data = proc.stdout.read(min(batch_size, remaining) * frame_bytes)
+                n_read = len(data) // frame_bytes
+                if n_read == 0:
+                    break
+                yield np.frombuffer(data[: n_read * frame_bytes], dtype=np.uint8).reshape(
+                    n_read, self.height, self.width
+                )
+                remaining -= n_read
+        finally:
+            # if the consumer stopped early, don't leave ffmpeg blocked on a full pipe
+            proc.stdout.close()
+            if remaining > 0:
+                proc.kill()
+        err = proc.stderr.read().decode("utf8", errors="replace")
+        if proc.wait() != 0 or remaining > 0:
+            raise FrameDecodingError(
+                f"ffmpeg stopped {remaining} frames early reading {start}–{stop} of {self.path}: {err}"
+            )
+
+
+class MotionFeatureCalculator:
+    """
+    Calculates MI or cd(τ) for every well at once.
+    For each batch of frames, the absolute consecutive differences are reduced to per-pixel values,
+    then summed over every ROI simultaneously using a summed-area table.
+    The frames are split into chunks that are processed in parallel with joblib;
+    each chunk re-reads the frame before it so that its first difference is correct.
+    Like Valar2 features, the value for the first frame is NaN.
+
+    Example:
+        Calculating cd(10) from a video::
+
+            calc = MotionFeatureCalculator.of_run(run, "cd(10)", n_jobs=8)
+            source = VideoFrameSource.probe(video_path, ValarTools.frames_per_second(run))
+            blobs = calc.blobs(calc.calculate(source))
+    """
+
+    def __init__(
+        self,
+        feature: Union[str, ConsecutiveFrameFeatureDef],
+        well_ids: Sequence[int],
+        bounds: np.array,
+        n_jobs: Optional[int] = None,
+        chunk_size: int = 9000,
+        batch_size: int = 64,
+    ):
+        """
+        Constructor.
+
+        Args:
+            feature: A feature name such as ``MI`` or ``cd(10)``
+            well_ids: The ``wells.id`` values, in the order of ``bounds``
+            bounds: An int array of shape (n_wells, 4), with columns x0, y0, x1, y1
+            n_jobs: The number of processes; defaults to ``sauronlab_env.n_cores``
+            chunk_size: The number of frames per parallel job
+            batch_size: The number of frames held in memory at once per job
+        """
+        self.feature = (
+            feature
+            if isinstance(feature, ConsecutiveFrameFeatureDef)
+            else ConsecutiveFrameFeatureDef.of(feature)
+        )
+        self.well_ids = list(well_ids)
+        self.bounds = np.asarray(bounds, dtype=np.int64)
+        if self.bounds.shape != (len(self.well_ids), 4):
+            raise LengthMismatchError(
+                f"{len(self.well_ids)} wells but ROI bounds have shape {self.bounds.shape}"
+            )
+        self.n_jobs = sauronlab_env.n_cores if n_jobs is None else n_jobs
+        self.chunk_size, self.batch_size = chunk_size, batch_size
+
+    @classmethod
+    def of_run(
+        cls, run: RunLike, feature: str, roi_ref: Optional[RefLike] = None, **kwargs
+    ) -> MotionFeatureCalculator:
+        """
+        Creates a calculator using the ROIs of a run's wells.
+
+        Args:
+            run: A run ID, instance, name, tag, or submission hash or instance
+            feature: A feature name such as ``MI`` or ``cd(10)``
+            roi_ref: The ref of the ROIs; defaults to ``hardware:sauronx`` or ``hardware:legacy``
+            kwargs: Passed to the constructor
+        """
+        run = Tools.run(run, join=True)
+        if roi_ref is None:
+            roi_ref = (
+                "hardware:sauronx"
+                if ValarTools.generation_of(run).is_sauronx()
+                else "hardware:legacy"
+            )
+        roi_ref = Refs.fetch(roi_ref)
+        rois = list(
+            Rois.select(Rois, Wells)
+            .join(Wells)
+            .where(Wells.run_id == run.id)
+            .where(Rois.ref_id == roi_ref.id)
+            .order_by(Wells.well_index)
+        )
+        if len(rois) == 0:
+            raise ValarLookupError(f"No ROIs for run r{run.id} with ref {roi_ref.name}")
+        bounds = np.array([[r.x0, r.y0, r.x1, r.y1] for r in rois], dtype=np.int64)
+        return MotionFeatureCalculator(feature, [r.well.id for r in rois], bounds, **kwargs)
+
+    def calculate(self, source: _FrameSource) -> np.array:
+        """
+        Calculates the feature for every well.
+
+        Returns:
+            A float32 array of shape (n_wells, n_frames)
+        """
+        x0, y0, x1, y1 = self.bounds.T
+        too_big = np.any(x1 > source.width) or np.any(y1 > source.height)
+        if too_big or np.any(np.minimum(x0, y0) < 0):
+            raise OutOfRangeError(
+                f"ROIs extend past the {source.width}×{source.height} frame for {self.feature.name}"
+            )
+        n = source.n_frames
+        chunks = [(i, min(i + self.chunk_size, n)) for i in range(0, n, self.chunk_size)]
+        t0 = time.monotonic()
+        results = joblib.Parallel(n_jobs=self.n_jobs)(
+            joblib.delayed(self._calc_chunk)(source, start, stop) for start, stop in chunks
+        )
+        arr = np.concatenate(results, axis=1) if len(results) > 0 else np.empty((len(x0), 0))
+        arr = arr.astype(np.float32)
+        if arr.shape[1] > 0:
+            arr[:, 0] = np.NaN
+        logger.info(
+            f"Calculated {self.feature.name} on {n} frames × {len(self.well_ids)} wells"
+            f" in {round(time.monotonic() - t0, 1)}s"
+        )
+        return arr
+
+    def blobs(self, arr: np.array) -> Mapping[int, bytes]:
+        """
+        Converts the output of ``calculate`` to big-endian float32 blobs for ``well_features.floats``.
+        These are byte-for-byte what ``Tools.signed_floats_to_blob`` produces.
+
+        Returns:
+            A mapping from well IDs to blobs
+        """
+        return {w: arr[i].astype(">f4").tobytes() for i, w in enumerate(self.well_ids)}
+
+    def insert(self, arr: np.array) -> None:
+        """
+        Inserts ``well_features`` rows for the output of ``calculate``, in one transaction.
+        """
+        feature = Features.fetch(self.feature.name)
+        rows = [
+            dict(floats=blob, sha1=hashlib.sha1(blob).digest(), type=feature.id, well=well)
+            for well, blob in self.blobs(arr).items()
+        ]
+        with VALAR.atomic():
+            WellFeatures.insert_many(rows).execute()
+        logger.notice(f"Inserted {self.feature.name} for {len(rows)} wells")
+
+    def _calc_chunk(self, source: _FrameSource, start: int, stop: int) -> np.array:
+        # read one frame before the chunk so that its first difference belongs to this chunk
+        # the very first frame of the video has no difference, so its column is left at 0
+        out = np.zeros((len(self.well_ids), stop - start), dtype=np.int64)
+        col = 0 if start > 0 else 1
+        prev = None
+        for batch in source.read(max(start - 1, 0), stop, self.batch_size):
+            frames = batch if prev is None else np.concatenate([prev[None], batch])
+            if len(frames) > 1:
+                diffs = np.abs(np.diff(frames.astype(np.int16), axis=0))
+                sums = self._roi_sums(self.feature.reduce(diffs))
+                out[:, col : col + sums.shape[1]] = sums
+                col += sums.shape[1]
+            prev = batch[-1]
+        return out
+
+    def _roi_sums(self, values: np.array) -> np.array:
+        """
+        Sums each ROI of each frame with a summed-area table.
+
+        Args:
+            values: An array of shape (n_frames, height, width)
+
+        Returns:
+            An int64 array of shape (n_wells, n_frames)
+        """
+        n, h, w = values.shape
+        table = np.zeros((n, h + 1, w + 1), dtype=np.int64)
+        np.cumsum(values, axis=1, out=table[:, 1:, 1:])
+        np.cumsum(table[:, 1:, 1:], axis=2, out=table[:, 1:, 1:])
+        x0, y0, x1, y1 = self.bounds.T
+        sums = table[:, y1, x1] - table[:, y0, x1] - table[:, y1, x0] + table[:, y0, x0]
+        return sums.T
+
+
+__all__ = [
+    "ConsecutiveFrameFeatureDef",
+    "FrameDecodingError",
+    "MotionFeatureCalculator",
+    "RawFrameSource",
+    "VideoFrameSource",
+]
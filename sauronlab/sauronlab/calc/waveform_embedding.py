@@ -3,7 +3,13 @@ from sauronlab.model.audio import Waveform
 
 
 class WaveformEmbedding:
-    """"""
+    """
+    Embeds standardized audio waveforms into stimframes.
+    Standardized waveforms are cached by stimulus and legacy flag,
+    since every battery with a stimulus embeds the same one.
+    """
+
+    _standardized: Dict[Tup[int, bool], np.array] = {}
 
     @classmethod
     def expand(
@@ -15,42 +21,55 @@ class WaveformEmbedding:
     ) -> np.array:
         """
         Embeds a waveform into a stimframes array.
+        The waveform starts at the first nonzero frame and plays in full.
+        It starts again at the first nonzero frame after it ends, and so on.
+        For block-format audio, this means that it repeats for as long as the block lasts.
+        A waveform that would run past the end of the array is truncated.
 
         Args:
-            stimseries:
-            stim:
-            waveform:
-            is_legacy:
+            stimseries: The stimframes for the stimulus
+            stim: The stimulus
+            waveform: The unstandardized waveform for the stimulus
+            is_legacy: Whether the battery is legacy (25 fps)
 
         Returns:
+            An array with the same length as ``stimseries``
 
         """
         stim = Stimuli.fetch(stim)
         logger.info(f"Expanding audio on {stim.name}{'(legacy)' if is_legacy else ''}")
-        form = (
-            waveform.standardize(50.0, 200.0, ms_freq=ValarTools.LEGACY_STIM_FRAMERATE)
-            if is_legacy
-            else waveform.standardize(50.0, 200.0, ms_freq=1000)
-        )
+        form = cls._standardize(stim, waveform, is_legacy)
         if isinstance(stimseries, pd.Series):
             # https://github.com/numpy/numpy/issues/15555
             # https://github.com/pandas-dev/pandas/issues/35331
             stimseries = stimseries.values
+        n, length = len(stimseries), len(form)
         # noinspection PyTypeChecker
-        starts = np.argwhere(stimseries > 0)
-        built = []
-        # TODO this could definitely be sped up
-        i = 0
-        for start in starts:
-            # if the audio is a block format, start will often be less than i, which is OK
-            if i == 0 or start >= i:
-                if start < i:
-                    raise AlgorithmError(f"Frame {start} went off the edge")
-                built.append(np.zeros(start - i))
-                built.append(form.data)
-                i = start + len(form.data)
-        built.append(np.zeros(len(stimseries) - i))
-        return np.concatenate(built)
+        nonzero = np.flatnonzero(stimseries > 0)
+        # jump from each onset to the first nonzero frame after the waveform ends
+        # this loops once per onset, not once per nonzero frame
+        onsets = []
+        k = 0
+        while length > 0 and k < len(nonzero):
+            onsets.append(nonzero[k])
+            k = np.searchsorted(nonzero, nonzero[k] + length, side="left")
+        # pad the end so that the last waveform can run over, then cut it off
+        built = np.zeros(n + length, dtype=np.result_type(form.dtype, np.float64))
+        for onset in onsets:
+            built[onset : onset + length] = form
+        return built[:n]
+
+    @classmethod
+    def clear_cache(cls) -> None:
+        cls._standardized.clear()
+
+    @classmethod
+    def _standardize(cls, stim: Stimuli, waveform: Waveform, is_legacy: bool) -> np.array:
+        key = (stim.id, is_legacy)
+        if key not in cls._standardized:
+            ms_freq = ValarTools.LEGACY_STIM_FRAMERATE if is_legacy else 1000
+            cls._standardized[key] = waveform.standardize(50.0, 200.0, ms_freq=ms_freq).data
+        return cls._standardized[key]
 
 
 __all__ = ["WaveformEmbedding"]
@@ -3,7 +3,7 @@ import random
 import shutil
 from pathlib import Path
 from subprocess import DEVNULL, check_call
-from typing import List
+from typing import List, Optional, Union
 
 import orjson
 import typer
@@ -12,6 +12,8 @@ from sauronlab.core import SauronlabResources, logger
 
 MAIN_DIR = os.environ.get("SAURONLAB_DIR", Path.home() / ".sauronlab")
 cli = typer.Typer()
+cache_cli = typer.Typer(help="Inspect and trim the on-disk caches")
+cli.add_typer(cache_cli, name="cache")
 
 
 class Installer:
@@ -191,25 +193,160 @@ class Commands:
 
     @staticmethod
     @cli.command()
-    def dl(runs: List[str]) -> None:
+    def dl(runs: List[str], workers: int = typer.Option(4, help="Concurrent downloads")) -> None:
         """
         Downloads runs with videos.
 
         Args:
             runs: Run IDs
+            workers: The maximum number of videos to download at once
 
         """
         from sauronlab.extras.video_caches import VideoCache
 
-        cache = VideoCache()
-        n_exists = sum([not cache.has_video(v) for v in runs])
-        for arg in runs:
-            cache.download(int(arg))
-        logger.notice(f"Downloaded {n_exists} videos.")
+        cache = VideoCache(n_workers=workers)
+        report = cache.prefetch([int(arg) for arg in runs])
+        for run_id, e in report.failed.items():
+            logger.error(f"Failed to download r{run_id}: {e}")
+        if len(report.failed) > 0:
+            raise typer.Exit(1)
+
+    @staticmethod
+    @cli.command()
+    def warm(
+        runs: List[str] = typer.Argument(None, help="Run IDs, tags, or names"),
+        project: str = typer.Option(None, help="A project ID or name"),
+        experiment: str = typer.Option(None, help="An experiment ID or name"),
+        where: str = typer.Option(None, help="A SQL condition on runs, experiments, or projects"),
+        since: str = typer.Option(None, help="Only runs inserted after this ISO datetime"),
+        features: List[str] = typer.Option(["MI"], "--feature", help="Feature internal names"),
+        jobs: int = typer.Option(None, help="Concurrent runs; defaults to n_cores"),
+    ) -> None:
+        """
+        Downloads well, sensor, stimframe, and assay data into the caches.
+
+        Args:
+            runs: Run IDs, tags, or names
+            project: Restrict to a project
+            experiment: Restrict to an experiment
+            where: A SQL condition, such as ``runs.datetime_run > '2020-01-01'``
+            since: Only runs inserted at or after this ISO 8601 datetime
+            features: Features to cache WellFrames for
+            jobs: The maximum number of runs to download at once
+
+        """
+        from datetime import datetime
+
+        from sauronlab.extras.cache_warming import CacheWarmer
+
+        warmer = CacheWarmer(features=features, n_jobs=jobs)
+        if runs:
+            matched = [Commands._id_or_name(r) for r in runs]
+        else:
+            if project is None and experiment is None and where is None and since is None:
+                raise typer.BadParameter("Pass runs, --project, --experiment, --where, or --since")
+            matched = CacheWarmer.runs_matching(
+                project=Commands._id_or_name(project),
+                experiment=Commands._id_or_name(experiment),
+                where=where,
+                since=None if since is None else datetime.fromisoformat(since),
+            )
+        report = warmer.warm(matched)
+        if len(report.failed) > 0 or len(report.failed_batteries) > 0:
+            raise typer.Exit(1)
+
+    @staticmethod
+    @cli.command()
+    def watch(
+        since: str = typer.Option(None, help="Also warm runs inserted from this ISO datetime on"),
+        poll: float = typer.Option(60, help="Seconds between polls"),
+        settle: float = typer.Option(600, help="Minimum age in seconds of a run to warm"),
+        features: List[str] = typer.Option(["MI"], "--feature", help="Feature internal names"),
+        jobs: int = typer.Option(None, help="Concurrent runs; defaults to n_cores"),
+    ) -> None:
+        """
+        Runs until interrupted, warming the caches for new runs as they are inserted.
+
+        Args:
+            since: Start from runs inserted at or after this ISO 8601 datetime instead of now
+            poll: The time to wait between polls
+            settle: The minimum age of a run, to let its insertion finish
+            features: Features to cache WellFrames for
+            jobs: The maximum number of runs to download at once
+
+        """
+        from datetime import datetime
+
+        from sauronlab.extras.cache_warming import CacheWarmer
+
+        warmer = CacheWarmer(features=features, n_jobs=jobs)
+        since = None if since is None else datetime.fromisoformat(since)
+        try:
+            warmer.watch(since=since, poll_seconds=poll, settle_seconds=settle)
+        except KeyboardInterrupt:
+            typer.echo("Stopped watching.")
+
+    @staticmethod
+    def _id_or_name(value: Optional[str]) -> Union[None, int, str]:
+        return int(value) if value is not None and value.isdigit() else value
+
+
+class CacheCommands:
+    @staticmethod
+    @cache_cli.command()
+    def status() -> None:
+        """
+        Shows the size, budget, and hit rate of each cache.
+        """
+        from sauronlab.model.cache_catalog import CacheManager
+
+        typer.echo(CacheManager().report().to_string(index=False))
+
+    @staticmethod
+    @cache_cli.command()
+    def evict(
+        dry_run: bool = typer.Option(False, help="Only list what would be deleted"),
+        max_gb: float = typer.Option(None, help="Override the global budget (cache_max_gb)"),
+    ) -> None:
+        """
+        Deletes the least valuable cached files until every budget is met.
+
+        Args:
+            dry_run: Only list what would be deleted
+            max_gb: Override the global budget
+
+        """
+        from sauronlab.model.cache_catalog import CacheManager
+
+        max_bytes = None if max_gb is None else int(max_gb * 1024 ** 3)
+        evicted = CacheManager(max_bytes=max_bytes).evict(dry=dry_run)
+        for entry in evicted:
+            typer.echo(f"{entry.cache}\t{entry.bytes}\t{entry.path}")
+
+    @staticmethod
+    @cache_cli.command()
+    def unpin() -> None:
+        """
+        Unpins every cached file, making it eligible for eviction again.
+        """
+        from sauronlab.model.cache_catalog import CacheCatalog
+
+        CacheCatalog.default().unpin()
+
+    @staticmethod
+    @cache_cli.command()
+    def collect_shared() -> None:
+        """
+        Deletes shared WellFrames (from ``shared=True``) that no live process is attached to.
+        """
+        from sauronlab.caches.shared_frames import SharedFrames
+
+        for key in SharedFrames().collect():
+            typer.echo(key)
 
 
 if __name__ == "__main__":
     cli()
 
 
-__all__ = ["Commands"]
+__all__ = ["Commands", "CacheCommands"]
@@ -14,6 +14,12 @@ if CONFIG_PATH is None:
 MAIN_DIR.mkdir(parents=True, exist_ok=True)
 
 
+def _default_shared_frames_dir(cache_dir: Path) -> Path:
+    # /dev/shm is backed by RAM on Linux
+    shm = Path("/dev/shm")
+    return shm / "sauronlab" if shm.is_dir() else cache_dir / "shared"
+
+
 def _read_json(path: Path):
     return orjson.loads(path.read_text(encoding="utf8").encode(encoding="utf8"))
 
@@ -53,6 +59,18 @@ class PropSet:
     def int_nullable(self, key: str, fallback: Optional[str] = None) -> Optional[int]:
         return int(self.str_nullable(key, fallback))
 
+    def float_nullable(self, key: str, fallback: Optional[float] = None) -> Optional[float]:
+        value = self._props.get(key, fallback)
+        return None if value is None else float(value)
+
+    def gb_by_name(self, key: str) -> Mapping[str, float]:
+        # a comma-separated list like wells:200,videos:500
+        value = self._props.get(key)
+        if value is None or value.strip() == "":
+            return {}
+        pairs = [s.split(":") for s in value.split(",") if s.strip() != ""]
+        return {k.strip(): float(v) for k, v in pairs}
+
     def bool(self, key: str, fallback: bool) -> bool:
         return CommonTools.parse_bool(self._props.get(key, fallback))
 
@@ -98,6 +116,10 @@ class SauronlabEnvironment:
         - sauronlab_log_level: The log level recommended to be used for logging statements within Sauronlab; set up by jupyter.py
         - global_log_level: The log level recommended to be used for logging statements globally; set up by jupyter.py
         - viz_file: Path to sauronlab-specific visualization options in the style of Matplotlib RC
+        - shared_frames_dir: Where WellFrames loaded with ``shared=True`` are memory-mapped from; defaults to /dev/shm/sauronlab where available, otherwise ~/valar-cache/shared
+        - shared_frames_max_gb: The most that shared WellFrames may take up; unused ones are deleted to make room; no limit by default
+        - cache_max_gb: The maximum total size of the caches, enforced by ``sauronlab cache evict``; no limit by default
+        - cache_budgets_gb: Maximum sizes of individual caches, like ``wells:200,videos:500``; none by default
         - n_cores: Default number of cores for some jobs, including with parallelize()
         - jupyter_template: Path to a Jupyter template text file
 
@@ -122,6 +144,10 @@ class SauronlabEnvironment:
         self.video_cache_dir          = props.dir("video_cache", Path(self.cache_dir, "videos"))
         self.dataset_cache_dir        = props.dir("dataset_cache", Path(self.cache_dir, "datasets"))
         self.shire_path               = props.str_nullable("shire_path", None)
+        self.shared_frames_dir        = props.dir("shared_frames", _default_shared_frames_dir(self.cache_dir))
+        self.shared_frames_max_gb     = props.float_nullable("shared_frames_max_gb", None)
+        self.cache_max_gb             = props.float_nullable("cache_max_gb", None)
+        self.cache_budgets_gb         = props.gb_by_name("cache_budgets_gb")
         self.use_multicore_tsne       = props.bool("multicore_tsne", False)
         self.joblib_compression_level = props.int("joblib_compression_level", 3)
         self.n_cores                  = props.int("n_cores", 1)
@@ -1,5 +1,8 @@
 import argparse
 import traceback
+from concurrent.futures import ThreadPoolExecutor
+
+import joblib
 
 from sauronlab.core.core_imports import *
 from sauronlab.model.concern_rules import *
@@ -13,7 +16,18 @@ from sauronlab.viz.figures import *
 
 @abcd.auto_repr_str()
 class AutoScreenTracer:
-    """"""
+    """
+    Writes plots, scores, and concerns for runs under one directory per run.
+    A run is skipped if its ``.done`` file records the same inputs hash (see ``inputs_hash``).
+    With ``n_jobs > 1``, runs are plotted in separate processes, each with its own Matplotlib state.
+    Otherwise, WellFrames and sensor data for the next ``prefetch_ahead`` runs
+    are downloaded in a background thread.
+    """
+
+    # bump when the artifacts change, so that every run is replotted
+    artifact_version: int = 2
+    # how many runs the download thread may get ahead of plotting, so it can't fill the cache
+    prefetch_ahead: int = 2
 
     def __init__(
         self,
@@ -26,6 +40,7 @@ class AutoScreenTracer:
         path_fn: Callable[[Runs], str] = None,
         saver: Optional[FigureSaver] = None,
         redownload: bool = False,
+        n_jobs: int = 1,
     ):
         """
 
@@ -38,6 +53,8 @@ class AutoScreenTracer:
             path_fn:
             saver:
             redownload:
+            n_jobs: The number of runs to plot in parallel, each in its own process;
+                    runs are prefetched only if this is 1
         """
         self.path = Tools.prepped_dir(path)
         self.redo = redo
@@ -48,6 +65,7 @@ class AutoScreenTracer:
         self.saver._save_under = None
         self.quick = copy(quick)
         self.redownload = redownload
+        self.n_jobs = n_jobs
         if path_fn is None:
             path_fn = lambda run: Path(
                 run.experiment.name.replace(" :: ", "_").replace(":", "_"), run.name
@@ -109,15 +127,72 @@ class AutoScreenTracer:
             control:
 
         """
-        control = None if control is None else ControlTypes.fetch(control)
         runs = self.quick.query_runs(where)
-        logger.notice(f"Plotting {runs} runs...")
-        for run in Tools.loop(runs, logger.info):
-            try:
-                self.plot_run(run, control)
-            except:
-                logger.exception(f"Failed to process run {run.id}")
-        logger.notice(f"Plotted {len(runs)} runs.")
+        self.plot_runs(runs, control)
+
+    def plot_runs(
+        self, runs: RunsLike, control: Union[None, ControlTypes, str, int] = "solvent (-)"
+    ) -> None:
+        """
+        Plots runs that are not already done with the same inputs, ``self.n_jobs`` at a time.
+        Failures are logged (and written to ``.failed``) without stopping the other runs.
+
+        Args:
+            runs:
+            control:
+
+        """
+        control = None if control is None else ControlTypes.fetch(control)
+        runs = Tools.runs(runs)
+        todo = [run for run in runs if self.redo or not self.is_done(run, control)]
+        logger.notice(f"Plotting {len(todo)} runs ({len(runs) - len(todo)} are already done)...")
+        t0 = time.monotonic()
+        if self.n_jobs == 1:
+            failed = self._plot_serially(todo, control)
+        else:
+            control_id = None if control is None else control.id
+            results = joblib.Parallel(n_jobs=self.n_jobs)(
+                joblib.delayed(self._plot_safely)(run.id, control_id) for run in todo
+            )
+            failed = [r for r, ok in zip(todo, results) if not ok]
+        logger.notice(
+            f"Plotted {len(todo) - len(failed)} runs in {round(time.monotonic() - t0, 1)}s."
+            + (f" Failed: {', '.join(f'r{r.id}' for r in failed)}" if len(failed) > 0 else "")
+        )
+
+    def _plot_serially(self, runs: Sequence[Runs], control: Optional[ControlTypes]) -> List[Runs]:
+        failed = []
+        # one thread downloads upcoming runs in order while this one plots
+        with ThreadPoolExecutor(max_workers=1) as executor:
+            ahead = self.prefetch_ahead
+            prefetches = [executor.submit(self._prefetch, run) for run in runs[:ahead]]
+            for i, run in Tools.loop(list(enumerate(runs)), logger.info):
+                if i + ahead < len(runs):
+                    prefetches.append(executor.submit(self._prefetch, runs[i + ahead]))
+                prefetches[i].result()
+                if not self._plot_safely(run, control):
+                    failed.append(run)
+        return failed
+
+    def _plot_safely(self, run: RunLike, control: Union[None, ControlTypes, int]) -> bool:
+        try:
+            self.plot_run(run, control)
+            return True
+        except Exception:
+            logger.exception(f"Failed to process run {Tools.run(run).id}")
+            return False
+
+    def _prefetch(self, run: Runs) -> None:
+        if self.redownload:
+            # plot_run deletes the cached data first
+            return
+        try:
+            self.quick.cache.download(run)
+            sensors = [SensorNames[s] if isinstance(s, str) else s for s in self.plot_sensors]
+            self.quick.sensor_cache.download(*[(s, run) for s in sensors])
+        except Exception:
+            # plot_run will download again and report the error
+            logger.debug(f"Failed to prefetch r{run.id}", exc_info=True)
 
     def plot_run(
         self, run: Runs, control: Union[None, ControlTypes, str, int] = "solvent (-)"
@@ -138,7 +213,7 @@ class AutoScreenTracer:
         path = self.run_path(run)
         path.mkdir(parents=True, exist_ok=True)
         done_path = path / ".done"
-        if done_path.exists() and not self.redo:
+        if not self.redo and self.is_done(run, control):
             logger.info(f"Handling r{run.id}... No need.")
             return
         logger.info(f"Handling r{run.id}...")
@@ -174,7 +249,7 @@ class AutoScreenTracer:
                 self._plot(df, control, path, run)
             ########################
             # we're done with plots
-            self._write_properties(done_path)
+            self._write_properties(done_path, self.inputs_hash(run, control))
             logger.info(f"Done with r{run.id}.")
         except:
             tb = traceback.format_exc()
@@ -257,18 +332,63 @@ class AutoScreenTracer:
         # except Exception:
         #    logger.error("Failed to plot structures", exc_info=True)
 
-    def _write_properties(self, done_path: Path) -> None:
+    def is_done(self, run: Runs, control: Optional[ControlTypes]) -> bool:
+        """
+        Returns whether the run's artifacts were written with the same inputs.
+
+        Args:
+            run: Runs:
+            control:
+
+        Returns:
+
+        """
+        done_path = self.run_path(run) / ".done"
+        if not done_path.exists():
+            return False
+        props = Tools.read_properties_file(str(done_path))
+        return props.get("inputs_hash") == self.inputs_hash(run, control)
+
+    def inputs_hash(self, run: Runs, control: Optional[ControlTypes]) -> str:
+        """
+        A hash of everything that determines a run's artifacts other than the run's data:
+        feature, generation, control, plotted sensors, and metric.
+
+        Args:
+            run: Runs:
+            control:
+
+        Returns:
+            A hex SHA-1 digest
+
+        """
+        # Quick.cache can be None, so use the Quick's own feature
+        inputs = [
+            self.artifact_version,
+            run.id,
+            FeatureTypes.of(self.quick.feature).internal_name,
+            str(self.quick.generation),
+            None if control is None else control.name,
+            self.traces,
+            sorted(str(s) for s in self.plot_sensors),
+            None if self.metric is None else getattr(self.metric, "__qualname__", str(self.metric)),
+        ]
+        return hashlib.sha1(json.dumps(inputs).encode("utf8")).hexdigest()
+
+    def _write_properties(self, done_path: Path, inputs_hash: str) -> None:
         """
 
 
         Args:
             done_path: Path:
+            inputs_hash:
 
         Returns:
 
         """
         Tools.write_properties_file(
             {
+                "inputs_hash": inputs_hash,
                 "sauronlab_version": sauronlab_version,
                 "sauronlab_startup_time": sauronlab_start_time.isoformat(),
                 "current_time": datetime.now().isoformat(),
@@ -313,8 +433,15 @@ class AutoScreenTraces:
         parser.add_argument("--stderr", required=False, action="store_true")
         parser.add_argument("--stdout", required=False, action="store_true")
         parser.add_argument("--redo", required=False, action="store_true")
+        parser.add_argument(
+            "--jobs",
+            required=False,
+            type=int,
+            default=1,
+            help="Runs to plot in parallel processes; upcoming runs are prefetched only with 1",
+        )
         args = parser.parse_args(args)
-        ignore_bids = args.ignore_bids
+        ignore_bids = args.ignore_batches
         q = Quicks.choose(
             args.generation,
             datetime.now(),
@@ -322,7 +449,12 @@ class AutoScreenTraces:
             namer=WellNamers.screening_plate(ignore_bids),
         )
         tracer = AutoScreenTracer(
-            q, args.path, redo=args.redo, traces=args.traces, plot_sensors=args.plot_sensors
+            q,
+            args.path,
+            redo=args.redo,
+            traces=args.traces,
+            plot_sensors=args.plot_sensors,
+            n_jobs=args.jobs,
         )
         tracer.plot_experiment(args.experiment, args.control)
 
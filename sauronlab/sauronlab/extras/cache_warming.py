@@ -0,0 +1,219 @@
+"""
+Pre-populates the well, sensor, stimframe, and assay caches,
+either once or for new runs as they are inserted.
+"""
+from __future__ import annotations
+
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+from sauronlab.caches.assay_caches import AssayFrameCache
+from sauronlab.caches.sensor_caches import SensorCache
+from sauronlab.caches.stim_caches import StimframeCache
+from sauronlab.caches.wf_caches import WellCache
+from sauronlab.core.core_imports import *
+from sauronlab.model.sensor_names import SensorNames
+
+
+@dataclass(frozen=True)
+class WarmingReport:
+    """
+    What a call to ``CacheWarmer.warm`` did.
+
+    Attributes:
+        n_runs: The number of runs that were warmed without errors
+        n_batteries: The number of distinct batteries whose stimframes and assays were warmed
+        failed: Exceptions by run ID
+        failed_batteries: Exceptions by battery ID, from the stimframe and assay caches
+        seconds: The elapsed wall time
+    """
+
+    n_runs: int
+    n_batteries: int
+    failed: Mapping[int, Exception]
+    failed_batteries: Mapping[int, Exception]
+    seconds: float
+
+
+@abcd.auto_repr_str()
+class CacheWarmer:
+    """
+    Downloads everything that an analysis of a set of runs will need into the caches.
+    Each distinct battery is warmed once, concurrently with the runs.
+    Within a run, sensors are downloaded before WellFrames,
+    so interpolated features reuse the timing data instead of racing to fetch it.
+
+    The usage is:
+        warmer = CacheWarmer(features=["MI", "cd(10)-i"], n_jobs=8)
+        warmer.warm(CacheWarmer.runs_matching(project="my project"))
+        warmer.watch()  # runs forever, warming new runs as they are inserted
+    """
+
+    default_sensors: Sequence[SensorNames] = (
+        SensorNames.STIMULUS_MILLIS,
+        SensorNames.CAMERA_MILLIS,
+    )
+
+    def __init__(
+        self,
+        features: Sequence[str] = ("MI",),
+        sensors: Optional[Sequence[SensorNames]] = None,
+        stimframes: bool = True,
+        assays: bool = True,
+        n_jobs: Optional[int] = None,
+    ):
+        """
+        Constructor.
+
+        Args:
+            features: Internal names of features to warm WellCaches for
+            sensors: Sensors to warm; defaults to ``default_sensors``
+            stimframes: Warm the (unexpanded) StimframeCache
+            assays: Warm the AssayFrameCache
+            n_jobs: The maximum number of runs to download at once;
+                    defaults to ``sauronlab_env.n_cores``
+        """
+        self.sensors = self.default_sensors if sensors is None else sensors
+        self.n_jobs = sauronlab_env.n_cores if n_jobs is None else n_jobs
+        self._sensor_cache = SensorCache()
+        self._well_caches = [WellCache(f, sensor_cache=self._sensor_cache) for f in features]
+        self._stim_cache = StimframeCache() if stimframes else None
+        self._assay_cache = AssayFrameCache() if assays else None
+
+    @classmethod
+    def runs_matching(
+        cls,
+        project: Union[None, int, str] = None,
+        experiment: Union[None, int, str] = None,
+        where: Union[None, str, peewee.Expression] = None,
+        since: Optional[datetime] = None,
+    ) -> Sequence[Runs]:
+        """
+        Finds runs by any combination of criteria, oldest first.
+
+        Args:
+            project: A project ID or name
+            experiment: An experiment ID or name
+            where: A peewee expression, or a SQL condition like ``runs.datetime_run > '2020-01-01'``
+            since: Only runs inserted at or after this time
+
+        Returns:
+            The runs, with their experiments and batteries joined
+        """
+        query = (
+            Runs.select(Runs, Experiments, Batteries)
+            .join(Experiments)
+            .join(Batteries)
+            .switch(Experiments)
+            .join(Projects)
+        )
+        if project is not None:
+            query = query.where(Projects.id == Projects.fetch(project).id)
+        if experiment is not None:
+            query = query.where(Experiments.id == Experiments.fetch(experiment).id)
+        if isinstance(where, str):
+            query = query.where(peewee.SQL(where))
+        elif where is not None:
+            query = query.where(where)
+        if since is not None:
+            query = query.where(Runs.created >= since)
+        return list(query.order_by(Runs.created, Runs.id))
+
+    def warm(self, runs: RunsLike) -> WarmingReport:
+        """
+        Downloads everything for ``runs`` that is not already cached.
+        Failures are logged and reported but do not stop the other downloads.
+
+        Args:
+            runs: Any number of runs
+
+        Returns:
+            What was downloaded and what failed
+        """
+        t0 = time.monotonic()
+        runs = Tools.runs(runs)
+        batteries = {r.experiment.battery.id: r.experiment.battery for r in runs}
+        failed, failed_batteries = {}, {}
+        with ThreadPoolExecutor(max_workers=self.n_jobs) as executor:
+            futures = {
+                **{executor.submit(self._warm_battery, b): ("b", b.id) for b in batteries.values()},
+                **{executor.submit(self._warm_run, r): ("r", r.id) for r in runs},
+            }
+            for future in as_completed(futures):
+                kind, key = futures[future]
+                if future.exception() is not None:
+                    (failed if kind == "r" else failed_batteries)[key] = future.exception()
+                    logger.error(f"Failed to warm {kind}{key}: {future.exception()}")
+        n_runs = sum(1 for r in runs if r.id not in failed)
+        report = WarmingReport(
+            n_runs, len(batteries), failed, failed_batteries, time.monotonic() - t0
+        )
+        logger.notice(
+            f"Warmed {n_runs}/{len(runs)} runs and {len(batteries)} batteries"
+            f" in {round(report.seconds, 1)}s"
+        )
+        return report
+
+    def watch(
+        self,
+        since: Optional[datetime] = None,
+        poll_seconds: float = 60,
+        settle_seconds: float = 600,
+        max_attempts: int = 3,
+    ) -> None:
+        """
+        Polls ``Runs.created`` and warms new runs until interrupted.
+        Runs are only picked up once they are ``settle_seconds`` old (by the database's clock),
+        which gives the insertion time to add their wells and sensor data.
+        Runs that fail are retried on later polls, up to ``max_attempts`` times in total.
+
+        Args:
+            since: Warm runs inserted at or after this time; defaults to now
+            poll_seconds: The time to wait between polls
+            settle_seconds: The minimum age of a run before it is warmed
+            max_attempts: The number of times to try a run before giving up on it
+        """
+        watermark = datetime.now() if since is None else since
+        # Runs.created has 1-second resolution, so runs can share the watermark's second;
+        # include that second on every poll and skip the runs from it that were already seen
+        seen: Set[int] = set()
+        retries: Dict[int, int] = {}
+        logger.notice(f"Watching for runs inserted at or after {watermark}")
+        while True:
+            cutoff = peewee.fn.TIMESTAMPADD(
+                peewee.SQL("SECOND"), -int(settle_seconds), peewee.fn.NOW()
+            )
+            new = self.runs_matching(where=Runs.created <= cutoff, since=watermark)
+            new = [r for r in new if r.id not in seen]
+            todo = new + Tools.runs(list(retries.keys()))
+            if len(todo) > 0:
+                report = self.warm(todo)
+                for run in todo:
+                    battery_id = run.experiment.battery_id
+                    if run.id in report.failed or battery_id in report.failed_batteries:
+                        retries[run.id] = retries.get(run.id, 0) + 1
+                        if retries[run.id] >= max_attempts:
+                            logger.error(f"Giving up on r{run.id} after {max_attempts} attempts")
+                            del retries[run.id]
+                    else:
+                        retries.pop(run.id, None)
+            if len(new) > 0:
+                latest = max(r.created for r in new)
+                if latest > watermark:
+                    seen = set()
+                watermark = latest
+                seen.update(r.id for r in new if r.created == latest)
+            time.sleep(poll_seconds)
+
+    def _warm_battery(self, battery: Batteries) -> None:
+        if self._stim_cache is not None:
+            self._stim_cache.download(battery)
+        if self._assay_cache is not None:
+            self._assay_cache.download(battery)
+
+    def _warm_run(self, run: Runs) -> None:
+        self._sensor_cache.download(*[(s, run) for s in self.sensors])
+        for cache in self._well_caches:
+            cache.download(run)
+
+
+__all__ = ["CacheWarmer", "WarmingReport"]
@@ -51,6 +51,12 @@ class OptisepDataset(Dataset, metaclass=abc.ABCMeta):
         self.training_experiment = training_experiment
         self.is_test_set = is_test_set
 
+    @property
+    @abcd.overrides
+    def name(self) -> str:
+        # the train and test sets are stored separately
+        return f"Optisep-{self.training_experiment}-{'test' if self.is_test_set else 'train'}"
+
     @abcd.overrides
     def _download(self):
         """ """
@@ -68,7 +74,7 @@ class OptisepDataset(Dataset, metaclass=abc.ABCMeta):
             .build()
         )
         return Datasets.create(
-            name="QC-OPT",
+            name=self.name + "-full",
             feature=FeatureTypes.cd_10_i,
             wheres=wheres,
             namer=namer,
@@ -141,42 +147,46 @@ class Nt650Flames(Dataset):
 
 
 class SauronlabDatasets:
-    """ """
+    """
+    Reference datasets.
+    Pass ``shared=True`` to attach to a read-only copy in shared memory
+    instead of loading a separate copy (see ``SharedFrames``).
+    """
 
     @classmethod
     @abcd.copy_docstring(LeoDataset1)
-    def leo_biomol(cls) -> WellFrame:
+    def leo_biomol(cls, shared: bool = False) -> WellFrame:
         """ """
-        return LeoDataset1().fetch()
+        return LeoDataset1().fetch(shared=shared)
 
     @classmethod
     @abcd.copy_docstring(Nt650Flames)
-    def nt650_flames(cls) -> WellFrame:
+    def nt650_flames(cls, shared: bool = False) -> WellFrame:
         """ """
-        return Nt650Flames().fetch()
+        return Nt650Flames().fetch(shared=shared)
 
     @classmethod
-    def opti_train_a(cls) -> WellFrame:
+    def opti_train_a(cls, shared: bool = False) -> WellFrame:
         """ """
-        return OptisepDataset(1231, False).fetch()
+        return OptisepDataset(1231, False).fetch(shared=shared)
 
     @classmethod
-    def opti_train_b(cls) -> WellFrame:
+    def opti_train_b(cls, shared: bool = False) -> WellFrame:
         """ """
-        return OptisepDataset(1238, False).fetch()
+        return OptisepDataset(1238, False).fetch(shared=shared)
 
     @classmethod
-    def opti_test_a(cls) -> WellFrame:
+    def opti_test_a(cls, shared: bool = False) -> WellFrame:
         """ """
-        return OptisepDataset(1238, True).fetch()
+        return OptisepDataset(1238, True).fetch(shared=shared)
 
     @classmethod
-    def opti_test_b(cls) -> WellFrame:
+    def opti_test_b(cls, shared: bool = False) -> WellFrame:
         """ """
-        return OptisepDataset(1231, True).fetch()
+        return OptisepDataset(1231, True).fetch(shared=shared)
 
     @classmethod
-    def prestwick_flames(cls) -> WellFrame:
+    def prestwick_flames(cls, shared: bool = False) -> WellFrame:
         today = datetime(2021, 1, 1)
         return Datasets.create(
             name="Prestwick",
@@ -185,10 +195,10 @@ class SauronlabDatasets:
             namer=WellNamers.large_refset(),
             compound_namer=CompoundNamers.chembl(today),
             today=today,
-        ).fetch()
+        ).fetch(shared=shared)
 
     @classmethod
-    def diverset_flames(cls) -> WellFrame:
+    def diverset_flames(cls, shared: bool = False) -> WellFrame:
         today = datetime(2021, 1, 1)
         return Datasets.create(
             name="DIVERSet",
@@ -197,10 +207,10 @@ class SauronlabDatasets:
             namer=WellNamers.large_refset(),
             compound_namer=CompoundNamers.chembl(today),
             today=today,
-        ).fetch()
+        ).fetch(shared=shared)
 
     @classmethod
-    def qc_opt_full(cls) -> WellFrame:
+    def qc_opt_full(cls, shared: bool = False) -> WellFrame:
         """ """
         today = datetime(2019, 9, 1)
         namer = (
@@ -216,10 +226,10 @@ class SauronlabDatasets:
             namer=namer,
             compound_namer=CompoundNamers.tiered(as_of=today),
             today=today,
-        ).fetch()
+        ).fetch(shared=shared)
 
     @classmethod
-    def qc_dr_full(cls) -> WellFrame:
+    def qc_dr_full(cls, shared: bool = False) -> WellFrame:
         """ """
         today = datetime(2019, 9, 1)
         namer = (
@@ -229,17 +239,21 @@ class SauronlabDatasets:
             .build()
         )
         return Datasets.create(
-            name="QC-OPT",
+            name="QC-DR",
             feature=FeatureTypes.cd_10_i,
             wheres=[Experiments.id == 1575, Runs.id != 7034],
             namer=namer,
             compound_namer=CompoundNamers.tiered(as_of=today),
             today=today,
-        ).fetch()
+        ).fetch(shared=shared)
 
     @classmethod
     def _mi_ref(
-        cls, name: str, experiment: int, namer: WellNamer = WellNamers.elegant()
+        cls,
+        name: str,
+        experiment: int,
+        namer: WellNamer = WellNamers.elegant(),
+        shared: bool = False,
     ) -> WellFrame:
         today = datetime(2020, 1, 1)
         return Datasets.create(
@@ -249,50 +263,50 @@ class SauronlabDatasets:
             namer=namer,
             compound_namer=CompoundNamers.tiered(as_of=today),
             today=today,
-        ).fetch()
+        ).fetch(shared=shared)
 
     @classmethod
-    def ref_capria(cls) -> WellFrame:
+    def ref_capria(cls, shared: bool = False) -> WellFrame:
         """"""
-        return cls._mi_ref("capria", 6)
+        return cls._mi_ref("capria", 6, shared=shared)
 
     @classmethod
-    def ref_ashley(cls) -> WellFrame:
+    def ref_ashley(cls, shared: bool = False) -> WellFrame:
         """"""
-        return cls._mi_ref("ashley", 936)
+        return cls._mi_ref("ashley", 936, shared=shared)
 
     @classmethod
-    def ref_matt(cls) -> WellFrame:
+    def ref_matt(cls, shared: bool = False) -> WellFrame:
         """ """
-        return cls._mi_ref("matt", 842)
+        return cls._mi_ref("matt", 842, shared=shared)
 
     @classmethod
-    def hallucinogens(cls) -> WellFrame:
+    def hallucinogens(cls, shared: bool = False) -> WellFrame:
         """ """
-        return cls._mi_ref("hallucinogens", 1037)
+        return cls._mi_ref("hallucinogens", 1037, shared=shared)
 
     @classmethod
-    def cannabinoids_adam(cls) -> WellFrame:
+    def cannabinoids_adam(cls, shared: bool = False) -> WellFrame:
         """ """
-        return cls._mi_ref("cannabinoids-adam", 819)
+        return cls._mi_ref("cannabinoids-adam", 819, shared=shared)
 
     @classmethod
-    def cannabinoids_reid(cls) -> WellFrame:
+    def cannabinoids_reid(cls, shared: bool = False) -> WellFrame:
         """ """
-        return cls._mi_ref("cannabinoids-reid", 1312)
+        return cls._mi_ref("cannabinoids-reid", 1312, shared=shared)
 
     @classmethod
-    def retest_mgh(cls) -> WellFrame:
+    def retest_mgh(cls, shared: bool = False) -> WellFrame:
         """ """
-        return cls._mi_ref("retest-mgh", 1101, namer=WellNamers.large_refset())
+        return cls._mi_ref("retest-mgh", 1101, namer=WellNamers.large_refset(), shared=shared)
 
     @classmethod
-    def screen_mgh_main(cls) -> WellFrame:
+    def screen_mgh_main(cls, shared: bool = False) -> WellFrame:
         """ """
-        return cls._mi_ref("screen-mgh-main", 580, namer=WellNamers.large_refset())
+        return cls._mi_ref("screen-mgh-main", 580, namer=WellNamers.large_refset(), shared=shared)
 
     @classmethod
-    def dmt(cls) -> WellFrame:
+    def dmt(cls, shared: bool = False) -> WellFrame:
         """Experiment 1744 with all concentrations excluding empty wells.."""
         today = datetime(2019, 1, 1)
         compound_namer = CompoundNamers.tiered(as_of=today)
@@ -314,10 +328,10 @@ class SauronlabDatasets:
             namer=namer,
             compound_namer=compound_namer,
             today=today,
-        ).fetch()
+        ).fetch(shared=shared)
 
     @classmethod
-    def dmt_paper(cls) -> WellFrame:
+    def dmt_paper(cls, shared: bool = False) -> WellFrame:
         """
         DMT and isoDMT analogs at 200uM with solvent controls. Experiment 1744 with run ID 7887 dropped.
         Replaces low-volume wells with their intended treatments.
@@ -348,7 +362,7 @@ class SauronlabDatasets:
             namer=namer,
             compound_namer=compound_namer,
             today=today,
-        ).fetch()
+        ).fetch(shared=shared)
 
 
 __all__ = ["SauronlabDatasets", "SauronlabDatasetTools"]
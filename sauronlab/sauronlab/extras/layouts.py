@@ -87,6 +87,9 @@ class LayoutChecker:
 class LayoutParser:
     """"""
 
+    # rows per INSERT or UPDATE statement when writing layouts
+    chunk_size: int = 500
+
     def parse(
         self,
         df: Union[PathLike, pd.DataFrame],
@@ -277,9 +280,11 @@ class LayoutParser:
         description: str,
         plate_type: Union[PlateTypes, int, str],
         whoami: Union[int, str, Users],
+        dry: bool = False,
     ) -> TemplatePlates:
         """
-
+        Inserts a template plate with its wells and treatments in one transaction.
+        All rows are built (and control types resolved) before anything is written.
 
         Args:
             df: LayoutFrame:
@@ -287,6 +292,7 @@ class LayoutParser:
             description: str:
             plate_type:
             whoami:
+            dry: Only build and check the rows; the returned plate is not saved
 
         Returns:
 
@@ -294,31 +300,16 @@ class LayoutParser:
         plate = TemplatePlates(
             name=name, description=description, plate_type=plate_type, author=Users.fetch(whoami)
         )
-        plate.save()
-
-        def nq(q):
-            """"""
-            return "" if Tools.is_empty(q) else q
-
-        for row in df.itertuples():
-            TemplateWells(
-                age_expression=nq(row.dpf),
-                control_type=Tools.or_null(row.control, ControlTypes.fetch),
-                group_expression=nq(row.group),
-                n_expression=nq(row.n),
-                template_plate=plate,
-                variant_expression=nq(row.variant),
-                well_range_expression=row.well,
-            ).save()
-            for batch, dose in self._drugs(df, row):
-                # Only insert templateTreatments if batch and dose are NOT empty.
-                if not (Tools.is_empty(batch)) and not (Tools.is_empty(dose)):
-                    TemplateTreatments(
-                        well_range_expression=nq(row.well),
-                        template_plate=nq(plate),
-                        dose_expression=nq(dose),
-                        batch_expression=nq(batch),
-                    ).save()
+        wells, treatments = self._template_rows(df)
+        if dry:
+            logger.notice(
+                f"Would insert {name} with {len(wells)} wells and {len(treatments)} treatments"
+            )
+            return plate
+        with VALAR.atomic():
+            plate.save()
+            self._insert_template_rows(plate, wells, treatments)
+        logger.notice(f"Inserted {name} with {len(wells)} wells and {len(treatments)} treatments")
         return plate
 
     def update(
@@ -328,9 +319,10 @@ class LayoutParser:
         description: str,
         plate_type: Union[PlateTypes, int, str],
         whoami: Union[int, str, Users],
+        dry: bool = False,
     ) -> TemplatePlates:
         """
-
+        Replaces the wells and treatments of an existing template plate in one transaction.
 
         Args:
             df: LayoutFrame:
@@ -338,48 +330,27 @@ class LayoutParser:
             description: str:
             plate_type:
             whoami:
+            dry: Only build and check the rows
 
         Returns:
 
         """
-        plate = TemplatePlates.select().where(TemplatePlates.name == name).first()
-        TemplatePlates.update(
-            name=name, description=description, plate_type=plate_type, author=Users.fetch(whoami)
-        ).where(TemplatePlates.name == name).execute()
-
-        def nq(q):
-            """"""
-            return "" if Tools.is_empty(q) else q
-
-        ftw_row = TemplateWells.select().where(TemplateWells.template_plate == nq(plate.id)).first()
-        ftt_row = (
-            TemplateTreatments.select()
-            .where(TemplateTreatments.template_plate == nq(plate.id))
-            .first()
-        )
-        for i, row in enumerate(df.itertuples()):
-            TemplateWells.update(
-                age_expression=nq(row.dpf),
-                control_type=None
-                if Tools.is_empty(row.control)
-                else ControlTypes.fetch(row.control),
-                group_expression=nq(row.group),
-                n_expression=nq(row.n),
-                template_plate=nq(plate.id),
-                variant_expression=nq(row.variant),
-                well_range_expression=row.well,
-            ).where(TemplateWells.template_plate == nq(plate.id)).where(
-                TemplateWells.id == ftw_row.id + i
-            ).execute()
-            for batch, dose in self._drugs(df, row):
-                TemplateTreatments.update(
-                    well_range_expression=nq(row.well),
-                    template_plate=nq(plate.id),
-                    dose_expression=nq(dose),
-                    batch_expression=nq(batch),
-                ).where(TemplateTreatments.template_plate == nq(plate.id)).where(
-                    TemplateTreatments.id == ftt_row.id + i
-                ).execute()
+        plate = TemplatePlates.fetch(name)
+        author = Users.fetch(whoami)
+        wells, treatments = self._template_rows(df)
+        if dry:
+            logger.notice(
+                f"Would replace {name} with {len(wells)} wells and {len(treatments)} treatments"
+            )
+            return plate
+        with VALAR.atomic():
+            TemplatePlates.update(
+                name=name, description=description, plate_type=plate_type, author=author
+            ).where(TemplatePlates.id == plate.id).execute()
+            for model in [TemplateTreatments, TemplateWells]:
+                model.delete().where(model.template_plate == plate.id).execute()
+            self._insert_template_rows(plate, wells, treatments)
+        logger.notice(f"Replaced {name} with {len(wells)} wells and {len(treatments)} treatments")
         return plate
 
     def update_run(
@@ -390,7 +361,7 @@ class LayoutParser:
         discard_solvents: bool = False,
     ) -> None:
         """
-
+        Replaces the treatments and updates the wells of a run in one transaction.
 
         Args:
             df: LayoutFrame:
@@ -403,69 +374,159 @@ class LayoutParser:
         run = Tools.run(run)
         plate_type = run.plate.plate_type
         EL = ParsingWB1(plate_type.n_rows, plate_type.n_columns)
-        if not dry:
-            for wt in (
-                WellTreatments.select(WellTreatments, Wells)
-                .join(Wells)
-                .where(Wells.run_id == run.id)
-            ):
-                wt.delete_instance()
-        total_n_wells, total_n_treatments = 0, 0
-        unique_bids, unique_variants, unique_controls, unique_groups, unique_ns = (
-            set(),
-            set(),
-            set(),
-            set(),
-            set(),
-        )
+        wells_by_index = {w.well_index: w for w in Wells.select().where(Wells.run == run)}
+        controls = self._control_types(df)
+        batches = self._batches(df)
+        variants = {
+            v: GeneticVariants.fetch(v)
+            for v in {w.variant_id for w in wells_by_index.values()}
+            if v is not None
+        }
+        solvents = ValarTools.known_solvent_names()
+        wells, treatments = [], []
         for row in df.itertuples():
             n_wells, n_treatments = 0, 0
             for well_index in (EL.label_to_index(w) for w in EL.parse(row.well)):
-                well = (
-                    Wells.select()
-                    .where(Wells.run == run)
-                    .where(Wells.well_index == well_index)
-                    .first()
-                )  # type: Wells
-                well.control_type = Tools.or_null(row.control, ControlTypes.fetch)
-                unique_controls.add(well.control_type)
+                well = wells_by_index[well_index]  # type: Wells
+                well.control_type = Tools.or_null(row.control, controls.get)
                 well.n = Tools.or_null(well.n, int)
-                unique_ns.add(well.n)
-                well.variant = Tools.or_null(well.variant, GeneticVariants.fetch)
-                unique_variants.add(well.variant)
+                well.variant = Tools.or_null(well.variant_id, variants.get)
                 well.well_group = row.group
-                unique_groups.add(well.well_group)
-                if not dry:
-                    well.save()
+                wells.append(well)
                 n_wells += 1
                 for batch_col, dose_col in batch_dose_cols:
-                    batch = Tools.or_null(getattr(row, batch_col), Batches.fetch)
+                    batch = Tools.or_null(getattr(row, batch_col), batches.get)
                     dose = Tools.or_null(getattr(row, dose_col), float)
+                    if batch is None:
+                        continue
                     if (
                         discard_solvents
                         and well.control_type is not None
-                        and batch.compound_id in ValarTools.known_solvent_names().keys()
+                        and batch.compound_id in solvents.keys()
                     ):
                         logger.debug(
-                            f"Skipping solvent {ValarTools.known_solvent_names()[batch.compound_id]} for well {well.id}"
+                            f"Skipping solvent {solvents[batch.compound_id]} for well {well.id}"
                         )
                         continue
-                    unique_bids.add(batch)
                     logger.debug(
                         f"Adding batch {batch} (dose {dose}) for well {well.id} and control type {row.control}"
                     )
-                    wt = WellTreatments(well=well, batch=batch, micromolar_dose=dose)
-                    if not dry:
-                        wt.save()
+                    treatments.append(dict(well=well.id, batch=batch.id, micromolar_dose=dose))
                     n_treatments += 1
-            total_n_wells += n_wells
-            total_n_treatments += n_treatments
             logger.debug(f"Added {n_wells} wells and {n_treatments} treatments for row {row.well}")
+        if not dry:
+            with VALAR.atomic():
+                WellTreatments.delete().where(
+                    WellTreatments.well << [w.id for w in wells_by_index.values()]
+                ).execute()
+                Wells.bulk_update(
+                    wells,
+                    fields=[Wells.control_type, Wells.n, Wells.variant, Wells.well_group],
+                    batch_size=self.chunk_size,
+                )
+                for chunk in peewee.chunked(treatments, self.chunk_size):
+                    WellTreatments.insert_many(chunk).execute()
         logger.notice(
-            f"Added {total_n_wells} total wells and {total_n_treatments} treatments for run r{run.id}"
+            f"Added {len(wells)} total wells and {len(treatments)} treatments for run r{run.id}"
         )
+        unique_bids = {t["batch"] for t in treatments}
         logger.info("Added batch IDs: " + Tools.join(unique_bids, ","))
 
+    def _template_rows(
+        self, df: LayoutFrame
+    ) -> Tup[List[Mapping[str, Any]], List[Mapping[str, Any]]]:
+        """
+        Builds the TemplateWells and TemplateTreatments rows, without a template plate.
+
+        Args:
+            df: LayoutFrame:
+
+        Returns:
+            The wells and the treatments, as dicts of column values
+
+        """
+
+        def nq(q):
+            """"""
+            return "" if Tools.is_empty(q) else q
+
+        controls = self._control_types(df)
+        wells, treatments = [], []
+        for row in df.itertuples():
+            control = Tools.or_null(row.control, controls.get)
+            wells.append(
+                dict(
+                    age_expression=nq(row.dpf),
+                    control_type=None if control is None else control.id,
+                    group_expression=nq(row.group),
+                    n_expression=nq(row.n),
+                    variant_expression=nq(row.variant),
+                    well_range_expression=row.well,
+                )
+            )
+            for batch, dose in self._drugs(df, row):
+                # Only insert templateTreatments if batch and dose are NOT empty.
+                if not (Tools.is_empty(batch)) and not (Tools.is_empty(dose)):
+                    treatments.append(
+                        dict(
+                            well_range_expression=nq(row.well),
+                            dose_expression=nq(dose),
+                            batch_expression=nq(batch),
+                        )
+                    )
+        return wells, treatments
+
+    def _insert_template_rows(
+        self,
+        plate: TemplatePlates,
+        wells: Sequence[Mapping[str, Any]],
+        treatments: Sequence[Mapping[str, Any]],
+    ) -> None:
+        """
+
+
+        Args:
+            plate:
+            wells:
+            treatments:
+
+        """
+        for model, rows in [(TemplateWells, wells), (TemplateTreatments, treatments)]:
+            rows = [{**r, "template_plate": plate.id} for r in rows]
+            for chunk in peewee.chunked(rows, self.chunk_size):
+                model.insert_many(chunk).execute()
+
+    def _control_types(self, df) -> Mapping[str, ControlTypes]:
+        """
+        Fetches each distinct control type in the layout once.
+
+        Args:
+            df:
+
+        Returns:
+
+        """
+        names = {c for c in df["control"] if not Tools.is_empty(c)}
+        return {c: ControlTypes.fetch(c) for c in names}
+
+    def _batches(self, df) -> Mapping[Union[int, str], Batches]:
+        """
+        Fetches each distinct batch in the layout once.
+
+        Args:
+            df:
+
+        Returns:
+
+        """
+        names = {
+            b
+            for _, batch_col, _ in self._drug_cols(df)
+            for b in df[batch_col]
+            if not Tools.is_empty(b)
+        }
+        return {b: Batches.fetch(b) for b in names}
+
 
 class LayoutVisualizer:
     """
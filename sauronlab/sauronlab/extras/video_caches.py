@@ -1,3 +1,7 @@
+import shutil
+import subprocess
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
 from sauronlab.core.core_imports import *
 from sauronlab.extras.addon_tools import AddonTools
 from sauronlab.extras.video_core import VideoCore
@@ -5,6 +9,7 @@ from sauronlab.extras.videos import SauronxVideo, SauronxVideos
 from sauronlab.model.cache_interfaces import AVideoCache
 from os.path import exists
 DEFAULT_SHIRE_STORE = PurePath(sauronlab_env.shire_path) / "store"
+_CHUNK_BYTES = 8 * 1024 * 1024
 
 
 class VideoDownloadError(DownloadError):
@@ -13,6 +18,36 @@ class VideoDownloadError(DownloadError):
     pass
 
 
+class VideoValidationError(VideoDownloadError):
+    """A video's SHA-256 hash does not match its ``.sha256`` file."""
+
+    pass
+
+
+@dataclass(frozen=True)
+class VideoPrefetchReport:
+    """
+    What a call to ``VideoCache.prefetch`` did.
+
+    Attributes:
+        n_downloaded: The number of videos downloaded
+        n_cached: The number of videos that were already in the cache
+        failed: Exceptions raised by failed downloads, by run ID
+        n_bytes: The total size of the downloaded videos
+        seconds: The elapsed wall time
+    """
+
+    n_downloaded: int
+    n_cached: int
+    failed: Mapping[int, Exception]
+    n_bytes: int
+    seconds: float
+
+    @property
+    def mb_per_sec(self) -> float:
+        return self.n_bytes / 1024 ** 2 / max(self.seconds, 1e-6)
+
+
 @abcd.auto_eq()
 @abcd.auto_repr_str()
 class VideoCache(AVideoCache):
@@ -26,6 +61,7 @@ class VideoCache(AVideoCache):
         self,
         cache_dir: PathLike = sauronlab_env.video_cache_dir,
         shire_store: PathLike = DEFAULT_SHIRE_STORE,
+        n_workers: int = 4,
     ):
         """
         Constructor.
@@ -34,10 +70,13 @@ class VideoCache(AVideoCache):
             cache_dir: The directory to save video files under.
             shire_store: The local or remote path to the Shire.
                          If local, will copy the files.
-                         If remote, will download with SCP on Windows and rsync on other systems.
+                         If remote, will download with rsync (resuming partial files),
+                         or with SCP if rsync is not installed.
+            n_workers: The maximum number of videos to download at once
         """
         self._cache_dir = Tools.prepped_dir(cache_dir)
         self.shire_store = PurePath(shire_store)
+        self.n_workers = n_workers
 
     @property
     def cache_dir(self) -> Path:
@@ -88,36 +127,81 @@ class VideoCache(AVideoCache):
             A SauronxVideo
 
         """
-        self.download(run)
+        self._catalogued(run)
         return self._load(run)
 
     @abcd.overrides
     def download(self, *runs: RunLike) -> None:
         """
-
+        Downloads any of the runs' videos that are not already cached, in parallel.
 
         Args:
             *runs: RunLike:
 
+        Raises:
+            VideoDownloadError: If any video failed to download or validate
         """
-        for run in Tools.runs(runs): # in my hands this causes errors because the target runs gets regarded as missing
-        #for run in runs:
-            video_path = self.path_of(run)
-            t0 = time.monotonic()
-            if video_path.exists():
-                logger.debug(f"Run {run.id} is already at {video_path}")
-            else:
-                generation = ValarTools.generation_of(run)
-                logger.trace(
-                    f"Downloading {generation.name} video of r{run.id} to {video_path} ..."
-                )
-                remote_path = self.shire_store / VideoCore.get_remote_path(run)
-                logger.trace(f"got remote path {remote_path}")
-                self._copy_from_shire(remote_path, video_path)
-                # TODO check for properties file
-                logger.notice(
-                    f"Downloaded video of r{run.id}. Took {round(time.monotonic() - t0, 1)}s."
-                )
+        report = self.prefetch(runs)
+        if len(report.failed) > 0:
+            failed = ", ".join(f"r{r}" for r in report.failed.keys())
+            raise VideoDownloadError(
+                f"Failed to download {len(report.failed)} videos: {failed}"
+            ) from next(iter(report.failed.values()))
+
+    def prefetch(self, runs: RunsLike, n_workers: Optional[int] = None) -> VideoPrefetchReport:
+        """
+        Downloads the videos of many runs concurrently, without raising if some fail.
+        Each video is written to a ``.part`` file, checked against the SHA-256 in the Shire's
+        ``.sha256`` file as it streams, and only then renamed into place.
+        A ``.part`` file left by an interrupted download is resumed rather than restarted.
+
+        Args:
+            runs: Any runs
+            n_workers: The maximum number of concurrent downloads; defaults to ``self.n_workers``
+
+        Returns:
+            A VideoPrefetchReport, including throughput and any failures
+        """
+        runs = Tools.runs(runs)
+        n_workers = self.n_workers if n_workers is None else n_workers
+        # resolve paths here; the worker threads shouldn't need the database
+        missing = {
+            run.id: self.shire_store / VideoCore.get_remote_path(run)
+            for run in runs
+            if not self.path_of(run).exists()
+        }
+        n_cached = len({run.id for run in runs}) - len(missing)
+        logger.info(
+            f"Downloading {len(missing)} videos with {n_workers} workers ({n_cached} are cached)"
+        )
+        t0 = time.monotonic()
+        n_bytes, failed = 0, {}
+        with ThreadPoolExecutor(max_workers=n_workers) as executor:
+            futures = {
+                executor.submit(self._fetch, remote_path, self.path_of(run_id)): run_id
+                for run_id, remote_path in missing.items()
+            }
+            for future in as_completed(futures):
+                run_id = futures[future]
+                try:
+                    n_bytes += future.result()
+                except Exception as e:
+                    logger.error(f"Failed to download video of r{run_id}: {e}")
+                    failed[run_id] = e
+        report = VideoPrefetchReport(
+            n_downloaded=len(missing) - len(failed),
+            n_cached=n_cached,
+            failed=failed,
+            n_bytes=n_bytes,
+            seconds=time.monotonic() - t0,
+        )
+        if len(missing) > 0:
+            logger.notice(
+                f"Downloaded {report.n_downloaded} videos ({round(n_bytes / 1024 ** 2, 1)} MB)"
+                f" in {round(report.seconds, 1)}s at {round(report.mb_per_sec, 1)} MB/s."
+                + (f" {len(failed)} failed." if len(failed) > 0 else "")
+            )
+        return report
 
     def _load(self, run: RunLike) -> SauronxVideo:
         """
@@ -134,37 +218,115 @@ class VideoCache(AVideoCache):
 
     def validate(self, run: RunLike) -> None:
         """
-        Raises a HashValidationFailedException if the hash doesn't validate.
+        Raises a VideoValidationError if the hash doesn't validate.
 
         Args:
             run: RunLike:
 
         """
         path = self.path_of(run)
-        if not VideoCore.video_hasher.check_hash(path):
-            pass
-            #raise HashValidationFailedError(f"Video at {path} did not validate") #HashValidationError is an unresolved reference
+        expected = self._read_hash(self._hash_path(path))
+        actual = self._sha256_of(path)
+        if actual != expected:
+            raise VideoValidationError(
+                f"Video at {path} has SHA-256 {actual}, but {expected} was expected"
+            )
 
-    def _copy_from_shire(self, remote_path, local_path) -> None:
+    def _fetch(self, remote_path: PurePath, video_path: Path) -> int:
         """
-
+        Downloads and verifies one video, returning its size in bytes.
 
         Args:
             remote_path:
-            local_path:
+            video_path:
 
         """
+        t0 = time.monotonic()
+        part_path = video_path.with_name(video_path.name + ".part")
+        part_hash_path = self._hash_path(part_path)
+        video_path.parent.mkdir(parents=True, exist_ok=True)
         try:
-            AddonTools.download_file(remote_path, local_path, False)
-            AddonTools.download_file(
-                str(remote_path) + ".sha256", str(local_path) + ".sha256", True
-            )
+            AddonTools.download_file(str(remote_path) + ".sha256", str(part_hash_path), True)
+            expected = self._read_hash(part_hash_path)
+            if Path(remote_path).exists():
+                actual = self._copy_local(Path(remote_path), part_path)
+            else:
+                self._copy_remote(remote_path, part_path)
+                actual = self._sha256_of(part_path)
         except Exception as e:
             raise VideoDownloadError(f"Failed to copy from the Shire at path {remote_path}") from e
-        if not Path(local_path).exists():
-            raise VideoDownloadError(
-                f"Video directory was downloaded to {local_path}, but the video does not exist"
+        if actual != expected:
+            # don't try to resume from a corrupt file
+            part_path.unlink()
+            raise VideoValidationError(
+                f"Video of {remote_path} has SHA-256 {actual}, but {expected} was expected"
             )
+        os.replace(str(part_hash_path), str(self._hash_path(video_path)))
+        os.replace(str(part_path), str(video_path))
+        n_bytes = video_path.stat().st_size
+        logger.debug(
+            f"Downloaded {video_path} ({round(n_bytes / 1024 ** 2, 1)} MB)"
+            f" in {round(time.monotonic() - t0, 1)}s"
+        )
+        return n_bytes
+
+    def _copy_local(self, source: Path, part_path: Path) -> str:
+        """
+        Appends to ``part_path`` from where it left off, hashing as it goes.
+
+        Args:
+            source:
+            part_path:
+
+        Returns:
+            The hex SHA-256 of the complete file
+        """
+        hasher = hashlib.sha256()
+        offset = part_path.stat().st_size if part_path.exists() else 0
+        if offset > source.stat().st_size:
+            part_path.unlink()
+            offset = 0
+        if offset > 0:
+            logger.debug(f"Resuming {part_path} at {offset} bytes")
+            self._update_hash(hasher, part_path)
+        with source.open("rb") as fin, part_path.open("ab") as fout:
+            fin.seek(offset)
+            for chunk in iter(lambda: fin.read(_CHUNK_BYTES), b""):
+                hasher.update(chunk)
+                fout.write(chunk)
+        return hasher.hexdigest()
+
+    def _copy_remote(self, remote_path: PurePath, part_path: Path) -> None:
+        """
+        Downloads with rsync, which resumes ``part_path`` if it exists, or with scp.
+
+        Args:
+            remote_path:
+            part_path:
+
+        """
+        if shutil.which("rsync") is not None:
+            cmd = ["rsync", "-t", "--partial", "--append-verify", str(remote_path), str(part_path)]
+        else:
+            cmd = ["scp", str(remote_path), str(part_path)]
+        subprocess.check_output(cmd, stderr=subprocess.STDOUT)
+
+    def _hash_path(self, path: Path) -> Path:
+        return path.with_name(path.name + ".sha256")
+
+    def _read_hash(self, hash_path: Path) -> str:
+        # either just the hex digest or the sha256sum format: "<digest>  <filename>"
+        return hash_path.read_text(encoding="utf8").split()[0].strip().lower()
+
+    def _sha256_of(self, path: Path) -> str:
+        hasher = hashlib.sha256()
+        self._update_hash(hasher, path)
+        return hasher.hexdigest()
+
+    def _update_hash(self, hasher, path: Path) -> None:
+        with path.open("rb") as f:
+            for chunk in iter(lambda: f.read(_CHUNK_BYTES), b""):
+                hasher.update(chunk)
 
 
-__all__ = ["VideoCache"]
+__all__ = ["VideoCache", "VideoPrefetchReport", "VideoDownloadError", "VideoValidationError"]
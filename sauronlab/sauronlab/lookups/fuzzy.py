@@ -1,21 +1,152 @@
 from __future__ import annotations
 
-from rapidfuzz.process import extract as fuzz_search
-
 from sauronlab.core.core_imports import *
 from sauronlab.lookups import *
 from sauronlab.lookups.lookups import *
 from sauronlab.lookups.mandos import *
-from sauronlab.model.compound_names import TieredCompoundNamer
 
 look = Tools.look
-_users = {u.id: u.username for u in Users.select()}
-_compound_namer = TieredCompoundNamer(max_length=50)
+DEFAULT_CACHE_DIR = sauronlab_env.cache_dir / "fuzzy"
+
+
+@dataclass(frozen=True)
+class _IndexSource:
+    """Where the names for one kind of fuzzy search live in Valar."""
+
+    table: Type[BaseModel]
+    key: peewee.Field
+    name: peewee.Field
+    ref: Optional[peewee.Field] = None
+
+
+class FuzzyNameIndex:
+    """
+    A persisted index of the names that ``Fuzzy`` matches against.
+    Each source (``projects``, ``compounds``, etc.) is stored as a feather file of
+    row ID, key (the ID that the lookup is keyed on), name, and ref ID.
+    On first use in a process, only rows with IDs above the highest cached ID are fetched;
+    if the table then has a different number of rows than the index (from deletions),
+    the source is rebuilt.
+    Renamed rows are only picked up by ``rebuild``.
+    """
+
+    sources: Mapping[str, _IndexSource] = {
+        "projects": _IndexSource(Projects, Projects.id, Projects.name),
+        "experiments": _IndexSource(Experiments, Experiments.id, Experiments.name),
+        "batteries": _IndexSource(Batteries, Batteries.id, Batteries.name),
+        "assays": _IndexSource(Assays, Assays.id, Assays.name),
+        "runs": _IndexSource(Runs, Runs.id, Runs.description),
+        "variants": _IndexSource(GeneticVariants, GeneticVariants.id, GeneticVariants.name),
+        "compounds": _IndexSource(
+            CompoundLabels, CompoundLabels.compound, CompoundLabels.name, CompoundLabels.ref
+        ),
+        "batches": _IndexSource(
+            BatchLabels, BatchLabels.batch, BatchLabels.name, BatchLabels.ref
+        ),
+        "mandos_objects": _IndexSource(
+            MandosObjectTags, MandosObjectTags.object, MandosObjectTags.name, MandosObjectTags.ref
+        ),
+    }
+
+    def __init__(self, cache_dir: PathLike = DEFAULT_CACHE_DIR):
+        self.cache_dir = Path(cache_dir)
+        self._loaded: Dict[str, pd.DataFrame] = {}
+
+    def path_of(self, source: str) -> Path:
+        return self.cache_dir / f"{source}.feather"
+
+    def names(self, source: str, ref: Optional[RefLike] = None) -> pd.DataFrame:
+        """
+        Returns the indexed names for a source, refreshing it first if this is its first use.
+
+        Args:
+            source: A key in ``FuzzyNameIndex.sources``
+            ref: Only include names from this ref (only for sources with refs)
+
+        Returns:
+            A DataFrame with columns ``row_id``, ``key``, ``name``, and ``ref_id``
+        """
+        if source not in self._loaded:
+            self._loaded[source] = self._refresh(source)
+        df = self._loaded[source]
+        if ref is not None:
+            if self.sources[source].ref is None:
+                raise XValueError(f"Fuzzy search on {source} does not support refs")
+            df = df[df["ref_id"] == Refs.fetch(ref).id]
+        return df
+
+    def rebuild(self, source: Optional[str] = None) -> None:
+        """
+        Discards the cached index for one source, or for every source, and fetches it again.
+
+        Args:
+            source: A key in ``FuzzyNameIndex.sources``, or None for all
+        """
+        for s in self.sources.keys() if source is None else [source]:
+            self.path_of(s).unlink(missing_ok=True)
+            self._loaded[s] = self._refresh(s)
+
+    def _refresh(self, source: str) -> pd.DataFrame:
+        src = self.sources[source]
+        path = self.path_of(source)
+        df = pd.read_feather(path) if path.exists() else self._empty()
+        max_id = int(df["row_id"].max()) if len(df) > 0 else 0
+        new = self._fetch(src, src.table.id > max_id)
+        df = pd.concat([df, new], ignore_index=True) if len(new) > 0 else df
+        if len(df) != src.table.select().count():
+            table = src.table.__name__
+            logger.info(f"Rows were deleted from {table}; rebuilding the {source} index")
+            df = self._fetch(src)
+            new = df
+        if len(new) > 0 or not path.exists():
+            logger.debug(f"Indexed {len(new)} new names for {source}; saving to {path}")
+            Tools.prepped_dir(self.cache_dir)
+            df.to_feather(path)
+        return df
+
+    def _fetch(self, src: _IndexSource, *wheres: peewee.Expression) -> pd.DataFrame:
+        ref = src.ref if src.ref is not None else peewee.Value(None)
+        query = src.table.select(src.table.id, src.key, src.name, ref)
+        if len(wheres) > 0:
+            query = query.where(*wheres)
+        rows = list(query.tuples())
+        if len(rows) == 0:
+            return self._empty()
+        df = pd.DataFrame(rows, columns=["row_id", "key", "name", "ref_id"])
+        df["name"] = df["name"].fillna("").astype(str)
+        df["ref_id"] = df["ref_id"].astype("Int64")
+        return df
+
+    def _empty(self) -> pd.DataFrame:
+        return pd.DataFrame(
+            {
+                "row_id": pd.Series([], dtype=np.int64),
+                "key": pd.Series([], dtype=np.int64),
+                "name": pd.Series([], dtype=str),
+                "ref_id": pd.Series([], dtype="Int64"),
+            }
+        )
+
+
+fuzzy_name_index = FuzzyNameIndex()
 
 
 class Fuzzy:
     """Fuzzy matching of labels for compounds, batches, and mandos objects."""
 
+    @classmethod
+    def _match(
+        cls, source: str, s: str, ref: Optional[RefLike], min_score: int, limit: Optional[int]
+    ) -> Tup[Mapping[int, str], Mapping[str, float]]:
+        # rapidfuzz is optional, so only import it when searching
+        from rapidfuzz.process import extract as fuzz_search
+
+        data = fuzzy_name_index.names(source, ref)
+        raw = fuzz_search(s, set(data["name"]), limit=limit)
+        matches = {name: score for name, score, *_ in raw if score >= min_score}
+        found = data[data["name"].isin(matches.keys())]
+        return dict(zip(found["key"].tolist(), found["name"].tolist())), matches
+
     @classmethod
     def projects(
         cls, s: str, ref: Optional[RefLike] = None, min_score: int = 75, limit: int = 100
@@ -33,11 +164,7 @@ class Fuzzy:
 
         """
         logger.debug(f"Searching project names for '{s}'...")
-        query = Projects.select()
-        data = list(query)
-        raw = fuzz_search(s, {x.name for x in data}, limit=limit)
-        matches = {name: score for name, score in raw if score >= min_score}
-        projects = {x.id: x.name for x in data if x.name in matches.keys()}
+        projects, matches = cls._match("projects", s, None, min_score, limit)
         logger.debug(f"Done. Found {len(projects)} projects.")
         df = Lookups.projects(Projects.id << set(projects.keys()))
         df["name"] = df["id"].map(projects.get)
@@ -62,11 +189,7 @@ class Fuzzy:
 
         """
         logger.debug(f"Searching experiment names for '{s}'...")
-        query = Experiments.select()
-        data = list(query)
-        raw = fuzz_search(s, {x.name for x in data}, limit=limit)
-        matches = {name: score for name, score in raw if score >= min_score}
-        experiments = {x.id: x.name for x in data if x.name in matches.keys()}
+        experiments, matches = cls._match("experiments", s, None, min_score, limit)
         logger.debug(f"Done. Found {len(experiments)} experiments.")
         df = Lookups.experiments(Experiments.id << set(experiments.keys()))
         df["name"] = df["id"].map(experiments.get)
@@ -91,11 +214,7 @@ class Fuzzy:
 
         """
         logger.debug(f"Searching batteries for '{s}'...")
-        query = Batteries.select()
-        data = list(query)
-        raw = fuzz_search(s, {x.name for x in data}, limit=limit)
-        matches = {name: score for name, score in raw if score >= min_score}
-        batteries = {x.id: x.name for x in data if x.name in matches.keys()}
+        batteries, matches = cls._match("batteries", s, None, min_score, limit)
         logger.debug(f"Done. Found {len(batteries)} rows.")
         df = Lookups.batteries(Batteries.id << set(batteries.keys()))
         df["name"] = df["id"].map(batteries.get)
@@ -120,11 +239,7 @@ class Fuzzy:
 
         """
         logger.debug(f"Searching assays for '{s}'...")
-        query = Assays.select()
-        data = list(query)
-        raw = fuzz_search(s, {x.name for x in data}, limit=limit)
-        matches = {name: score for name, score in raw if score >= min_score}
-        assays = {x.id: x.name for x in data if x.name in matches.keys()}
+        assays, matches = cls._match("assays", s, None, min_score, limit)
         logger.debug(f"Done. Found {len(assays)} rows.")
         df = Lookups.assays(Assays.id << set(assays.keys()))
         df["name"] = df["id"].map(assays.get)
@@ -149,11 +264,7 @@ class Fuzzy:
 
         """
         logger.debug(f"Searching run descriptions for '{s}'...")
-        query = Runs.select()
-        data = list(query)
-        raw = fuzz_search(s, {x.description for x in data}, limit=limit)
-        matches = {name: score for name, score in raw if score >= min_score}
-        runs = {x.id: x.description for x in data if x.description in matches.keys()}
+        runs, matches = cls._match("runs", s, None, min_score, limit)
         logger.debug(f"Done. Found {len(runs)} rows.")
         df = Lookups.runs(Runs.id << set(runs.keys()))
         df["name"] = df["id"].map(runs.get)
@@ -178,11 +289,7 @@ class Fuzzy:
 
         """
         logger.debug(f"Searching variant names for '{s}'...")
-        query = GeneticVariants.select()
-        data = list(query)
-        raw = fuzz_search(s, {x.name for x in data}, limit=limit)
-        matches = {name: score for name, score in raw if score >= min_score}
-        variants = {x.id: x.name for x in data if x.name in matches.keys()}
+        variants, matches = cls._match("variants", s, None, min_score, limit)
         logger.debug(f"Done. Found {len(variants)} rows.")
         df = Lookups.variants(variants.keys())
         df["name"] = df["id"].map(variants.get)
@@ -207,13 +314,7 @@ class Fuzzy:
 
         """
         logger.debug(f"Searching compound labels for '{s}'...")
-        query = CompoundLabels.select()
-        if ref is not None:
-            query = query.where(CompoundLabels.ref_id == Refs.fetch(ref).id)
-        data = list(query)
-        raw = fuzz_search(s, {x.name for x in data}, limit=limit)
-        matches = {name: score for name, score in raw if score >= min_score}
-        compounds = {x.compound_id: x.name for x in data if x.name in matches.keys()}
+        compounds, matches = cls._match("compounds", s, ref, min_score, limit)
         logger.debug(f"Done. Found {len(compounds)} rows.")
         df = Lookups.compounds(compounds.keys())
         df["name"] = df["id"].map(compounds.get)
@@ -238,13 +339,7 @@ class Fuzzy:
 
         """
         logger.debug(f"Searching batch labels for '{s}'...")
-        query = BatchLabels.select()
-        if ref is not None:
-            query = query.where(BatchLabels.ref_id == Refs.fetch(ref).id)
-        data = list(query)
-        raw = fuzz_search(s, {x.name for x in data}, limit=limit)
-        matches = {name: score for name, score in raw if score >= min_score}
-        batches = {x.batch_id: x.name for x in data if x.name in matches.keys()}
+        batches, matches = cls._match("batches", s, ref, min_score, limit)
         logger.debug(f"Done. Found {len(batches)} rows.")
         df = Lookups.batches(batches.keys())
         df["name"] = df["id"].map(batches.get)
@@ -268,14 +363,8 @@ class Fuzzy:
         Returns:
 
         """
-        logger.debug("Searching mandos_object_tags for '{s}'...")
-        query = MandosObjectTags.select()
-        if ref is not None:
-            query = query.where(MandosObjectTags.ref_id == Refs.fetch(ref).id)
-        data = list(query)
-        raw = fuzz_search(s, {x.name for x in data}, limit=limit)
-        matches = {name: score for name, score in raw if score >= min_score}
-        objects = {x.object_id: x.name for x in data if x.name in matches.keys()}
+        logger.debug(f"Searching mandos_object_tags for '{s}'...")
+        objects, matches = cls._match("mandos_objects", s, ref, min_score, limit)
         logger.debug(f"Done. Found {len(objects)} rows.")
         df = MandosLookups.objects(objects.keys())
         df["name"] = df["id"].map(objects.get)
@@ -284,4 +373,4 @@ class Fuzzy:
         return Lookup(df)
 
 
-__all__ = ["Fuzzy"]
+__all__ = ["Fuzzy", "FuzzyNameIndex", "fuzzy_name_index"]
@@ -5,8 +5,15 @@ from sauronlab.lookups import *
 from sauronlab.model.compound_names import TieredCompoundNamer
 
 look = Tools.look
-_users = {u.id: u.username for u in Users.select()}
-_compound_namer = TieredCompoundNamer(max_length=50)
+_compound_namer: Optional[TieredCompoundNamer] = None
+
+
+def _get_compound_namer() -> TieredCompoundNamer:
+    # built on first use because it queries Valar for its refs
+    global _compound_namer
+    if _compound_namer is None:
+        _compound_namer = TieredCompoundNamer(max_length=50)
+    return _compound_namer
 
 
 @abcd.external
@@ -1513,7 +1520,7 @@ class Lookups(LookupTool):
             all_ids = {
                 int(c) for c in df[id_col].unique().tolist() if not Tools.is_null(c) and c != ""
             }
-            names = _compound_namer.fetch(all_ids)
+            names = _get_compound_namer().fetch(all_ids)
             df["best_name"] = df[id_col].map(lambda x: names[x] if x in names else None)
         else:
             df["best_name"] = []
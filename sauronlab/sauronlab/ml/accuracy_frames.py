@@ -123,35 +123,32 @@ class AccuracyFrame(ScoreFrameWithPrediction):
             self.summarize(ci=ci, center_fn=np.median, boot=boot), renamer=renamer
         )
 
-    def boot_mean(self, b: int, q: float = 0.95) -> BaseScoreFrame:
+    def boot_mean(self, b: int, q: float = 0.95, seed: int = 0, n_jobs: int = 1) -> BaseScoreFrame:
         """
         Calculates a confidence interval of the mean from bootstrap over the wells (single rows).
+        Rows are resampled within each label (see ``Bootstrapper``).
 
         Args:
             b: The number of bootstrap samples
             q: The high quantile, between 0 and 1.
+            seed: The random seed
+            n_jobs: The number of processes to bootstrap labels with
 
         Returns:
-            A DataFrame with columns 'label', 'lower', and 'upper'.
+            A DataFrame with columns 'label', 'score' (the mean), 'lower', and 'upper'.
 
         """
-        data = []
-        for repeat in range(b):
-            samples = self.sample(len(self), replace=True)
-            data.append(samples.groupby("label")[["score"]].mean().reset_index())
-        upper = (
-            AccuracyFrame(pd.concat(data))
-            .groupby("label")
-            .quantile(q)
-            .rename(columns={"label": "upper"})["upper"],
+        bounds = Bootstrapper(b, seed=seed, n_jobs=n_jobs).quantiles_by(
+            self, "label", "score", [1 - q, q]
         )
-        lower = (
-            AccuracyFrame(pd.concat(data))
-            .groupby("label")
-            .quantile(1 - q)
-            .rename(columns={"label": "lower"})["lower"]
+        df = pd.DataFrame(
+            {
+                "score": self.groupby("label")["score"].mean(),
+                "lower": bounds[0],
+                "upper": bounds[1],
+            }
         )
-        return BaseScoreFrame(pd.merge(upper, lower, left_index=True, right_index=True))
+        return BaseScoreFrame(df.reset_index())
 
 
 __all__ = ["AccuracyFrame"]
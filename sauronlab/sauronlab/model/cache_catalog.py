@@ -0,0 +1,407 @@
+"""
+A persistent record of what is in the on-disk caches, and eviction to keep them under a size budget.
+"""
+from __future__ import annotations
+
+import socket
+import sqlite3
+import uuid
+
+from sauronlab.core.core_imports import *
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS entries (
+    path TEXT PRIMARY KEY,
+    cache TEXT NOT NULL,
+    bytes INTEGER NOT NULL,
+    created REAL NOT NULL,
+    last_access REAL NOT NULL,
+    n_hits INTEGER NOT NULL DEFAULT 0
+);
+CREATE INDEX IF NOT EXISTS entries_cache_access ON entries (cache, last_access);
+CREATE TABLE IF NOT EXISTS pins (
+    path TEXT NOT NULL,
+    token TEXT NOT NULL,
+    host TEXT NOT NULL,
+    pid INTEGER NOT NULL,
+    until REAL NOT NULL,
+    PRIMARY KEY (path, token)
+);
+CREATE TABLE IF NOT EXISTS stats (
+    cache TEXT PRIMARY KEY,
+    hits INTEGER NOT NULL DEFAULT 0,
+    misses INTEGER NOT NULL DEFAULT 0
+);
+"""
+
+
+@dataclass(frozen=True)
+class CacheEntry:
+    """
+    One file in a cache.
+
+    Attributes:
+        path: The absolute path
+        cache: The name of the cache (the directory under ``sauronlab_env.cache_dir``)
+        bytes: The size when last recorded
+        created: When it was added (seconds since the epoch)
+        last_access: When it was last loaded (seconds since the epoch)
+        n_hits: The number of times it was loaded without downloading
+        pinned_until: Never evict before this time (seconds since the epoch),
+                      the latest among the pins of live processes
+    """
+
+    path: Path
+    cache: str
+    bytes: int
+    created: float
+    last_access: float
+    n_hits: int
+    pinned_until: float
+
+    @property
+    def is_pinned(self) -> bool:
+        return self.pinned_until > time.time()
+
+
+class CacheCatalog:
+    """
+    A small SQLite database of cache files, with their sizes and access times, and hits and misses.
+    Caches record each load here (see ``ASauronlabCache``).
+    Files that were added without a load, such as by ``download``, are picked up by ``sync``.
+    Each ``pin`` is separate, so a process that unpins can't unpin files that another is still
+    using; a pin lapses when it expires or its process (on this host) exits.
+    The catalog is only advisory: errors writing to it are logged and otherwise ignored.
+    """
+
+    _default: Optional[CacheCatalog] = None
+
+    def __init__(self, path: PathLike):
+        self.path = Path(path)
+        self._initialized = False
+
+    @classmethod
+    def default(cls) -> CacheCatalog:
+        """The catalog at ``catalog.sqlite`` in ``sauronlab_env.cache_dir``."""
+        if cls._default is None:
+            cls._default = CacheCatalog(sauronlab_env.cache_dir / "catalog.sqlite")
+        return cls._default
+
+    @classmethod
+    def name_of(cls, cache_dir: PathLike) -> str:
+        """
+        Gets the name that files in a cache directory are catalogued under:
+        its top-level directory under ``sauronlab_env.cache_dir``, or else its own name.
+        """
+        cache_dir = Path(cache_dir)
+        try:
+            return cache_dir.relative_to(sauronlab_env.cache_dir).parts[0]
+        except (ValueError, IndexError):
+            return cache_dir.name
+
+    @classmethod
+    def cache_dirs(cls) -> Mapping[str, Path]:
+        """The directories of all caches, by name."""
+        dirs = [d for d in sauronlab_env.cache_dir.iterdir() if d.is_dir()]
+        dirs += [sauronlab_env.video_cache_dir, sauronlab_env.dataset_cache_dir]
+        return {cls.name_of(d): d for d in dirs if d.exists()}
+
+    def record_access(self, cache: str, path: PathLike, hit: bool) -> None:
+        """
+        Records that a file was loaded, and whether it was already cached.
+
+        Args:
+            cache: The name of the cache
+            path: The file, which might not exist if the load failed
+            hit: Whether the file existed before the load
+        """
+        path = Path(path).absolute()
+        now = time.time()
+        column = "hits" if hit else "misses"
+        try:
+            with self._connect() as conn:
+                conn.execute(
+                    f"INSERT INTO stats (cache, {column}) VALUES (?, 1)"
+                    f" ON CONFLICT (cache) DO UPDATE SET {column} = {column} + 1",
+                    (cache,),
+                )
+                if path.is_file():
+                    conn.execute(
+                        "INSERT INTO entries (path, cache, bytes, created, last_access, n_hits)"
+                        " VALUES (?, ?, ?, ?, ?, ?) ON CONFLICT (path) DO UPDATE SET"
+                        " bytes = excluded.bytes, last_access = excluded.last_access,"
+                        " n_hits = n_hits + excluded.n_hits",
+                        (str(path), cache, path.stat().st_size, now, now, int(hit)),
+                    )
+        except sqlite3.Error:
+            logger.debug(f"Failed to record access to {path} in {self.path}", exc_info=True)
+
+    def record_delete(self, *paths: PathLike) -> None:
+        """Removes entries for files that were deleted."""
+        try:
+            with self._connect() as conn:
+                conn.executemany(
+                    "DELETE FROM entries WHERE path = ?",
+                    [(str(Path(p).absolute()),) for p in paths],
+                )
+        except sqlite3.Error:
+            logger.debug(f"Failed to record deletions in {self.path}", exc_info=True)
+
+    def pin(
+        self, cache: str, paths: Iterable[PathLike], seconds: float = 24 * 3600
+    ) -> Optional[str]:
+        """
+        Keeps files from being evicted for some time, or until ``unpin`` is called with the token.
+        The files don't need to exist yet.
+        Files that are not yet catalogued are added if they exist.
+
+        Returns:
+            A token for ``unpin``, or None if the pin could not be recorded
+        """
+        token = uuid.uuid4().hex
+        until = time.time() + seconds
+        paths = [Path(p).absolute() for p in paths]
+        host, pid = socket.gethostname(), os.getpid()
+        try:
+            self.sync_paths(cache, paths)
+            with self._connect() as conn:
+                conn.executemany(
+                    "INSERT OR REPLACE INTO pins (path, token, host, pid, until)"
+                    " VALUES (?, ?, ?, ?, ?)",
+                    [(str(p), token, host, pid, until) for p in paths],
+                )
+        except sqlite3.Error:
+            logger.debug(f"Failed to pin {len(paths)} files in {self.path}", exc_info=True)
+            return None
+        return token
+
+    def unpin(self, token: Optional[str] = None) -> None:
+        """Removes the pin from a call to ``pin``, or every pin if ``token`` is None."""
+        try:
+            with self._connect() as conn:
+                if token is None:
+                    conn.execute("DELETE FROM pins")
+                else:
+                    conn.execute("DELETE FROM pins WHERE token = ?", (token,))
+        except sqlite3.Error:
+            logger.debug(f"Failed to unpin files in {self.path}", exc_info=True)
+
+    def entries(self, cache: Optional[str] = None) -> Sequence[CacheEntry]:
+        """Gets catalogued files, least recently used first."""
+        query = "SELECT path, cache, bytes, created, last_access, n_hits FROM entries"
+        args = ()
+        if cache is not None:
+            query += " WHERE cache = ?"
+            args = (cache,)
+        with self._connect() as conn:
+            rows = conn.execute(query + " ORDER BY last_access", args).fetchall()
+            pinned = self._live_pins(conn)
+        return [CacheEntry(Path(r[0]), *r[1:], pinned.get(r[0], 0)) for r in rows]
+
+    def stats(self) -> Mapping[str, Tup[int, int]]:
+        """Gets the number of hits and misses by cache."""
+        with self._connect() as conn:
+            rows = conn.execute("SELECT cache, hits, misses FROM stats").fetchall()
+        return {cache: (hits, misses) for cache, hits, misses in rows}
+
+    def sync(self, cache_dirs: Optional[Mapping[str, Path]] = None) -> None:
+        """
+        Makes the catalog match the files on disk.
+        New files are added with their modification time as their last access,
+        and entries for files that no longer exist are removed.
+        """
+        cache_dirs = CacheCatalog.cache_dirs() if cache_dirs is None else cache_dirs
+        on_disk = {}
+        for cache, directory in cache_dirs.items():
+            for p in directory.rglob("*"):
+                if p.is_file() and not p.name.startswith("."):
+                    on_disk[str(p.absolute())] = (cache, p.stat())
+        with self._connect() as conn:
+            known = {r[0] for r in conn.execute("SELECT path FROM entries").fetchall()}
+            conn.executemany(
+                "DELETE FROM entries WHERE path = ?", [(p,) for p in known - on_disk.keys()]
+            )
+            self._upsert(conn, [(p, c, s) for p, (c, s) in on_disk.items()])
+        logger.debug(f"Synced {len(on_disk)} cached files with {self.path}")
+
+    def sync_paths(self, cache: str, paths: Iterable[Path]) -> None:
+        """Adds or updates entries for specific files in one cache."""
+        stats = {str(Path(p).absolute()): Path(p).stat() for p in paths if Path(p).is_file()}
+        with self._connect() as conn:
+            self._upsert(conn, [(p, cache, s) for p, s in stats.items()])
+
+    def _live_pins(self, conn: sqlite3.Connection) -> Mapping[str, float]:
+        # the latest expiry of each path's live pins; drops the pins of exited processes
+        now, here = time.time(), socket.gethostname()
+        pinned, dead = {}, []
+        for path, token, host, pid, until in conn.execute(
+            "SELECT path, token, host, pid, until FROM pins"
+        ):
+            if until <= now or (host == here and not _is_alive(pid)):
+                dead.append((path, token))
+            else:
+                pinned[path] = max(until, pinned.get(path, 0))
+        conn.executemany("DELETE FROM pins WHERE path = ? AND token = ?", dead)
+        return pinned
+
+    def _upsert(self, conn: sqlite3.Connection, rows: Sequence[Tup[str, str, os.stat_result]]):
+        conn.executemany(
+            "INSERT INTO entries (path, cache, bytes, created, last_access)"
+            " VALUES (?, ?, ?, ?, ?) ON CONFLICT (path) DO UPDATE SET bytes = excluded.bytes",
+            [(p, c, s.st_size, s.st_mtime, s.st_mtime) for p, c, s in rows],
+        )
+
+    @contextmanager
+    def _connect(self) -> Generator[sqlite3.Connection, None, None]:
+        # a connection per call keeps this safe across threads and joblib workers
+        conn = sqlite3.connect(str(self.path), timeout=30)
+        try:
+            if not self._initialized:
+                conn.execute("PRAGMA journal_mode=WAL")
+                conn.executescript(_SCHEMA)
+                self._initialized = True
+            with conn:
+                yield conn
+        finally:
+            conn.close()
+
+
+def _is_alive(pid: int) -> bool:
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        # it exists but belongs to another user
+        return True
+    return True
+
+
+class CacheManager:
+    """
+    Reports on and evicts from the on-disk caches.
+    Files are evicted until each cache is under its own budget,
+    and then until all caches together are under the global budget.
+    Caches with a lower priority are emptied first, least recently used files first.
+    Pinned files are never evicted, and caches with priority None (datasets by default) are only
+    evicted from to meet their own budget.
+    """
+
+    default_priorities: Mapping[str, Optional[int]] = {
+        "videos": 0,
+        "sensors": 1,
+        "stimuli": 2,
+        "batteries": 2,
+        "assays": 2,
+        "fuzzy": 2,
+        "wells": 3,
+        "datasets": None,
+        "shared": None,
+    }
+
+    def __init__(
+        self,
+        max_bytes: Optional[int] = None,
+        budgets: Optional[Mapping[str, int]] = None,
+        priorities: Optional[Mapping[str, Optional[int]]] = None,
+        catalog: Optional[CacheCatalog] = None,
+    ):
+        """
+        Constructor.
+
+        Args:
+            max_bytes: The global budget; defaults to ``sauronlab_env.cache_max_gb``
+            budgets: Budgets by cache name; defaults to ``sauronlab_env.cache_budgets_gb``
+            priorities: Eviction priorities by cache name, overriding ``default_priorities``;
+                        unlisted caches have priority 1
+            catalog: Defaults to ``CacheCatalog.default()``
+        """
+        if max_bytes is None and sauronlab_env.cache_max_gb is not None:
+            max_bytes = int(sauronlab_env.cache_max_gb * 1024 ** 3)
+        if budgets is None:
+            budgets = {k: int(v * 1024 ** 3) for k, v in sauronlab_env.cache_budgets_gb.items()}
+        self.max_bytes = max_bytes
+        self.budgets = budgets
+        self.priorities = {**self.default_priorities, **({} if priorities is None else priorities)}
+        self.catalog = CacheCatalog.default() if catalog is None else catalog
+
+    def report(self) -> pd.DataFrame:
+        """
+        Gets the number of files, size, hit rate, and budget of each cache.
+        Syncs the catalog with the disk first.
+        """
+        self.catalog.sync()
+        stats = self.catalog.stats()
+        entries = self.catalog.entries()
+        rows = []
+        for cache in sorted({e.cache for e in entries} | set(stats.keys())):
+            mine = [e for e in entries if e.cache == cache]
+            hits, misses = stats.get(cache, (0, 0))
+            rows.append(
+                dict(
+                    cache=cache,
+                    n_files=len(mine),
+                    n_pinned=sum(1 for e in mine if e.is_pinned),
+                    gb=sum(e.bytes for e in mine) / 1024 ** 3,
+                    budget_gb=self.budgets[cache] / 1024 ** 3 if cache in self.budgets else None,
+                    hits=hits,
+                    misses=misses,
+                    hit_rate=hits / (hits + misses) if hits + misses > 0 else None,
+                )
+            )
+        return pd.DataFrame(rows)
+
+    def evict(self, dry: bool = False) -> Sequence[CacheEntry]:
+        """
+        Deletes files until every budget is met.
+
+        Args:
+            dry: Only return what would be deleted
+
+        Returns:
+            The evicted entries
+        """
+        self.catalog.sync()
+        entries = [e for e in self.catalog.entries() if not e.is_pinned]
+        evicted = []
+        for cache, budget in self.budgets.items():
+            mine = [e for e in entries if e.cache == cache]
+            total = sum(e.bytes for e in self.catalog.entries(cache))
+            evicted += self._take_until(mine, total - budget)
+        if self.max_bytes is not None:
+            total = sum(e.bytes for e in self.catalog.entries()) - sum(e.bytes for e in evicted)
+            gone = {e.path for e in evicted}
+            candidates = [
+                e
+                for e in entries
+                if e.path not in gone and self.priorities.get(e.cache, 1) is not None
+            ]
+            candidates.sort(key=lambda e: (self.priorities.get(e.cache, 1), e.last_access))
+            evicted += self._take_until(candidates, total - self.max_bytes)
+        n_bytes = sum(e.bytes for e in evicted)
+        if dry:
+            logger.notice(f"Would evict {len(evicted)} files ({round(n_bytes / 1024 ** 3, 2)} GB)")
+            return evicted
+        for entry in evicted:
+            self._delete(entry)
+        self.catalog.record_delete(*[e.path for e in evicted])
+        logger.notice(f"Evicted {len(evicted)} files ({round(n_bytes / 1024 ** 3, 2)} GB)")
+        return evicted
+
+    def _take_until(self, entries: Sequence[CacheEntry], n_bytes: int) -> List[CacheEntry]:
+        taken = []
+        for entry in entries:
+            if n_bytes <= 0:
+                break
+            taken.append(entry)
+            n_bytes -= entry.bytes
+        return taken
+
+    def _delete(self, entry: CacheEntry) -> None:
+        # also remove files that belong to this one, like a video's .sha256
+        for p in [entry.path, *entry.path.parent.glob(entry.path.name + ".*")]:
+            if p.exists():
+                p.unlink()
+
+
+__all__ = ["CacheCatalog", "CacheEntry", "CacheManager"]
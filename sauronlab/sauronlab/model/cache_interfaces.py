@@ -6,6 +6,7 @@ from sauronlab.core.core_imports import *
 from sauronlab.core.valar_singleton import *
 from sauronlab.model.assay_frames import AssayFrame
 from sauronlab.model.audio import *
+from sauronlab.model.cache_catalog import CacheCatalog
 from sauronlab.model.sensors import *
 from sauronlab.model.stim_frames import BatteryStimFrame
 from sauronlab.model.well_frames import *
@@ -58,6 +59,39 @@ class ASauronlabCache(Generic[KEY, VALUE], metaclass=ABCMeta):
         path = self.path_of(key).relative_to(self.cache_dir).parts
         if self.contains(key):
             self.path_of(key).unlink()
+            CacheCatalog.default().record_delete(self.path_of(key))
+
+    @property
+    def catalog_name(self) -> str:
+        """The name that this cache's files are listed under in the ``CacheCatalog``."""
+        return CacheCatalog.name_of(self.cache_dir)
+
+    @contextmanager
+    def pinned(
+        self, keys: Iterable[KEY], seconds: float = 24 * 3600
+    ) -> Generator[None, None, None]:
+        """
+        Keeps the files for ``keys``, including ones that are about to be downloaded,
+        from being evicted until the block exits.
+        The pin expires after ``seconds``, or when this process exits.
+        """
+        paths = [self.path_of(k) for k in keys]
+        token = CacheCatalog.default().pin(self.catalog_name, paths, seconds)
+        try:
+            yield
+        finally:
+            if token is not None:
+                CacheCatalog.default().unpin(token)
+
+    def _catalogued(self, key: KEY) -> None:
+        # downloads if needed, recording the hit or miss
+        hit = self.contains(key)
+        if not hit:
+            self.download(key)
+        self._record_access(key, hit)
+
+    def _record_access(self, key: KEY, hit: bool) -> None:
+        CacheCatalog.default().record_access(self.catalog_name, self.path_of(key), hit)
 
     def __contains__(self, key: KEY) -> bool:
         return self.contains(key)
@@ -72,7 +106,7 @@ class ASauronlabCache(Generic[KEY, VALUE], metaclass=ABCMeta):
 class AWellCache(ASauronlabCache[RunLike, WellFrame], metaclass=ABCMeta):
     """"""
 
-    def load_multiple(self, runs: RunsLike) -> WellFrame:
+    def load_multiple(self, runs: RunsLike, shared: bool = False) -> WellFrame:
         raise NotImplementedError()
 
     def with_dtype(self, dtype) -> AWellCache:
@@ -95,6 +129,11 @@ class AStimCache(ASauronlabCache[BatteryLike, BatteryStimFrame], metaclass=ABCMe
         """"""
         raise NotImplementedError()
 
+    def load_window(
+        self, battery: BatteryLike, start_ms: Optional[int] = None, end_ms: Optional[int] = None
+    ) -> BatteryStimFrame:
+        raise NotImplementedError()
+
 
 class StimulusWaveform(Waveform):
     """"""
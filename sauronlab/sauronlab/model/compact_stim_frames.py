@@ -0,0 +1,140 @@
+"""
+A compact file format for stimframes, which can read a window of rows without reading the rest.
+"""
+from __future__ import annotations
+
+from sauronlab.core.core_imports import *
+
+_MAGIC = b"SAURONSF1\n"
+_ALIGN = 64
+
+
+class CompactStimFrames:
+    """
+    Reads and writes stimframes as one file with a JSON header and a block per stimulus.
+    Each column is stored in one of two ways, whichever is smaller:
+        - ``rle``: The rows where the value changes, and the new values.
+          Most stimuli are off most of the time, so an hour-long battery is usually a few kilobytes.
+        - ``dense``: Every value. Embedded audio waveforms change every millisecond.
+    Values are stored as uint8 unless a column has non-byte values (as in some legacy batteries).
+    Blocks are memory-mapped, so reading rows ``start`` to ``end`` touches only the pages with them:
+    a binary search over the change points for ``rle`` columns, and a slice for ``dense`` ones.
+
+    The layout is: ``_MAGIC``, the header length as 8 little-endian bytes, the JSON header,
+    and the blocks, each aligned to 64 bytes from the start of the file.
+    """
+
+    @classmethod
+    def write(cls, path: PathLike, df: pd.DataFrame) -> None:
+        """
+        Writes stimframes with one row per frame, replacing the file atomically.
+
+        Args:
+            path: The file to write
+            df: A DataFrame whose index is the ms (row number) and whose columns are stimuli
+        """
+        path = Path(path)
+        blocks, columns = [], []
+        n_rows = len(df)
+        for name in df.columns:
+            x = np.asarray(df[name].values, dtype=np.float64)
+            is_bytes = np.all((x >= 0) & (x <= 255) & (np.mod(x, 1) == 0))
+            dtype = np.dtype(np.uint8) if is_bytes else np.dtype(np.float32)
+            x = x.astype(dtype)
+            starts = np.concatenate([[0], np.flatnonzero(np.diff(x)) + 1]).astype(np.int64)
+            if n_rows > 0 and starts.nbytes + len(starts) * dtype.itemsize < x.nbytes:
+                blocks += [starts, x[starts]]
+                columns.append(dict(name=str(name), encoding="rle", dtype=dtype.str, n=len(starts)))
+            else:
+                blocks.append(x)
+                columns.append(dict(name=str(name), encoding="dense", dtype=dtype.str, n=n_rows))
+        header = dict(n_rows=n_rows, columns=columns)
+        # offsets depend on the header length, which depends on the offsets; fix the width first
+        offsets = [0] * len(blocks)
+        header["offsets"] = [10 ** 15] * len(blocks)
+        data_start = cls._align(len(_MAGIC) + 8 + len(json.dumps(header)))
+        position = data_start
+        for i, block in enumerate(blocks):
+            offsets[i] = position
+            position = cls._align(position + block.nbytes)
+        header["offsets"] = offsets
+        encoded = json.dumps(header).encode("utf8")
+        tmp = path.with_name("." + path.name + ".tmp")
+        with tmp.open("wb") as f:
+            f.write(_MAGIC)
+            f.write(len(encoded).to_bytes(8, "little"))
+            f.write(encoded)
+            for offset, block in zip(offsets, blocks):
+                f.write(b"\0" * (offset - f.tell()))
+                f.write(block.tobytes())
+        os.replace(tmp, path)
+
+    @classmethod
+    def n_rows(cls, path: PathLike) -> int:
+        return cls._header(path)["n_rows"]
+
+    @classmethod
+    def read(
+        cls, path: PathLike, start: Optional[int] = None, end: Optional[int] = None
+    ) -> pd.DataFrame:
+        """
+        Reads rows ``start`` (inclusive) to ``end`` (exclusive).
+
+        Args:
+            path: A file written by ``write``
+            start: The first row; 0 if None
+            end: The row after the last; the number of rows if None
+
+        Returns:
+            A DataFrame with columns per stimulus,
+            indexed by ``ms`` (the row numbers in the full stimframes)
+        """
+        header = cls._header(path)
+        n_rows = header["n_rows"]
+        start = 0 if start is None else min(max(start, 0), n_rows)
+        end = n_rows if end is None else min(max(end, start), n_rows)
+        data = {}
+        offsets = iter(header["offsets"])
+        for column in header["columns"]:
+            dtype = np.dtype(column["dtype"])
+            if column["encoding"] == "dense":
+                values = cls._map(path, next(offsets), dtype, column["n"])
+                data[column["name"]] = np.array(values[start:end])
+            else:
+                starts = cls._map(path, next(offsets), np.dtype(np.int64), column["n"])
+                values = cls._map(path, next(offsets), dtype, column["n"])
+                data[column["name"]] = cls._decode_window(starts, values, start, end)
+        index = pd.RangeIndex(start, end, name="ms")
+        return pd.DataFrame(data, index=index)
+
+    @classmethod
+    def _decode_window(
+        cls, starts: np.ndarray, values: np.ndarray, start: int, end: int
+    ) -> np.ndarray:
+        if end <= start:
+            return np.array(values[:0])
+        first = np.searchsorted(starts, start, side="right") - 1
+        last = np.searchsorted(starts, end, side="left")
+        bounds = np.clip(np.append(starts[first:last], end), start, end)
+        return np.repeat(np.array(values[first:last]), np.diff(bounds))
+
+    @classmethod
+    def _header(cls, path: PathLike) -> Dict[str, Any]:
+        with Path(path).open("rb") as f:
+            if f.read(len(_MAGIC)) != _MAGIC:
+                raise CacheLoadError(f"{path} is not a compact stimframes file")
+            n = int.from_bytes(f.read(8), "little")
+            return json.loads(f.read(n).decode("utf8"))
+
+    @classmethod
+    def _map(cls, path: PathLike, offset: int, dtype: np.dtype, n: int) -> np.ndarray:
+        if n == 0:
+            return np.empty(0, dtype=dtype)
+        return np.memmap(path, dtype=dtype, mode="r", offset=offset, shape=(n,))
+
+    @classmethod
+    def _align(cls, position: int) -> int:
+        return -(-position // _ALIGN) * _ALIGN
+
+
+__all__ = ["CompactStimFrames"]
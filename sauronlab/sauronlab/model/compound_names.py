@@ -5,6 +5,26 @@ def identity(s: str) -> str:
     return s
 
 
+class _LazyRefs:
+    """
+    A class attribute holding the refs listed in a chem resource file.
+    The refs are fetched from Valar on first access rather than when the class is defined.
+    """
+
+    def __init__(self, resource: str):
+        self.resource = resource
+        self._refs = None
+
+    def __get__(self, instance, owner) -> Sequence[Refs]:
+        if self._refs is None:
+            self._refs = [
+                x
+                for x in Refs.fetch_all_or_none(InternalTools.load_resource("chem", self.resource))
+                if x is not None
+            ]
+        return self._refs
+
+
 @abcd.auto_repr_str()
 @abcd.auto_eq()
 class CompoundNamer(metaclass=abc.ABCMeta):
@@ -193,16 +213,8 @@ class TieredCompoundNamer(CompoundNamer):
     """
 
     # high-precedence, manual, drugbank:5.0.10:secondary_id, chembl:api:fda_name, chembl:api:inn_name, chembl:api:usan_name, valinor, dmso_stocks, chembl:api:preferred_name
-    elegant_sources: Sequence[RefLike] = [
-        x
-        for x in Refs.fetch_all_or_none(InternalTools.load_resource("chem", "refs_few.lines"))
-        if x is not None
-    ]
-    elegant_sources_extended: Sequence[RefLike] = [
-        x
-        for x in Refs.fetch_all_or_none(InternalTools.load_resource("chem", "refs_more.lines"))
-        if x is not None
-    ]
+    elegant_sources: Sequence[RefLike] = _LazyRefs("refs_few.lines")
+    elegant_sources_extended: Sequence[RefLike] = _LazyRefs("refs_more.lines")
 
     def __init__(
         self,
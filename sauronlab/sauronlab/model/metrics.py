@@ -2,6 +2,7 @@ from __future__ import annotations
 
 from dataclasses import dataclass
 
+import joblib
 import sklearn.metrics as skmetrics
 from statsmodels.nonparametric.kde import KDEUnivariate
 from typeddfs.df_typing import DfTyping
@@ -36,6 +37,106 @@ class StatTools:
         return dens.support, dens.density
 
 
+@dataclass(frozen=True, repr=True)
+class Bootstrapper:
+    """
+    Vectorized bootstrap of a center statistic (mean, median, etc.).
+    For each sample, draws a (b × n) matrix of resampled indices at once (in chunks of at most
+    ``max_elements``) and applies the center function along its rows.
+    Every group gets its own random stream spawned from ``seed``,
+    so results are reproducible and independent of ``n_jobs``.
+
+    Attributes:
+        b: The number of bootstrap samples
+        seed: The seed for the random streams
+        n_jobs: The number of processes to spread groups over
+        max_elements: The largest index matrix to hold in memory at once
+    """
+
+    b: int
+    seed: int = 0
+    n_jobs: int = 1
+    max_elements: int = 2 ** 24
+
+    def quantiles(
+        self,
+        values: np.array,
+        qs: Sequence[float],
+        center_fn: Callable[..., Any] = np.mean,
+        rand: Optional[np.random.Generator] = None,
+    ) -> np.array:
+        """
+        Bootstraps the center of one sample.
+
+        Args:
+            values: A 1-D array
+            qs: Quantiles of the bootstrapped centers to return, each between 0 and 1
+            center_fn: A function of an array;
+                       if it accepts ``axis``, it is applied to all rows at once
+            rand: A random generator; by default uses one seeded with ``seed``
+
+        Returns:
+            An array of the quantiles, in the order of ``qs``
+        """
+        values = np.asarray(values)
+        n = len(values)
+        if n == 0:
+            return np.full(len(qs), np.nan)
+        rand = np.random.default_rng(self.seed) if rand is None else rand
+        per_chunk = max(1, self.max_elements // n)
+        centers = np.empty(self.b)
+        for start in range(0, self.b, per_chunk):
+            stop = min(start + per_chunk, self.b)
+            samples = values[rand.integers(0, n, size=(stop - start, n))]
+            centers[start:stop] = self._center(samples, center_fn)
+        return np.quantile(centers, qs)
+
+    def quantiles_by(
+        self,
+        df: pd.DataFrame,
+        by: Union[str, Sequence[str]],
+        column: str,
+        qs: Sequence[float],
+        center_fn: Callable[..., Any] = np.mean,
+    ) -> pd.DataFrame:
+        """
+        Bootstraps the center of ``column`` separately within each group.
+
+        Args:
+            df: Any DataFrame
+            by: Column(s) to group by
+            column: The column to resample
+            qs: Quantiles of the bootstrapped centers, each between 0 and 1
+            center_fn: A function of an array;
+                       if it accepts ``axis``, it is applied to all rows at once
+
+        Returns:
+            A DataFrame indexed by the groups (as in ``groupby``),
+            with one column per quantile, in order
+        """
+        grouped = df.groupby(by)[column]
+        samples = [g.values for _, g in grouped]
+        streams = np.random.SeedSequence(self.seed).spawn(len(samples))
+        if self.n_jobs == 1:
+            results = [
+                self.quantiles(x, qs, center_fn, np.random.default_rng(s))
+                for x, s in zip(samples, streams)
+            ]
+        else:
+            results = joblib.Parallel(n_jobs=self.n_jobs)(
+                joblib.delayed(self.quantiles)(x, qs, center_fn, np.random.default_rng(s))
+                for x, s in zip(samples, streams)
+            )
+        results = np.array(results).reshape(len(samples), len(qs))
+        return pd.DataFrame(results, index=grouped.size().index)
+
+    def _center(self, samples: np.array, center_fn: Callable[..., Any]) -> np.array:
+        try:
+            return center_fn(samples, axis=1)
+        except TypeError:
+            return np.apply_along_axis(center_fn, 1, samples)
+
+
 @dataclass(frozen=True, repr=True)
 class MetricInfo:
     """A type of 2D metric such as ROC or Precision-Recall."""
@@ -229,6 +330,8 @@ class BaseScoreFrame(TypedDf):
         center_fn=np.mean,
         spread_fn=np.std,
         boot: Optional[int] = None,
+        seed: int = 0,
+        n_jobs: int = 1,
     ) -> BaseScoreFrame:
         """
 
@@ -237,7 +340,9 @@ class BaseScoreFrame(TypedDf):
             ci:
             center_fn:  (Default value = np.mean)
             spread_fn:  (Default value = np.std)
-            boot:
+            boot: The number of bootstrap samples for the confidence interval (see ``Bootstrapper``)
+            seed: The random seed for bootstrapping
+            n_jobs: The number of processes to bootstrap groups with
 
         Returns:
 
@@ -256,18 +361,10 @@ class BaseScoreFrame(TypedDf):
             # noinspection PyTypeChecker
             bottoms = selected.groupby(gb).quantile(1 - ci)
         else:
-
-            def get_b(g, c):
-                return np.quantile(
-                    [
-                        float(g.sample(len(g), replace=True).score.aggregate(center_fn))
-                        for _ in range(boot)
-                    ],
-                    c,
-                )
-
-            tops = selected.groupby(gb).aggregate(get_b, c=ci)
-            bottoms = selected.groupby(gb).aggregate(get_b, c=1 - ci)
+            bounds = Bootstrapper(boot, seed=seed, n_jobs=n_jobs).quantiles_by(
+                selected, gb, "score", [ci, 1 - ci], center_fn
+            )
+            tops, bottoms = bounds[0], bounds[1]
         summary = pd.DataFrame(scores)
         summary.columns = ["score"]
         summary["spread"] = stds
@@ -460,4 +557,11 @@ class KdeData:
         return KdeData(samples, support, density, params=kwargs)
 
 
-__all__ = ["MetricData", "MetricInfo", "BaseScoreFrame", "ScoreFrameWithPrediction", "KdeData"]
+__all__ = [
+    "Bootstrapper",
+    "MetricData",
+    "MetricInfo",
+    "BaseScoreFrame",
+    "ScoreFrameWithPrediction",
+    "KdeData",
+]
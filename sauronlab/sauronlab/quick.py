@@ -754,11 +754,8 @@ class Quick:
         battery = Batteries.fetch(battery)
         if audio_waveform is None:
             audio_waveform = not ValarTools.battery_is_legacy(battery)
-        if audio_waveform:
-            stimframes = self._expanded_stim_cache.load(battery)
-        else:
-            stimframes = self.stim_cache.load(battery)
-        return stimframes.slice_ms(battery, start_ms, end_ms)
+        cache = self._expanded_stim_cache if audio_waveform else self.stim_cache
+        return cache.load_window(battery, start_ms, end_ms)
 
     def df(
         self,
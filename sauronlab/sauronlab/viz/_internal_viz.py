@@ -15,6 +15,100 @@ FigureSeqLike = Union[Figure, Iterator[Figure], Iterator[Tup[str, Figure]], Mapp
 class InternalVizTools:
     """"""
 
+    @classmethod
+    def n_display_columns(cls, width_inches: float, enabled: bool = True) -> Optional[int]:
+        """
+        Returns the number of time points worth drawing in a plot this wide,
+        or None if plots should not be decimated.
+
+        Args:
+            width_inches: The width of the axes in inches
+            enabled: False to always return None
+
+        Returns:
+
+        """
+        if not enabled or not sauronlab_rc.decimate_plots:
+            return None
+        return int(np.ceil(width_inches * sauronlab_rc.decimate_dpi))
+
+    @classmethod
+    def decimate_heat(cls, arr: np.array, n_bins: int, symmetric: bool) -> Tup[np.array, np.array]:
+        """
+        Reduces a (rows × time) array to at most ``n_bins`` columns,
+        keeping the extreme of each bin so that short spikes stay visible:
+        the max, or if ``symmetric``, the value furthest from 0.
+        NaNs are ignored unless a bin is all NaN.
+
+        Args:
+            arr: A 2D array
+            n_bins: The maximum number of output columns
+            symmetric: Whether the colormap is centered on 0
+
+        Returns:
+            The reduced array and the edges of its columns (in input columns)
+        """
+        edges = cls._decimation_edges(arr.shape[1], n_bins)
+        if len(edges) > arr.shape[1]:
+            return arr, edges
+        hi = np.fmax.reduceat(arr, edges[:-1], axis=1)
+        if not symmetric:
+            return hi, edges
+        lo = np.fmin.reduceat(arr, edges[:-1], axis=1)
+        return np.where(np.abs(lo) > np.abs(hi), lo, hi), edges
+
+    @classmethod
+    def decimate_lines(cls, arr: np.array, n_bins: int) -> Tup[np.array, np.array]:
+        """
+        Reduces (lines × time) to the min and max of each of at most ``n_bins`` bins,
+        which draws the same envelope as the full lines at the output resolution.
+
+        Args:
+            arr: A 2D array with one row per line
+            n_bins: The maximum number of bins
+
+        Returns:
+            The x positions (in input columns) and the y values, alternating min and max per bin
+        """
+        edges = cls._decimation_edges(arr.shape[1], n_bins)
+        if len(edges) > arr.shape[1]:
+            return np.arange(arr.shape[1]), arr
+        lo, hi = cls.decimate_bands(arr, arr, n_bins)[1:]
+        y = np.empty((arr.shape[0], 2 * lo.shape[1]), dtype=np.result_type(arr, np.float32))
+        y[:, 0::2], y[:, 1::2] = lo, hi
+        return np.repeat(cls._bin_centers(edges), 2), y
+
+    @classmethod
+    def decimate_bands(
+        cls, bottom: np.array, top: np.array, n_bins: int
+    ) -> Tup[np.array, np.array, np.array]:
+        """
+        Reduces the bottom and top of (rows × time) bands to
+        the min of the bottom and max of the top in each of at most ``n_bins`` bins.
+
+        Args:
+            bottom: A 2D array
+            top: A 2D array of the same shape
+            n_bins: The maximum number of bins
+
+        Returns:
+            The x positions (in input columns), bottom, and top
+        """
+        edges = cls._decimation_edges(bottom.shape[1], n_bins)
+        if len(edges) > bottom.shape[1]:
+            return np.arange(bottom.shape[1]), bottom, top
+        lo = np.fmin.reduceat(bottom, edges[:-1], axis=1)
+        hi = np.fmax.reduceat(top, edges[:-1], axis=1)
+        return cls._bin_centers(edges), lo, hi
+
+    @classmethod
+    def _decimation_edges(cls, n: int, n_bins: int) -> np.array:
+        return np.unique(np.linspace(0, n, min(n, n_bins) + 1).round().astype(int))
+
+    @classmethod
+    def _bin_centers(cls, edges: np.array) -> np.array:
+        return (edges[:-1] + edges[1:] - 1) / 2
+
     @classmethod
     def preferred_units_per_sec(cls, mark_every_ms: int, total_ms: float) -> Tup[str, float]:
         """
@@ -30,6 +30,7 @@ class HeatPlotter(CakeComponent, KvrcPlotting):
         symmetric: bool = False,
         name_sep_line: bool = False,
         control_sep_line: bool = False,
+        decimate: bool = True,
     ):
         """
         Creates a new plotter to be applied to any data.
@@ -43,6 +44,9 @@ class HeatPlotter(CakeComponent, KvrcPlotting):
             symmetric: If True, calculates z=abs(max(MI)) and sets vmin=-z and vmax=z.
             name_sep_line:
             control_sep_line:
+            decimate: Reduce long time-series to the figure's resolution before drawing,
+                      keeping the extreme value per pixel column
+                      (also see ``sauronlab_rc.decimate_plots``)
         """
         self._stimframes_plotter = (
             stimframes_plotter if stimframes_plotter is not None else StimframesPlotter()
@@ -61,6 +65,7 @@ class HeatPlotter(CakeComponent, KvrcPlotting):
         self._vmax_quantile = vmax_quantile
         self._name_sep_line = name_sep_line
         self._control_sep_line = control_sep_line
+        self._decimate = decimate
 
     def plot(
         self,
@@ -87,12 +92,21 @@ class HeatPlotter(CakeComponent, KvrcPlotting):
         logger.info(f"Plotting heatmap with {n_plots} rows...")
         vmin, vmax = self._vmin_max(df)
         figure, ax1, ax2 = self._figure(len(df), stimframes is not None)
+        values, edges = self._values(df)
         if sauronlab_rc.rasterize_heatmaps:
             ax1.imshow(
-                df, aspect="auto", vmin=vmin, vmax=vmax, cmap=self._cmap, interpolation="none"
+                values,
+                aspect="auto",
+                vmin=vmin,
+                vmax=vmax,
+                cmap=self._cmap,
+                interpolation="none",
+                extent=(-0.5, edges[-1] - 0.5, len(df) - 0.5, -0.5),
             )
         else:
-            ax1.pcolormesh(df, vmin=vmin, vmax=vmax, cmap=self._cmap)
+            ax1.pcolormesh(
+                edges, np.arange(len(df) + 1), values, vmin=vmin, vmax=vmax, cmap=self._cmap
+            )
         self._adjust(df, ax1)
         if stimframes is not None:
             self._stimframes_plotter.plot(stimframes, battery, ax2, starts_at_ms=starts_at_ms)
@@ -102,6 +116,22 @@ class HeatPlotter(CakeComponent, KvrcPlotting):
         FigureTools.stamp_runs(ax1, df.unique_runs())
         return figure
 
+    def _values(self, df: WellFrame) -> Tup[np.array, np.array]:
+        """
+        Gets the values to draw and the edges of their columns, decimated if enabled.
+
+        Args:
+            df:
+
+        Returns:
+
+        """
+        values = df.values.astype(np.float64)
+        n_bins = InternalVizTools.n_display_columns(sauronlab_rc.heatmap_width, self._decimate)
+        if n_bins is None:
+            return values, np.arange(values.shape[1] + 1)
+        return InternalVizTools.decimate_heat(values, n_bins, self._symmetric)
+
     def _figure(self, n_rows: int, with_stimframes: bool):
         """
 
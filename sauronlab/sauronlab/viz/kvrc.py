@@ -129,6 +129,14 @@ class SauronlabRc(KvrcCore):
         self.rasterize_heatmaps = config.new_bool("rasterize_heatmaps", True)
         self.rasterize_waveforms = config.new_bool("rasterize_waveforms", True)
 
+        # reducing long time-series to the output resolution before drawing
+        self.decimate_plots = config.new_bool(
+            "decimate_plots",
+            True,
+            desc="Reduce heatmaps and traces to the output resolution; disable for publication.",
+        )
+        self.decimate_dpi = config.new_int("decimate_dpi", 300, minimum=1)
+
         # choosing units and tick frequencies for traces
         self.trace_pref_tick_ms_interval = config.new_float_list(
             "trace_pref_tick_ms_interval", KvrcDefaults.trace_pref_tick_ms_interval
@@ -30,6 +30,7 @@ class TraceBase(CakeLayer, KvrcPlotting):
         mean_band_color: Optional[str] = None,
         with_bar: bool = False,
         feature: FeatureType = FeatureTypes.MI,
+        decimate: bool = True,
     ):
         """
 
@@ -40,6 +41,8 @@ class TraceBase(CakeLayer, KvrcPlotting):
             mean_band_color:
             with_bar:
             feature:
+            decimate: Reduce long traces to their min/max envelope at the figure's resolution
+                      before drawing (see ``sauronlab_rc.decimate_plots``)
         """
         self._banded = top_bander is None or bottom_bander is None or mean_bander is None
         self._top_bander = top_bander
@@ -48,6 +51,7 @@ class TraceBase(CakeLayer, KvrcPlotting):
         self._mean_band_color = mean_band_color
         self._with_bar = with_bar
         self._feature = feature
+        self._decimate = decimate
         self._y_label = (
             sauronlab_rc.get_feature_names()[feature.internal_name] + " " + feature.recommended_unit
         )
@@ -145,13 +149,16 @@ class TraceBase(CakeLayer, KvrcPlotting):
 
         """
         viz_name = FigureTools.fix_labels(name)
+        n_bins = InternalVizTools.n_display_columns(sauronlab_rc.trace_width, self._decimate)
         if self._banded and len(group) > 2:
             if self._mean_bander is None:
                 mean_band = (
                     group.agg_by_name("mean").smooth(window_size=10).iloc[0, :].values
                 )  # won't matter
+                x, y = self._lines(mean_band[np.newaxis, :], n_bins)
                 ax1.plot(
-                    mean_band,
+                    x,
+                    y[0],
                     alpha=0,
                     color=color,
                     label=viz_name,
@@ -162,8 +169,10 @@ class TraceBase(CakeLayer, KvrcPlotting):
             else:
                 mean_band = self._mean_bander(group).iloc[0, :].values
                 mbc = color if self._mean_band_color is None else self._mean_band_color
+                x, y = self._lines(mean_band[np.newaxis, :], n_bins)
                 ax1.plot(
-                    mean_band,
+                    x,
+                    y[0],
                     alpha=1,
                     color=mbc,
                     label=viz_name,
@@ -174,8 +183,15 @@ class TraceBase(CakeLayer, KvrcPlotting):
             if len(group) > 1:
                 top_band = self._top_bander(group).iloc[0, :].values
                 bottom_band = self._bottom_bander(group).iloc[0, :].values
+                if n_bins is None:
+                    x = np.arange(0, len(bottom_band))
+                else:
+                    x, bottom_band, top_band = InternalVizTools.decimate_bands(
+                        bottom_band[np.newaxis, :], top_band[np.newaxis, :], n_bins
+                    )
+                    bottom_band, top_band = bottom_band[0], top_band[0]
                 ax1.fill_between(
-                    np.arange(0, len(bottom_band)),
+                    x,
                     bottom_band,
                     top_band,
                     facecolor=color,
@@ -184,8 +200,10 @@ class TraceBase(CakeLayer, KvrcPlotting):
                     zorder=0,
                 )
         else:
+            x, y = self._lines(group.values.astype(np.float64), n_bins)
             ax1.plot(
-                group.T.values,
+                x,
+                y.T,
                 alpha=alpha,
                 color=color,
                 label=viz_name,
@@ -197,6 +215,21 @@ class TraceBase(CakeLayer, KvrcPlotting):
             ax1.set_ylim(y_bounds[0], y_bounds[1])
         ax1.set_xbound(0, group.feature_length())
 
+    def _lines(self, arr: np.array, n_bins: Optional[int]) -> Tup[np.array, np.array]:
+        """
+        Gets x positions and y values (one row per line), decimated if ``n_bins`` is not None.
+
+        Args:
+            arr:
+            n_bins:
+
+        Returns:
+
+        """
+        if n_bins is None:
+            return np.arange(arr.shape[1]), arr
+        return InternalVizTools.decimate_lines(arr, n_bins)
+
 
 @abcd.auto_eq()
 @abcd.auto_repr_str()
@@ -228,6 +261,7 @@ class TracePlotter(KvrcPlotting):
         with_bar: bool = False,
         feature: FeatureType = FeatureTypes.MI,
         extra_gridspec_slots: Optional[Sequence[float]] = None,
+        decimate: bool = True,
     ):
         """
 
@@ -243,6 +277,7 @@ class TracePlotter(KvrcPlotting):
             with_bar:
             feature:
             extra_gridspec_slots:
+            decimate: Draw long traces at the figure's resolution (see ``TraceBase``)
         """
         self._stimframes_plotter = (
             stimframes_plotter if stimframes_plotter is not None else StimframesPlotter()
@@ -257,6 +292,7 @@ class TracePlotter(KvrcPlotting):
         self._with_bar = with_bar
         self._feature = feature
         self._extra_gridspec_slots = [] if extra_gridspec_slots is None else extra_gridspec_slots
+        self._decimate = decimate
         self._banded = top_bander is None or bottom_bander is None or mean_bander is None
 
     def plot(
@@ -444,6 +480,7 @@ class TracePlotter(KvrcPlotting):
             mean_band_color=self._mean_band_color,
             with_bar=self._with_bar,
             feature=self._feature,
+            decimate=self._decimate,
         )
         member = trace_base.plot(
             sub, name, control_names, ax1, the_colors, the_alphas, y_bounds, starts_at_ms, run_dict
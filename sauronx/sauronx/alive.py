@@ -18,7 +18,13 @@ from valarpy.model import *
 from .utils import datetime_started_raw, warn_user
 
 from .configuration import config
-from .locks import ProcessingList, ProcessingSubmission, SauronxLock
+from .locks import (
+    PostProcessingQueue,
+    PostProcessorLock,
+    ProcessingList,
+    ProcessingSubmission,
+    SauronxLock,
+)
 
 
 class InterceptHandler(logging.Handler):
@@ -163,6 +169,43 @@ REMOTE = {
 }
 
 
+class Stage(Enum):
+    """
+    The two stages of a submission on this machine.
+    Acquisition needs the hardware and holds SauronxLock.
+    Post-processing (encoding and uploading) runs afterward in a separate process,
+    so the next plate can start while it runs.
+    """
+
+    ACQUISITION = 1
+    POST_PROCESSING = 2
+
+
+def stage_status() -> List[str]:
+    """Describes what each stage is doing, one line per stage."""
+    lock = SauronxLock()
+    if not lock.is_engaged():
+        acquisition = "idle"
+    elif lock.submission_hash == "None":
+        acquisition = "locked without a submission"
+    else:
+        acquisition = "running {}".format(lock.submission_hash)
+    queue = PostProcessingQueue()
+    running = ", ".join(str(j) for j in queue.running())
+    pending = ", ".join(str(j) for j in queue.pending())
+    failed = ", ".join(str(j) for j in queue.failed())
+    post_processor = PostProcessorLock()
+    if post_processor.is_engaged():
+        post_processing = "running {} (PID {})".format(running or "nothing", post_processor.pid)
+    else:
+        post_processing = "stopped"
+    if len(pending) > 0:
+        post_processing += "; queued: " + pending
+    if len(failed) > 0:
+        post_processing += "; failed: " + failed
+    return ["Acquisition: " + acquisition, "Post-processing: " + post_processing]
+
+
 class SauronxAlive:
     """Handles a database connection from VALARPY_CONFIG and processing (submission) locks.
     For example, you can't prototype and submit at the same time.
@@ -175,6 +218,7 @@ class SauronxAlive:
         db: Optional[Valar] = None,
         acquisition_start: bool = False,
         ignore_warnings: bool = False,
+        stage: Stage = Stage.ACQUISITION,
     ) -> None:
         """If submission_hash is None, don't try to access submission_obj or status_obj or call update_status."""
         self.db = None  # type: Valar
@@ -186,6 +230,7 @@ class SauronxAlive:
         self._internal_db = db is None  # don't close if it was built outside
         self.ignore_warnings = ignore_warnings
         self.acquisition_start = acquisition_start
+        self.stage = stage
         self.submission_hash = submission_hash
         if self.submission_hash is not None:
             processing_list = ProcessingList.now()
@@ -231,7 +276,9 @@ class SauronxAlive:
                     self.username = "cole"
                 else:
                     self.username = Users.select().where(Users.id == self.submission_obj.user_id).first().username
-                self._init_status()
+                # post-processing continues a submission that acquisition already started
+                if self.stage is Stage.ACQUISITION:
+                    self._init_status()
             except:
                 ProcessingSubmission.from_hash(self.submission_hash).destroy()
                 raise
@@ -262,8 +309,10 @@ class SauronxAlive:
                 else:
                     description = "test"
                 user = self._slack_user_dict[self.username]
-                payload = '{{"text":"<@{}> S{} {} {} ({})"}}'.format(user, self.sauron_obj.id, stat.name.lower(),
-                                                                     self.submission_hash, description)
+                payload = '{{"text":"<@{}> S{} {} {} {} ({})"}}'.format(
+                    user, self.sauron_obj.id, self.stage.name.lower(), stat.name.lower(),
+                    self.submission_hash, description
+                )
                 CallTools.stream_cmd_call(['curl', '-X', "POST", "-H", "'Content-type: application/json'", "--data", payload,
                                self._slack_hook.rstrip("\n")])
             except:
@@ -381,4 +430,4 @@ class SauronxAlive:
         self.update_status(StatusValue.STARTING)
 
 
-__all__ = ["StatusValue", "SauronxAlive"]
+__all__ = ["StatusValue", "Stage", "SauronxAlive", "stage_status"]
@@ -1,6 +1,6 @@
 import shutil
 from enum import Enum
-from typing import Any, Callable, Dict, Iterator, Optional
+from typing import Any, Callable, Dict, List, Optional
 from colorama import Fore
 from pocketutils.core.exceptions import (
     LookupFailedError,
@@ -13,13 +13,14 @@ from peewee import JOIN
 from valarpy import Valar
 
 from .utils import is_process_running, show_table, pjoin, warn_user, notify_user, print_to_user, prompt_yes_no,\
-    prompt_and_delete, Deletion, scan_for_files
+    prompt_and_delete, Deletion
 from .alive import SauronxAlive
 from .configuration import config
-from .locks import SauronxLock
+from .locks import PostProcessingQueue, PostProcessorLock, SauronxLock
 from .paths import *
 from .paths import SubmissionPathCollection
 from .results import Results
+from .submission_index import IndexedSubmission, SubmissionIndex
 
 
 class Recommendation(Enum):
@@ -33,7 +34,7 @@ class Recommendation(Enum):
     # TODO this class is terribly written
 
     def ask(self, coll: SubmissionPathCollection, db: Valar, skip_ignores: bool) -> None:
-        path, raw_frames_path = coll.output_dir(), coll.outer_frames_dir()
+        path, raw_frames_path = coll.output_dir, coll.outer_frames_dir
         if self is Recommendation.DELETE:
             # don't actually delete in prompt_and_delete
             # instead, save to delete both path and output frames
@@ -56,6 +57,8 @@ class Recommendation(Enum):
                     os.rmdir(path)
             elif choice == Deletion.TRASH and pexists(path):
                 shutil.move(path, config.trash_path(path))
+            if not pexists(path):
+                SubmissionIndex().forget(path)
         elif self is Recommendation.CONTINUE_RAW:
             self._trash_move_leave_continue(
                 coll,
@@ -85,9 +88,10 @@ class Recommendation(Enum):
             )
 
     def accept(self, coll: SubmissionPathCollection, db: Valar) -> None:
-        output_dir = coll.output_dir()
+        output_dir = coll.output_dir
         if self is Recommendation.DELETE:
             shutil.move(output_dir, config.trash_path(output_dir))
+            SubmissionIndex().forget(output_dir)
         elif self is Recommendation.CONTINUE or self is Recommendation.CONTINUE_RAW:
             self._proceed(coll, db)
 
@@ -100,8 +104,8 @@ class Recommendation(Enum):
         deletable: bool,
         msg: str,
     ) -> None:
-        output_dir = coll.output_dir()
-        raw_frames_path = coll.outer_frames_dir()
+        output_dir = coll.output_dir
+        raw_frames_path = coll.outer_frames_dir
         while True:
             command = input("[{}] ... ".format(msg))
             print("Deleteable" if deletable else "Not deleteable")
@@ -117,6 +121,7 @@ class Recommendation(Enum):
                     ConsoleTools.slow_delete(raw_frames_path, 2)
                 if pexists(output_dir):
                     ConsoleTools.slow_delete(output_dir, 2)
+                SubmissionIndex().forget(output_dir)
             elif trashable and command.lower() == "trash":
                 if os.path.exists(raw_frames_path):
                     ConsoleTools.slow_delete(raw_frames_path, 2)
@@ -126,6 +131,7 @@ class Recommendation(Enum):
                 else:
                     print(Fore.RED + "{} does not exist".format(output_dir))
                 print(Fore.BLUE + "Trashed {}".format(output_dir))
+                SubmissionIndex().forget(output_dir)
                 break
             elif continuable and command.lower() == "fix":
                 self._proceed(coll, db)
@@ -134,7 +140,7 @@ class Recommendation(Enum):
                 print(Fore.RED + msg)
 
     def _proceed(self, coll: SubmissionPathCollection, db: Valar) -> None:
-        output_dir = coll.output_dir()
+        output_dir = coll.output_dir
         with open(pjoin(output_dir, "submission_hash.txt")) as f:
             submission_hash = f.read()
         with SauronxAlive(submission_hash, db) as sx_alive:
@@ -163,6 +169,7 @@ class Verdict(Enum):
     BEING_INSERTED = 9
     HANDLED_BY_OTHER = 10
     FAILED_ENCODING = 11
+    QUEUED = 12
 
     def recommendation(self) -> Recommendation:
         return self._recommendations()[self.name]
@@ -184,6 +191,7 @@ class Verdict(Enum):
             "CURRENTLY_RUNNING": Recommendation.IGNORE_NO_OPTION,
             "BEING_INSERTED": Recommendation.DELETE,
             "HANDLED_BY_OTHER": Recommendation.IGNORE_NO_OPTION,
+            "QUEUED": Recommendation.IGNORE_NO_OPTION,
         }
 
     @staticmethod
@@ -275,6 +283,14 @@ class Verdict(Enum):
             ).format(
                 entry.path, processing_file(entry.submission_hash)
             ),
+            "QUEUED": """
+                The verdict: The capture at path {} is queued for post-processing.
+                It will be encoded and uploaded in the background; see 'sauronx status'.
+            """.replace(
+                "\t", ""
+            ).format(
+                entry.path
+            ),
             "BEING_INSERTED": Fore.GREEN
             + """
                 The verdict: The data at path {} is currently being processed on Valinor.
@@ -288,12 +304,19 @@ class Verdict(Enum):
 
 
 class Entry:
-    def __init__(self, path: str) -> None:
+    def __init__(self, path: str, indexed: Optional[IndexedSubmission] = None) -> None:
+        """
+        If ``indexed`` is passed, the local files are not checked again.
+        """
         self.coll = config.get_coll(path)
         self.path = path
+        self.indexed = indexed
 
-        with open(pjoin(path, "submission_hash.txt")) as f:
-            self.submission_hash = f.read()
+        if indexed is not None:
+            self.submission_hash = indexed.submission_hash
+        else:
+            with open(pjoin(path, "submission_hash.txt")) as f:
+                self.submission_hash = f.read()
         self.submission = self._submission()
         if self.submission is None:
             self.history = []
@@ -308,7 +331,7 @@ class Entry:
             rows=[
                 ["snapshot timing info", "+" if self.capture_completed() else "<< failed! >>"],
                 ["stimulus timing info", "+" if self.stimulus_completed() else "<< failed! >>"],
-                ["video (hash)", self._checkmark(self.coll.avi_file() + ".sha256")],
+                ["video (hash)", "+" if self.encoding_completed() else ""],
             ],
             title="local storage",
         )
@@ -348,6 +371,8 @@ class Entry:
             return Verdict.CURRENTLY_RUNNING
         elif self.handled_by_other():
             return Verdict.HANDLED_BY_OTHER
+        elif self.is_queued():
+            return Verdict.QUEUED
         elif self.is_invalid():
             return Verdict.INVALID
         elif self.is_test():
@@ -422,6 +447,11 @@ class Entry:
     def handled_by_other(self) -> bool:
         return pexists(processing_file(self.submission_hash))
 
+    def is_queued(self) -> bool:
+        queue = PostProcessingQueue()
+        jobs = queue.pending() + queue.running()
+        return any(j.submission_hash == self.submission_hash for j in jobs)
+
     def is_unrecoverable(self) -> bool:
         return not self.capture_completed() or not self.stimulus_completed()
 
@@ -429,12 +459,18 @@ class Entry:
     # These are are lower-level and not mutually exclusive
 
     def capture_completed(self) -> bool:
+        if self.indexed is not None:
+            return self.indexed.capture_completed
         return self.coll.snapshot_timing_exists()
 
     def encoding_completed(self) -> bool:
+        if self.indexed is not None:
+            return self.indexed.encoding_completed
         return self.coll.avi_exists()
 
     def stimulus_completed(self) -> bool:
+        if self.indexed is not None:
+            return self.indexed.stimulus_completed
         return self.coll.stimulus_timing_exists()
 
     def is_on_valinor(self) -> bool:
@@ -577,11 +613,13 @@ class SearchRestrictions:
 class DataManager:
     def __init__(self, db: Optional[Valar]) -> None:
         self.db = db
+        self.index = SubmissionIndex()
 
-    def ls(self, base_dir: str) -> None:
+    def ls(self, base_dir: str, pending: bool = False) -> None:
         notify_user("Listing submissions under {}".format(base_dir))
-        for d in self._ls(base_dir):
-            print(Fore.BLUE + os.path.dirname(d))
+        for indexed in self._ls(base_dir):
+            if not pending or not indexed.is_uploaded:
+                print(Fore.BLUE + indexed.path.ljust(60) + " " + indexed.state.name.lower())
         print("")
 
     def data(
@@ -592,7 +630,9 @@ class DataManager:
     def auto_clean(
         self, restrictions: SearchRestrictions, options: DisplayOptions, base_dir: str
     ) -> None:
-        if is_process_running():  # TODO this is broken on Windows
+        # TODO is_process_running is broken on Windows
+        # the post-processor runs detached, so is_process_running doesn't see it
+        if is_process_running() or PostProcessorLock().is_engaged():
             warn_user("For safety, cannot auto-clean if another SauronX instance is running.")
             raise RefusingRequestError(
                 "For safety, cannot auto-clean if another SauronX instance is running."
@@ -626,7 +666,7 @@ class DataManager:
             top="_",
             bottom="",
         )
-        if is_process_running():
+        if is_process_running() or PostProcessorLock().is_engaged():
             warn_user(
                 "Another SauronX process appears to be running.",
                 "As a precaution, make sure to leave any submission in-progress alone.",
@@ -660,12 +700,10 @@ class DataManager:
                 print("Deleted {}".format(f))
             print(Fore.RED + "Obliterated {} files or directories under {}".format(n, path))
 
-    def _ls(self, base_dir: str) -> Iterator[str]:
+    def _ls(self, base_dir: str) -> List[IndexedSubmission]:
         print("")
-        lst = list(scan_for_files(base_dir))  # we modify the iterator by deleting files
-        for f in lst:
-            if f.endswith("submission_hash.txt"):
-                yield os.path.dirname(f)
+        # a list because the callbacks may delete directories
+        return self.index.reconcile(base_dir)
 
     def _data(
         self,
@@ -674,9 +712,15 @@ class DataManager:
         base_dir: str,
         callback: Callable[[Entry], Any] = lambda s: None,
     ) -> None:
-        for path in self._ls(base_dir):
+        for indexed in self._ls(base_dir):
+            path = indexed.path
+            # skip the database lookups for submissions we already know don't match
+            if restrictions.submission is not None and not indexed.submission_hash.startswith(
+                restrictions.submission
+            ):
+                continue
             try:
-                entry = Entry(path)
+                entry = Entry(path, indexed)
                 if restrictions.matches(entry):
                     self._pretty_print(entry, options, callback)
             except LookupFailedError as e:
@@ -1,10 +1,21 @@
 import enum
+import json
 import logging
 import os
-from typing import Iterator, Optional, Set
+import time
+from typing import Iterator, List, Optional, Set
+
+import psutil
 from pocketutils.core.exceptions import LockedError
 
-from .paths import lock_file, processing_file, processing_submission_hash_from_file, sauronx_home
+from .paths import (
+    lock_file,
+    postprocessing_queue_dir,
+    postprocessor_lock_file,
+    processing_file,
+    processing_submission_hash_from_file,
+    sauronx_home,
+)
 from .utils import warn_user, notify_user, is_process_running, looks_like_submission_hash
 _generic_lock_string = "None"
 _forced_lock_string = "--locked--"
@@ -196,4 +207,153 @@ class ProcessingList:
         )
 
 
-__all__ = ["ProcessingList", "ProcessingSubmission", "SauronxLock"]
+class PostProcessorLock:
+    """
+    Ownership of the post-processing queue, so that only one post-processor runs at a time.
+    This is separate from SauronxLock, which is held only while the hardware is in use.
+    The file holds the owner's PID; a lock left by a process that died is taken over.
+    """
+
+    def __init__(self) -> None:
+        self.pid = None  # type: Optional[int]
+        if os.path.exists(postprocessor_lock_file):
+            with open(postprocessor_lock_file) as f:
+                text = f.read().strip()
+            self.pid = int(text) if text.isdigit() else None
+
+    def is_engaged(self) -> bool:
+        return self.pid is not None and psutil.pid_exists(self.pid)
+
+    def engage(self) -> bool:
+        """Takes the lock for this process; returns False if another live process has it."""
+        for _ in range(2):
+            try:
+                fd = os.open(str(postprocessor_lock_file), os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+            except FileExistsError:
+                other = PostProcessorLock()
+                if other.is_engaged() and other.pid != os.getpid():
+                    return False
+                logging.warning("Removing stale post-processor lock (PID {})".format(other.pid))
+                if os.path.exists(postprocessor_lock_file):
+                    os.remove(postprocessor_lock_file)
+                continue
+            with os.fdopen(fd, "w") as f:
+                f.write(str(os.getpid()))
+            self.pid = os.getpid()
+            logging.debug("Engaged post-processor lock")
+            return True
+        return False
+
+    def disengage(self) -> None:
+        if self.pid == os.getpid() and os.path.exists(postprocessor_lock_file):
+            os.remove(postprocessor_lock_file)
+            logging.debug("Disengaged post-processor lock")
+        self.pid = None
+
+
+class PostProcessingJob:
+    """A submission whose capture finished and that still needs to be encoded and uploaded."""
+
+    def __init__(
+        self,
+        submission_hash: str,
+        local: bool = False,
+        store_to: Optional[str] = None,
+        keep_frames: bool = False,
+        assume_clean: bool = False,
+        queued: Optional[float] = None,
+    ) -> None:
+        self.submission_hash = submission_hash
+        self.local = local
+        self.store_to = store_to
+        self.keep_frames = keep_frames
+        self.assume_clean = assume_clean
+        self.queued = time.time() if queued is None else queued
+
+    @property
+    def file_name(self) -> str:
+        return "{:020d}-{}.json".format(int(self.queued * 1e6), self.submission_hash)
+
+    def __str__(self):
+        return self.submission_hash
+
+    @staticmethod
+    def read(path: str):
+        with open(path, encoding="utf8") as f:
+            return PostProcessingJob(**json.load(f))
+
+
+class PostProcessingQueue:
+    """
+    Submissions waiting for post-processing, as one JSON file per job under ``$SAURONX_HOME``.
+    Jobs run oldest first.
+    While a job runs, its file ends with ``.running``; if it fails, ``.failed``.
+    Every change is a rename, so a job is never half-written.
+    Only the owner of PostProcessorLock should call ``start``, ``done``, or ``fail``.
+    """
+
+    def __init__(self, path: str = str(postprocessing_queue_dir)) -> None:
+        self.path = path
+        os.makedirs(self.path, exist_ok=True)
+
+    def put(self, job: PostProcessingJob) -> None:
+        tmp = os.path.join(self.path, "." + job.file_name)
+        with open(tmp, "w", encoding="utf8") as f:
+            json.dump(vars(job), f)
+        os.replace(tmp, os.path.join(self.path, job.file_name))
+        logging.info("Queued {} for post-processing".format(job))
+
+    def pending(self) -> List[PostProcessingJob]:
+        return self._jobs(".json")
+
+    def running(self) -> List[PostProcessingJob]:
+        return self._jobs(".json.running")
+
+    def failed(self) -> List[PostProcessingJob]:
+        return self._jobs(".json.failed")
+
+    def start(self) -> Optional[PostProcessingJob]:
+        """Marks the oldest pending job as running and returns it, or None if there are none."""
+        pending = self.pending()
+        if len(pending) == 0:
+            return None
+        job = pending[0]
+        path = os.path.join(self.path, job.file_name)
+        os.replace(path, path + ".running")
+        return job
+
+    def done(self, job: PostProcessingJob) -> None:
+        os.remove(os.path.join(self.path, job.file_name + ".running"))
+
+    def fail(self, job: PostProcessingJob) -> None:
+        path = os.path.join(self.path, job.file_name)
+        os.replace(path + ".running", path + ".failed")
+
+    def forget_failed(self, submission_hash: str) -> None:
+        """Removes failed jobs for a submission that was since finished some other way."""
+        for job in self.failed():
+            if job.submission_hash == submission_hash:
+                os.remove(os.path.join(self.path, job.file_name + ".failed"))
+
+    def requeue_running(self) -> None:
+        """Puts back jobs left running by a post-processor that died."""
+        for job in self.running():
+            path = os.path.join(self.path, job.file_name)
+            os.replace(path + ".running", path)
+            logging.warning("Re-queued {}, which was interrupted".format(job))
+
+    def _jobs(self, suffix: str) -> List[PostProcessingJob]:
+        names = sorted(
+            f for f in os.listdir(self.path) if f.endswith(suffix) and not f.startswith(".")
+        )
+        return [PostProcessingJob.read(os.path.join(self.path, f)) for f in names]
+
+
+__all__ = [
+    "ProcessingList",
+    "ProcessingSubmission",
+    "SauronxLock",
+    "PostProcessorLock",
+    "PostProcessingJob",
+    "PostProcessingQueue",
+]
@@ -18,6 +18,7 @@ from .data_manager import DataManager, DisplayOptions, SearchRestrictions
 from .locks import SauronxLock
 from .lookup import *
 from .meta_tools import *
+from .postprocessing import PostProcessor
 from .run_modes import *
 
 
@@ -30,6 +31,7 @@ class Main:
     Submission subcommands:
         submit       Submit a job to SauronX
         continue     Continue an incomplete SauronX run
+        postprocess  Encode and upload captured submissions that are queued (run automatically)
     Special submission commands:
         incubate     Incubate a plate with SauronX locked (notifies Goldberry when done)
         prototype    Run Arduino commands interactively
@@ -187,6 +189,13 @@ class Main:
         args = self._parse_args(parser)
         ProceedMode().run(args.path, args.local, ignore_warnings=args.ignore_prior)
 
+    def postprocess(self) -> None:
+        parser = argparse.ArgumentParser(
+            description="Encodes and uploads queued submissions, then exits. Submit starts this itself."
+        )
+        self._parse_args(parser)
+        PostProcessor().run()
+
     def version(self) -> None:
         InfoTools().print_version()
 
@@ -342,8 +351,11 @@ class Main:
             default=config.output_dir_root,
             help="Look at SauronX data in a different base directory",
         )
+        parser.add_argument(
+            "--pending", action="store_true", help="Only list submissions that haven't been uploaded"
+        )
         args = self._parse_args(parser)
-        DataManager(None).ls(args.dir)
+        DataManager(None).ls(args.dir, args.pending)
 
     def data(self) -> None:
         parser = argparse.ArgumentParser(description="List SauronX output on this machine")
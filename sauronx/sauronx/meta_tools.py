@@ -9,7 +9,7 @@ from valarpy import Valar
 
 from sauronx import sauronx_version
 from .utils import pjoin, git_commit_hash
-from .alive import SauronxAlive
+from .alive import SauronxAlive, stage_status
 from .configuration import config, config_file_path
 from .locks import *
 from .paths import lock_file, sauronx_home
@@ -90,6 +90,8 @@ class InfoTools(MetaTools):
                     Fore.MAGENTA
                     + "These submissions are being processed but not run: {}".format(", ".join(non))
                 )
+        for line in stage_status():
+            print(Fore.MAGENTA + line)
 
     def print_info(self, extended: bool = False) -> None:
         with Valar() as valar:
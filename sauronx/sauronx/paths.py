@@ -6,11 +6,21 @@ sauronx_home = os.environ["SAURONX_HOME"]
 
 lock_file = Path(sauronx_home, ".lock")
 
+submission_index_file = Path(sauronx_home, ".submissions.sqlite")
+
+postprocessor_lock_file = Path(sauronx_home, ".postprocessor")
+
+postprocessing_queue_dir = Path(sauronx_home, ".postprocessing")
+
 
 def processing_file(submission_hash: str) -> Path:
     return Path(sauronx_home, ".processing-" + submission_hash)
 
 
+def upload_progress_file(submission_hash: str) -> Path:
+    return Path(sauronx_home, ".upload-" + submission_hash + ".json")
+
+
 def processing_submission_hash_from_file(submission_hash: str) -> Path:
     return Path(submission_hash[len(".processing-"):])
 
@@ -53,6 +63,10 @@ class SubmissionPathCollection:
     def microphone_flac_path(self) -> Path:
         return Path(self.__path, "sensors", "microphone_log.flac")
 
+    @property
+    def microphone_samples_path(self) -> Path:
+        return Path(self.__path, "sensors", "microphone_log.npy")
+
     @property
     def microphone_timestamps_path(self) -> Path:
         return Path(self.__path, "sensors", "microphone_times.txt")
@@ -114,13 +128,13 @@ class SubmissionPathCollection:
         return Path(self.__path, "timing", "end_events.csv")
 
     def avi_exists(self) -> bool:
+        # write_hash_file writes the .sha256 after the video is complete
+        hash_file = Path(str(self.avi_file) + ".sha256")
         return (
-                        self.avi_file.exists()
-                        and os.path.getsize(self.avi_file) > 0
-                        and os.path.getsize(self.shasum_file) > 0
-                        and pexists(os.path.join(self.avi_file, ".sha256")
-                        and psize(self.avi_file) > 0
-                        and psize(os.path.join(self.avi_file, ".sha256"))) > 0
+            pexists(self.avi_file)
+            and psize(self.avi_file) > 0
+            and pexists(hash_file)
+            and psize(hash_file) > 0
         )
 
     def snapshot_timing_exists(self) -> bool:
@@ -0,0 +1,87 @@
+import logging
+import os
+import subprocess
+import sys
+
+from .alive import SauronxAlive, Stage
+from .locks import PostProcessingJob, PostProcessingQueue, PostProcessorLock
+from .paths import sauronx_home
+from .results import Results
+
+
+class PostProcessor:
+    """
+    Encodes and uploads captured submissions from the PostProcessingQueue, one at a time,
+    in a process of its own so that the runner can start the next plate right away.
+    PostProcessorLock makes sure only one is running; it exits when the queue is empty.
+    The runner queues a job and then calls ``ensure_running``:
+            PostProcessingQueue().put(PostProcessingJob(submission_hash))
+            PostProcessor.ensure_running()
+    A job that fails is kept with a ``.failed`` suffix; ``sauronx continue`` can finish it.
+    """
+
+    def __init__(self) -> None:
+        self.queue = PostProcessingQueue()
+        self.lock = PostProcessorLock()
+
+    @classmethod
+    def ensure_running(cls) -> None:
+        """Starts a post-processor in the background unless one is already running."""
+        if PostProcessorLock().is_engaged():
+            logging.debug("Post-processor is already running")
+            return
+        with open(os.devnull, "r+b") as devnull:
+            p = subprocess.Popen(
+                [sys.executable, "-m", "sauronx.main", "postprocess"],
+                cwd=str(sauronx_home),
+                stdin=devnull,
+                stdout=devnull,
+                stderr=devnull,
+                start_new_session=True,  # keep running if the terminal closes
+            )
+        logging.info("Started post-processor (PID {})".format(p.pid))
+
+    def run(self) -> None:
+        # check again after releasing the lock:
+        # a job queued after the last check would otherwise wait for the next submission
+        while len(self.queue.pending()) > 0 or len(self.queue.running()) > 0:
+            if not self.lock.engage():
+                logging.info("Another post-processor (PID {}) owns the queue".format(self.lock.pid))
+                return
+            try:
+                self.queue.requeue_running()
+                job = self.queue.start()
+                while job is not None:
+                    self._run_job(job)
+                    job = self.queue.start()
+            finally:
+                self.lock.disengage()
+
+    def _run_job(self, job: PostProcessingJob) -> None:
+        logging.info("Post-processing {}".format(job))
+        # noinspection PyBroadException
+        try:
+            self._process(job)
+        except Exception:
+            logging.exception("Post-processing {} failed".format(job))
+            self.queue.fail(job)
+        else:
+            self.queue.done(job)
+            logging.info("Finished post-processing {}".format(job))
+
+    def _process(self, job: PostProcessingJob) -> None:
+        with SauronxAlive(
+            job.submission_hash, ignore_warnings=True, stage=Stage.POST_PROCESSING
+        ) as alive:
+            with Results(
+                alive, keep_raw_frames=job.keep_frames, assume_clean=job.assume_clean
+            ) as results:
+                if job.store_to is None:
+                    results.make_video()
+                    if not job.local:
+                        results.upload()
+                else:
+                    results.copy_raw_to(job.store_to)
+
+
+__all__ = ["PostProcessor"]
@@ -1,22 +1,30 @@
 import csv
+import functools
 import logging
 import shutil
-from datetime import datetime, timedelta
+import sqlite3
+from datetime import datetime
 from ntpath import basename
-from typing import List
+from typing import List, Optional, Tuple
 import os
 import subprocess
+import numpy as np
 from colorama import Fore
 from dateutil import parser
 from pocketutils.tools.console_tools import ConsoleTools
 from pocketutils.tools.call_tools import CallTools
 from pocketutils.core.exceptions import RefusingRequestError, BadCommandError, MissingResourceError
 from .utils import append_log_to_submission_log, stamp, make_dirs, warn_user, prompt_yes_no, pexists, pjoin,\
-    success_to_user, pdir, scan_for_proper_files, write_hash_file, parse_local_iso_datetime, lines
+    success_to_user, pdir, scan_for_proper_files, write_hash_file, lines
 
 from .alive import SauronxAlive, StatusValue
 from .configuration import config
+from .paths import upload_progress_file
+from .sensor_buffer import SensorRecorder
 from .submission import CompletedRunInfo
+from .submission_index import LocalState, SubmissionIndex
+from .uploader import Uploader
+from .video_segments import SegmentedEncoder
 
 
 def make_dirs_perm(pathname):
@@ -58,9 +66,17 @@ class Results:
         self.x265_params = None
         self.keyframe_interval = config["sauron.data.video.keyframe_interval"]
         self.extra_x265_options = config["sauron.data.video.extra_x265_params"]
+        # segmented mode encodes closed-GOP segments during capture and concatenates them afterward
+        self.segmented = bool(config.get("sauron.data.video.segmented", False))
+        self.segment_frames = int(
+            config.get("sauron.data.video.segment_frames", 10 * self.keyframe_interval)
+        )
+        self.segment_workers = int(config.get("sauron.data.video.segment_workers", 2))
         self.submission_log_file = append_log_to_submission_log(self.submission_hash)
         self.keep_raw_frames = keep_raw_frames
         self.assume_clean = assume_clean
+        self._snapshot_times = None  # type: Optional[np.ndarray]
+        self._index = None  # type: Optional[SubmissionIndex]
 
     def __enter__(self):
         return self
@@ -126,6 +142,7 @@ class Results:
             logging.warning("The log file at {} already exists".format(self.coll.log_file))
         else:
             os.symlink(self.submission_log_file, self.coll.log_file)
+        self._record(LocalState.INITIALIZED)
 
     def finalize(self, run_info: CompletedRunInfo) -> None:
         import valarpy.model as model
@@ -179,6 +196,7 @@ class Results:
                 logging.error("Missing preview snapshot {}".format(run_info.preview_path))
         except:
             logging.exception("Failed to copy preview frame at {}".format(run_info.preview_path))
+        self._record(LocalState.CAPTURED)
         success_to_user("Finalized run. All of the necessary data is now present.")
 
     def find_ffmpeg_version(self):
@@ -188,6 +206,7 @@ class Results:
     def upload(self) -> None:
         try:
             self.sx_alive.update_status(StatusValue.UPLOADING)
+            self._record(LocalState.UPLOADING)
             # noinspection PyTypeChecker
             for i in range(0, int(self.upload_params["max_attempts"])):
                 try:
@@ -201,8 +220,10 @@ class Results:
                     else:
                         raise e
             self.sx_alive.update_status(StatusValue.UPLOADED)
+            self._record(LocalState.UPLOADED)
         except Exception:
             self.sx_alive.update_status(StatusValue.FAILED_DURING_UPLOAD)
+            self._record(LocalState.FAILED_UPLOAD)
             raise
 
     def copy_raw_to(self, path: str) -> None:
@@ -227,60 +248,132 @@ class Results:
     def make_video(self) -> None:
         try:
             self._parse_frame_timing_file()
-            self._trim_frames()
-            logging.info(
-                "Making primary video with ffmpeg. At high framerates, this should take about as long as the duration of the run"
-            )
-            self._run_ffmpeg(self.raw_frames_output_dir, self.video_file)
+            if self.segmented:
+                self._make_video_from_segments()
+            else:
+                self._trim_frames()
+                logging.info(
+                    "Making primary video with ffmpeg. At high framerates, this should take about as long as the duration of the run"
+                )
+                self._run_ffmpeg(self.raw_frames_output_dir, self.video_file)
             logging.info("Compressing microphone recording.")
             self._convert_microphone()
+            self._record(LocalState.ENCODED)
         except Exception:
             self.sx_alive.update_status(StatusValue.FAILED_DURING_POSTPROCESSING)
+            self._record(LocalState.FAILED_ENCODING)
             raise
 
+    def _record(self, state: LocalState) -> None:
+        # the index is only a cache, so failing to open it shouldn't fail the run
+        try:
+            if self._index is None:
+                self._index = SubmissionIndex()
+        except sqlite3.Error:
+            logging.exception("Failed to open the submission index to record {}".format(state))
+            return
+        self._index.record(self.output_dir, self.submission_hash, state)
+
+    def segment_encoder(self) -> SegmentedEncoder:
+        """
+        Gets an encoder that writes segments of the primary video under the camera directory.
+        Call ``follow()`` on it before capture starts so that most of the encoding happens during the run.
+        """
+        return SegmentedEncoder(
+            self.raw_frames_output_dir,
+            pjoin(os.path.dirname(self.video_file), "segments"),
+            functools.partial(self._ffmpeg_command, self.raw_frames_output_dir),
+            self.segment_frames,
+            self.segment_workers,
+        )
+
+    def _make_video_from_segments(self) -> None:
+        """
+        Makes the primary and trimmed videos from the segments, without moving frames around.
+        Only the partial segments at the trim boundaries (and any not finished during capture) are encoded here.
+        """
+        encoder = self.segment_encoder()
+        first = encoder.first_frame()
+        n_frames = len(list(scan_for_proper_files(self.raw_frames_output_dir)))
+        plan = self._plan_trim(n_frames)
+        if plan is None:
+            # no stimuli, so nothing to trim (like _trim_frames)
+            logging.info("Making primary video from all {} frames".format(n_frames))
+            encoder.assemble([(first, first + n_frames)], str(self.video_file))
+        else:
+            # as in _trim_frames, frames past the last timestamp stay in the primary video
+            i_start, i_stop, n_covered = plan
+            start, stop, covered = first + i_start, first + i_stop, first + n_covered
+            make_dirs_perm(self.coll.trimmed_dir)
+            logging.info(
+                "Making primary video from frames {}–{}, trimming {} and {}".format(
+                    start, stop - 1, i_start, n_covered - i_stop
+                )
+            )
+            for name, a, b in [("start", first, start), ("end", stop, covered)]:
+                output_video = (
+                    self.coll.trimmed_start_video if name == "start" else self.coll.trimmed_end_video
+                )
+                if b > a:
+                    encoder.encode_range(a, b, str(output_video))
+                    write_hash_file(output_video)
+                else:
+                    self._warn_no_trimmings(name)
+            encoder.assemble([(start, stop), (covered, first + n_frames)], str(self.video_file))
+        write_hash_file(self.video_file)
+        encoder.delete_segments()
+        if not self.keep_raw_frames:
+            ConsoleTools.slow_delete(self.raw_frames_output_dir, 3)
+
     def _run_ffmpeg(self, path, output_video):
         make_dirs_perm(os.path.dirname(output_video))
         if not pdir(path):
             raise ValueError("Directory {} does not exist".format(path))
         first_real_frame = self._first_frame(path)
         # TODO change log level back to info
-        subprocess.run(
-            [
-                "ffmpeg",
-                "-loglevel",
-                "warning",
-                "-f",
-                "image2",
-                "-nostdin",
-                "-c:v",
-                "rawvideo",
-                "-framerate",
-                str(self.fps),
-                "-video_size",
-                "{}x{}".format(self.frame_width, self.frame_height),
-                "-pixel_format",
-                "gray",
-                "-start_number",
-                str(first_real_frame),
-                "-i",
-                pjoin(path, "%08d.raw"),
-                "-y",
-                "-c:v",
-                "hevc",
-                "-g",
-                str(self.keyframe_interval),
-                "-q:v",
-                str(self.qp),
-                "-r",
-                str(self.fps),
-                output_video,
-            ]
-        )
+        subprocess.run(self._ffmpeg_command(path, first_real_frame, None, output_video))
 
         write_hash_file(output_video)
         if not self.keep_raw_frames:
             ConsoleTools.slow_delete(path, 3)
 
+    def _ffmpeg_command(
+        self, path, first_frame, n_frames: Optional[int], output_video
+    ) -> List[str]:
+        """Builds the ffmpeg command; if ``n_frames`` is set, encodes only that many as a closed-GOP MKV segment."""
+        cmd = [
+            "ffmpeg",
+            "-loglevel",
+            "warning",
+            "-f",
+            "image2",
+            "-nostdin",
+            "-c:v",
+            "rawvideo",
+            "-framerate",
+            str(self.fps),
+            "-video_size",
+            "{}x{}".format(self.frame_width, self.frame_height),
+            "-pixel_format",
+            "gray",
+            "-start_number",
+            str(first_frame),
+            "-i",
+            pjoin(path, "%08d.raw"),
+            "-y",
+            "-c:v",
+            "hevc",
+            "-g",
+            str(self.keyframe_interval),
+            "-q:v",
+            str(self.qp),
+            "-r",
+            str(self.fps),
+        ]
+        if n_frames is not None:
+            cmd += ["-frames:v", str(n_frames), "-x265-params", "open-gop=0", "-f", "matroska"]
+        return cmd + [str(output_video)]
+
     def _first_frame(self, path: str):
         assert pexists(path), "The frame directory does not exist"
         prop_files = list(sorted(scan_for_proper_files(path)))
@@ -308,9 +401,15 @@ class Results:
         return self.x265_params
 
     def _convert_microphone(self) -> None:
+        microphone_samples = self.coll.microphone_samples_path
         microphone_input = self.coll.microphone_wav_path
         microphone_output = self.coll.microphone_flac_path
-        if pexists(microphone_input):
+        if pexists(microphone_samples):
+            logging.info("Compressing microphone data.")
+            self._encode_microphone_samples(str(microphone_samples), str(microphone_output))
+            write_hash_file(microphone_output)
+            os.remove(microphone_samples)
+        elif pexists(microphone_input):
             logging.info("Compressing microphone data.")
             CallTools.stream_cmd_call(
                 [
@@ -327,6 +426,41 @@ class Results:
             write_hash_file(microphone_output)
             os.remove(microphone_input)
 
+    def _encode_microphone_samples(self, samples_path: str, output: str) -> None:
+        """Pipes the samples recorded by Microphone into ffmpeg, without writing a WAV file first."""
+        samples = SensorRecorder.load(samples_path)["value"]
+        proc = subprocess.Popen(
+            [
+                "ffmpeg",
+                "-loglevel",
+                "warning",
+                "-f",
+                "s32le",
+                "-ar",
+                str(config.sensors["microphone.sample_rate"]),
+                "-ac",
+                "1",
+                "-i",
+                "-",
+                "-compression_level",
+                str(config["sauron.data.audio.flac_compression_level"]),
+                "-c:a",
+                "flac",
+                "-y",
+                output,
+            ],
+            stdin=subprocess.PIPE,
+        )
+        try:
+            for i in range(0, len(samples), 1024):
+                proc.stdin.write(samples[i : i + 1024].tobytes())
+        finally:
+            proc.stdin.close()
+        if proc.wait() != 0:
+            raise BadCommandError(
+                "ffmpeg exited with {} encoding {}".format(proc.returncode, samples_path)
+            )
+
     def _trim_frames(self) -> None:
         """Trims the frames that were captured before the first stimulus or after the last.
         This works because StimulusTimeLog is defined to have its head be the start of the run and its tail be the end of the run, regardless of the stimuli.
@@ -362,33 +496,39 @@ class Results:
         fixit("start")
         fixit("end")
 
-        stimulus_time_log = self._parse_stimulus_timing_file(self.coll.stimulus_timing_log_file)
-        if len(stimulus_time_log) == 0:
+        frames = sorted(scan_for_proper_files(self.coll.outer_frames_dir))
+        plan = self._plan_trim(len(frames))
+        if plan is None:
             return  # ok; nothing to remove
-        snapshots = [
-            parse_local_iso_datetime(snap) for snap in lines(self.coll.snapshot_timing_log_file)
-        ]
-        first_stimulus = stimulus_time_log[0]  # type: datetime
-        last_stimulus = stimulus_time_log[-1]  # type: datetime
-        trimmings_start = []
-        trimmings_end = []
-        ran_off_end = 0
-        my_files = enumerate(sorted(scan_for_proper_files(self.coll.outer_frames_dir)))
-        for i, frame in my_files:
-            if i >= len(snapshots):
-                ran_off_end += 1
-            elif snapshots[i] < first_stimulus:
-                trimmings_start.append(frame)
-            elif snapshots[i] > last_stimulus:
-                trimmings_end.append(frame)
-        if ran_off_end > 0:
-            logging.error("{} stimuli occurred after the last snapshot!")
-            warn_user("{} stimuli occurred after the last snapshot!")
+        start, stop, n_covered = plan
+        trimmings_start = frames[:start]
+        trimmings_end = frames[stop:n_covered]
 
         make_dirs_perm(self.coll.trimmed_dir)
         self._make_trimmings_video(trimmings_start, "start")
         self._make_trimmings_video(trimmings_end, "end")
 
+    def _plan_trim(self, n_frames: int) -> Optional[Tuple[int, int, int]]:
+        """
+        Finds which frames to keep: those captured between the first and last stimulus.
+        Returns the indices (into the sorted frames) of the first kept frame, one past the last kept frame,
+        and the number of frames that have a timestamp; or None if there were no stimuli.
+        """
+        stimulus_time_log = self._parse_stimulus_timing_file(self.coll.stimulus_timing_log_file)
+        if len(stimulus_time_log) == 0:
+            return None
+        snapshots = self._snapshot_timing()
+        n_covered = min(n_frames, len(snapshots))
+        # the camera's counter is monotonic, so the snapshots are sorted
+        covered = snapshots[:n_covered]
+        start = int(np.searchsorted(covered, stimulus_time_log[0], side="left"))
+        stop = int(np.searchsorted(covered, stimulus_time_log[-1], side="right"))
+        if n_frames > len(snapshots):
+            msg = "{} frames occurred after the last snapshot!".format(n_frames - len(snapshots))
+            logging.error(msg)
+            warn_user(msg)
+        return start, stop, n_covered
+
     def _make_trimmings_video(self, trimmings, name):
         output_video = (
             self.coll.trimmed_start_video if name == "start" else self.coll.trimmed_end_video
@@ -412,16 +552,7 @@ class Results:
                 )
             )
         if len(trimmings) == 0:
-            logging.error("No {} trimmed frames".format(name))
-            warn_user(
-                "No {} trimmed frames.".format(name),
-                "Increase {} in {} to ensure that frames aren't lost.".format(
-                    "padding_before_milliseconds"
-                    if name == "start"
-                    else "padding_after_milliseconds",
-                    config.path,
-                ),
-            )
+            self._warn_no_trimmings(name)
             return
         # moving to another disk is a little slower
         # but we don't want these deleted if sauronx fails
@@ -436,49 +567,64 @@ class Results:
                 )  # we HAVE to move here so they're not seen when making the primary video
         self._run_ffmpeg(tmpdir, output_video)
 
-    def _parse_stimulus_timing_file(self, path: str) -> List[datetime]:
+    def _warn_no_trimmings(self, name: str) -> None:
+        logging.error("No {} trimmed frames".format(name))
+        warn_user(
+            "No {} trimmed frames.".format(name),
+            "Increase {} in {} to ensure that frames aren't lost.".format(
+                "padding_before_milliseconds" if name == "start" else "padding_after_milliseconds",
+                config.path,
+            ),
+        )
+
+    def _parse_stimulus_timing_file(self, path: str) -> np.ndarray:
         # datetime,id,intensity
-        return [parse_local_iso_datetime(line.split(",")[0]) for line in list(lines(path))[1:]]
+        return np.array([line.split(",")[0] for line in list(lines(path))[1:]], dtype="datetime64[us]")
 
-    def _parse_frame_timing_file(self):
-        strftime_fmt = "%Y-%m-%dT%H:%M:%S.%f"
+    def _parse_frame_timing_file(self) -> None:
+        """
+        Converts the camera's raw timing log into one ISO datetime per frame.
+        The raw file has the start datetime on the first line, then a counter (in nanoseconds) per frame;
+        the first counter value is the reference and does not get a line of its own.
+        """
         raw_timing_file_path = self.coll.raw_snapshot_timing_log_file
         proc_timing_file_path = self.coll.snapshot_timing_log_file
         CallTools.stream_cmd_call(["sudo", "chmod", "777", raw_timing_file_path])
-        with open(raw_timing_file_path, "r+", encoding="utf8") as f:
-            with open(proc_timing_file_path, "w", encoding="utf8") as o:
-                reader = csv.reader(f)
-                # get the two header lines?
-                prev_datetime = parser.parse(next(reader)[0])
-                # o.write("{}\n".format(prev_datetime.strftime(strftime_fmt))) # 20180920 added acquisition of an extra, unsaved frame before main acquisition loop
-                prev_us = int(next(reader)[0]) / 1000
-                for row in reader:
-                    curr_us = int(row[0]) / 1000
-                    diff_us = curr_us - prev_us
-                    new_datetime = prev_datetime + timedelta(microseconds=diff_us)
-                    o.write("{}\n".format(new_datetime.strftime(strftime_fmt)))
-                    prev_datetime = new_datetime
-                    prev_us = curr_us
+        with open(raw_timing_file_path, "r", encoding="utf8") as f:
+            # strftime below ignored any time zone, so drop it here too
+            started = parser.parse(next(csv.reader(f))[0]).replace(tzinfo=None)
+            counter = np.loadtxt(f, dtype=np.int64, delimiter=",", usecols=0, ndmin=1)
+        # round each step to microseconds before summing, just as adding timedeltas frame-by-frame did
+        steps = np.round(np.diff(counter / 1000)).astype(np.int64)
+        times = np.datetime64(started, "us") + np.cumsum(steps).astype("timedelta64[us]")
+        self._snapshot_times = times
+        with open(proc_timing_file_path, "w", encoding="utf8") as o:
+            o.write("".join(t + "\n" for t in np.datetime_as_string(times, unit="us")))
+        logging.info("Wrote {} frame timestamps to {}".format(len(times), proc_timing_file_path))
+
+    def _snapshot_timing(self) -> np.ndarray:
+        if self._snapshot_times is None:
+            self._snapshot_times = np.array(
+                list(lines(self.coll.snapshot_timing_log_file)), dtype="datetime64[us]"
+            )
+        return self._snapshot_times
 
     def _attempt_upload(self) -> None:
         logging.info("Uploading data via SSH...")
-        self._scp_files()
+        self._upload_files()
         logging.info("Finished uploading data via SSH")
 
-    def _scp_files(self) -> None:
-        CallTools.stream_cmd_call(
-            [
-                "scp",
-                "-r",
-                "-C",
-                os.path.normpath(self.output_dir),
-                str(self.upload_params["ssh_username"])
-                + "@"
-                + str(self.upload_params["hostname"])
-                + ":"
-                + self._remote_upload_dir,
-            ]
+    def _upload_files(self) -> None:
+        max_kbps = config.get("connection.upload.max_kbps", None)
+        uploader = Uploader(
+            str(self.upload_params["ssh_username"]) + "@" + str(self.upload_params["hostname"]),
+            self._remote_upload_dir(),
+            upload_progress_file(self.submission_hash),
+            n_connections=int(config.get("connection.upload.n_connections", 4)),
+            chunk_bytes=int(config.get("connection.upload.chunk_mb", 64)) * 1024 * 1024,
+            max_bytes_per_second=None if max_kbps is None else float(max_kbps) * 1000 / 8,
         )
+        uploader.upload(str(self.output_dir))
         # noinspection PyBroadException
         try:
             self.sx_alive.notify_finished()
@@ -488,15 +634,7 @@ class Results:
 
     def _remote_upload_dir(self) -> str:
         remote_dir = self.upload_params["remote_upload_path"]  # type: str
-        return (
-            str(self.upload_params["ssh_username"])
-            + "@"
-            + str(self.upload_params["hostname"])
-            + ":"
-            + remote_dir
-            if remote_dir.endswith(os.sep)
-            else remote_dir + os.sep
-        )
+        return remote_dir if remote_dir.endswith("/") else remote_dir + "/"
 
 
 __all__ = ["Results"]
@@ -9,7 +9,7 @@ from valarpy import Valar
 
 from .alive import SauronxAlive, StatusValue
 from .global_audio import SauronxAudio
-from .locks import SauronxLock
+from .locks import PostProcessingQueue, SauronxLock
 from .preview import *
 from .prototype import Prototyper
 from .results import Results
@@ -29,9 +29,23 @@ class _SubmissionMode(RunMode, ABC):
         notify_user("Starting at {}".format(pretty_timestamp_started))
         logging.info("Submission start time: ".format(plain_timestamp_started_with_millis))
 
-    def _log_finish(self, local: bool, submission_hash: str, halt_after_acquisition: bool) -> None:
+    def _log_finish(
+        self,
+        local: bool,
+        submission_hash: str,
+        halt_after_acquisition: bool,
+        queued: bool = False,
+    ) -> None:
         if halt_after_acquisition:
             success_to_user("Exiting. Handing off processing of results.")
+        elif queued:
+            success_to_user(
+                "Finished capturing {}. You can start the next plate now.".format(submission_hash),
+                "The video will be made{} in the background.".format(
+                    "" if local else " and uploaded"
+                ),
+                "Run 'sauronx status' to check on it.",
+            )
         elif local:
             success_to_user(
                 "All done! The data will be stored locally.",
@@ -73,6 +87,7 @@ class SubmitMode(_SubmissionMode):
             plot_audio=plot_audio,
             halt_after_acquisition=halt_after_acquisition,
             ignore_prior=ignore_prior,
+            postprocess_async=bool(config.get("sauron.data.postprocess_async", True)),
         )
         SauronxLock().lock(None)
         try:
@@ -86,8 +101,8 @@ class SubmitMode(_SubmissionMode):
                     # TODO datetime_started only applies to the first hash. Is this really what we want?
                     self._log_start(args.local, h)
                     # we don't need a new process for the last run
-                    ss.run(h, i == len(hashes) - 1)
-                    self._log_finish(args.local, h, halt_after_acquisition)
+                    queued = ss.run(h, i == len(hashes) - 1)
+                    self._log_finish(args.local, h, halt_after_acquisition, queued)
         finally:
             if not keep_lock:
                 SauronxLock().unlock(ignore_warning=True)
@@ -161,6 +176,8 @@ class TestMode(RunMode):
             plot_audio=plot_audio,
             halt_after_acquisition=False,
             ignore_prior=True,
+            # the output is deleted afterward unless keep is set
+            postprocess_async=False,
         )
         with Valar() as db:
             SauronxLock().lock(None)
@@ -198,6 +215,7 @@ class ProceedMode(_SubmissionMode):
                 results.make_video()
             if not local:
                 results.upload()
+        PostProcessingQueue().forget_failed(submission_hash)
         self._log_finish(local, submission_hash, False)
 
 
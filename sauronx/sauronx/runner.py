@@ -1,16 +1,17 @@
 from datetime import datetime, timedelta
-from multiprocessing import Process
 import psutil
 from pocketutils.core.exceptions import RefusingRequestError
 from pocketutils.tools.console_tools import ConsoleTools
 from valarpy import Valar
 from .alive import SauronxAlive, StatusValue
 from .global_audio import SauronxAudio
-from .locks import SauronxLock
+from .locks import PostProcessingJob, PostProcessingQueue, SauronxLock
+from .postprocessing import PostProcessor
 from .preview import *
 from .protocol import ProtocolBlock
 from .results import Results
 from .submission import CompletedRunInfo, RunArguments, Submitter
+from .submission_index import SubmissionIndex
 from .utils import notify_user, prompt_yes_no, nice_time
 from .utils import fsize as filesize
 class SubmissionRunnerArgs:
@@ -26,6 +27,7 @@ class SubmissionRunnerArgs:
         plot_audio: bool,
         halt_after_acquisition: bool,
         ignore_prior: bool,
+        postprocess_async: bool = True,
     ):
         self.local = local
         self.dark = dark
@@ -37,6 +39,7 @@ class SubmissionRunnerArgs:
         self.plot_audio = plot_audio
         self.halt_after_acquisition = halt_after_acquisition
         self.ignore_prior = ignore_prior
+        self.postprocess_async = postprocess_async
 
 
 class SubmissionRunner:
@@ -48,11 +51,14 @@ class SubmissionRunner:
         self._audio = audio
         self._board = b
 
-    def run(self, submission_hash: str, last_run: bool):
+    def run(self, submission_hash: str, last_run: bool) -> bool:
+        """
+        Captures the submission.
+        Returns True if its post-processing was queued to run in the background.
+        """
         output_dir = config.get_output_dir(submission_hash)
         raw_frames_output_dir = config.get_raw_frames_dir(submission_hash)
         self._ensure_sufficient_storage(submission_hash)
-        logging.debug("Will {}start new process".format("" if not last_run else "not "))
         logging.debug(
             "Will {}shut board and audio down after capture finishes".format(
                 "" if last_run else "not "
@@ -82,6 +88,22 @@ class SubmissionRunner:
             ) as results:
                 results.initialize_dir()
                 self._run_single(alive, battery, run_args, results, last_run)
+                if not self._args.halt_after_acquisition and not self._args.postprocess_async:
+                    self._handle_results(results)
+        # queue only now that SauronxAlive has released the submission to the post-processor
+        if self._args.halt_after_acquisition or not self._args.postprocess_async:
+            return False
+        PostProcessingQueue().put(
+            PostProcessingJob(
+                submission_hash,
+                local=self._args.local,
+                store_to=self._args.store_to,
+                keep_frames=self._args.keep_frames,
+                assume_clean=self._args.assume_clean,
+            )
+        )
+        PostProcessor.ensure_running()
+        return True
 
     def _prompt(self, alive: SauronxAlive, battery: ProtocolBlock, run_args: RunArguments):
         if alive.is_test:
@@ -160,7 +182,15 @@ class SubmissionRunner:
         try:
             b.ir_on()
             submitter = Submitter(alive, battery, run_args, audio, b)
-            run_info = submitter.submit()  # type: CompletedRunInfo
+            # start encoding the video while the camera is still writing frames
+            encoder = results.segment_encoder() if results.segmented else None
+            if encoder is not None:
+                encoder.follow()
+            try:
+                run_info = submitter.submit()  # type: CompletedRunInfo
+            finally:
+                if encoder is not None:
+                    encoder.stop()
             # Save the timing info ASAP; we can't in proceed().
             # It would be nice to shut everything down earlier, but preserve the data at all costs.
             results.finalize(run_info)
@@ -174,18 +204,13 @@ class SubmissionRunner:
             b.finish()
             audio.stop()
             raise
-        # we need to handle these cases separately
+        # otherwise the next run needs the board and audio; it takes the lock over
         if last_run:
             # don't do this after unlocking because shutting down the board and audio
             # could interfere with another process that gets run after the unlock!!!
             b.finish()
             audio.stop()
             SauronxLock().unlock()
-            if not self._args.halt_after_acquisition:
-                self._handle_results(results, alive)
-        elif not self._args.halt_after_acquisition:
-            p = Process(target=self._handle_results, args=(results,))
-            p.start()
 
     def _handle_already_exists(self, output_dir: str, raw_frames_output_dir: str):
         if self._args.overwrite and (
@@ -194,10 +219,11 @@ class SubmissionRunner:
             logging.info("Deleting previous run at {}".format(output_dir))
             if os.path.exists(output_dir):
                 ConsoleTools.slow_delete(output_dir, 3)
+            SubmissionIndex().forget(output_dir)
             if os.path.exists(raw_frames_output_dir) and not self._args.assume_clean:
                 ConsoleTools.slow_delete(raw_frames_output_dir, 3)
 
-    def _handle_results(self, results: Results, alive: SauronxAlive) -> None:
+    def _handle_results(self, results: Results) -> None:
         if self._args.store_to is None:
             results.make_video()
             if not self._args.local:
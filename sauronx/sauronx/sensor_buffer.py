@@ -0,0 +1,210 @@
+import datetime
+import logging
+import os
+import threading
+import time
+from typing import Optional, Tuple
+
+import numpy as np
+
+_NPY_MAGIC = b"\x93NUMPY\x01\x00"
+# wide enough for any count, so the header never changes length
+_SHAPE_WIDTH = 20
+
+
+class SampleRing:
+    """
+    A preallocated ring of fixed-width records, for one producer thread and one consumer thread.
+    Neither side takes a lock or allocates a buffer:
+    the producer writes a record and only then advances ``head``,
+    and the consumer copies records and only then advances ``tail``.
+    Each counter is written by one thread only.
+    If the consumer falls behind by more than ``capacity`` records,
+    new records are dropped (and counted) rather than blocking the producer.
+    """
+
+    def __init__(self, dtype: np.dtype, capacity: int) -> None:
+        if capacity < 1:
+            raise ValueError("Capacity must be positive")
+        self.dtype = np.dtype(dtype)
+        self.capacity = capacity
+        self._buffer = np.zeros(capacity, dtype=self.dtype)
+        self._head = 0
+        self._tail = 0
+        self.n_dropped = 0
+
+    def put(self, t_ns: int, value) -> bool:
+        head = self._head
+        if head - self._tail >= self.capacity:
+            self.n_dropped += 1
+            return False
+        record = self._buffer[head % self.capacity]
+        record["t_ns"] = t_ns
+        record["value"] = value
+        self._head = head + 1
+        return True
+
+    def __len__(self) -> int:
+        return self._head - self._tail
+
+    @property
+    def n_put(self) -> int:
+        """The number of records ever put (not counting dropped ones)."""
+        return self._head
+
+    def take(self) -> np.ndarray:
+        """Copies out and removes every record written so far, oldest first."""
+        head, tail = self._head, self._tail
+        if head == tail:
+            return self._buffer[:0].copy()
+        i, j = tail % self.capacity, head % self.capacity
+        if i < j:
+            taken = self._buffer[i:j].copy()
+        else:
+            taken = np.concatenate([self._buffer[i:], self._buffer[:j]])
+        self._tail = head
+        return taken
+
+
+class NpyAppender:
+    """
+    Appends records to a ``.npy`` file.
+    The count in the header is rewritten after each block, so ``np.load`` can always read the file,
+    and it keeps everything up to the last block if the process dies.
+    """
+
+    def __init__(self, path: str, dtype: np.dtype) -> None:
+        self.path = path
+        self.dtype = np.dtype(dtype)
+        self.n = 0
+        self._file = open(path, "wb")
+        self._write_header()
+
+    def append(self, records: np.ndarray) -> None:
+        if len(records) == 0:
+            return
+        self._file.seek(0, os.SEEK_END)
+        self._file.write(np.ascontiguousarray(records, dtype=self.dtype).tobytes())
+        self.n += len(records)
+        self._write_header()
+        self._file.flush()
+
+    def close(self) -> None:
+        self._file.close()
+
+    def _write_header(self) -> None:
+        header = "{{'descr': {!r}, 'fortran_order': False, 'shape': ({:>{}d},), }}".format(
+            np.lib.format.dtype_to_descr(self.dtype), self.n, _SHAPE_WIDTH
+        )
+        # magic, 2 bytes of length, then the header padded so that the data is 64-byte aligned
+        n_pad = -(len(_NPY_MAGIC) + 2 + len(header) + 1) % 64
+        header = (header + " " * n_pad + "\n").encode("latin1")
+        self._file.seek(0)
+        self._file.write(_NPY_MAGIC + len(header).to_bytes(2, "little") + header)
+
+
+class SensorRecorder:
+    """
+    Records timestamped sensor samples without formatting or writing on the caller's thread.
+    ``put`` copies a sample into a ``SampleRing``.
+    A background thread drains it every ``interval`` seconds (or once ``block_records`` are waiting)
+    and appends the block to a ``.npy`` file with fields ``t_ns`` and ``value``.
+    Timestamps are from ``time.monotonic_ns`` (CLOCK_MONOTONIC), which never jumps like wall time.
+    One wall-clock datetime is taken with the first reading, and ``datetimes`` converts with it.
+    The usage is:
+            recorder = SensorRecorder(path, np.dtype("<f8"), 65536)
+            recorder.start()
+            recorder.put(value)  # from the acquisition thread
+            recorder.close()
+            samples = SensorRecorder.load(path)
+    """
+
+    def __init__(
+        self,
+        path: str,
+        value_dtype: np.dtype,
+        capacity: int,
+        block_records: Optional[int] = None,
+        interval: float = 1.0,
+    ) -> None:
+        self.path = path
+        value_dtype = np.dtype(value_dtype)
+        if value_dtype.subdtype is not None:
+            base, shape = value_dtype.subdtype
+            self.dtype = np.dtype([("t_ns", "<i8"), ("value", base, shape)])
+        else:
+            self.dtype = np.dtype([("t_ns", "<i8"), ("value", value_dtype)])
+        self.ring = SampleRing(self.dtype, capacity)
+        self.block_records = max(1, capacity // 4) if block_records is None else block_records
+        self.interval = interval
+        self.anchor = None  # type: Optional[Tuple[datetime.datetime, int]]
+        self._appender = None  # type: Optional[NpyAppender]
+        self._stopping = threading.Event()
+        self._wake = threading.Event()
+        self._thread = None  # type: Optional[threading.Thread]
+
+    def start(self) -> None:
+        self.anchor = (datetime.datetime.now(), time.monotonic_ns())
+        self._appender = NpyAppender(self.path, self.dtype)
+        self._stopping.clear()
+        self._thread = threading.Thread(
+            target=self._drain_loop, name="recorder-" + os.path.basename(self.path), daemon=True
+        )
+        self._thread.start()
+
+    def put(self, value, t_ns: Optional[int] = None) -> None:
+        self.ring.put(time.monotonic_ns() if t_ns is None else t_ns, value)
+        if len(self.ring) >= self.block_records:
+            self._wake.set()
+
+    def flush(self) -> None:
+        """Waits until everything recorded so far is in the file."""
+        if self._thread is not None and self._thread.is_alive():
+            # let the writer do it, since the ring only has one consumer
+            target = self.ring.n_put
+            self._wake.set()
+            while self._appender.n < target and self._thread.is_alive():
+                time.sleep(0.01)
+
+    def close(self) -> int:
+        """Stops the writer, writes the rest, and returns the number of records."""
+        if self._thread is None:
+            return 0
+        self._stopping.set()
+        self._wake.set()
+        self._thread.join()
+        self._thread = None
+        self._appender.append(self.ring.take())
+        self._appender.close()
+        if self.ring.n_dropped > 0:
+            logging.error(
+                "Dropped {} samples recording {}; the writer fell behind".format(
+                    self.ring.n_dropped, self.path
+                )
+            )
+        logging.debug("Wrote {} samples to {}".format(self._appender.n, self.path))
+        return self._appender.n
+
+    def datetimes(self, t_ns: np.ndarray) -> np.ndarray:
+        """Converts monotonic timestamps from this recorder to wall-clock ``datetime64[us]``."""
+        started, started_ns = self.anchor
+        return np.datetime64(started, "us") + ((t_ns - started_ns) // 1000).astype(
+            "timedelta64[us]"
+        )
+
+    @classmethod
+    def load(cls, path: str) -> np.ndarray:
+        return np.load(path, mmap_mode="r")
+
+    def _drain_loop(self) -> None:
+        while not self._stopping.is_set():
+            self._wake.wait(self.interval)
+            self._wake.clear()
+            # noinspection PyBroadException
+            try:
+                self._appender.append(self.ring.take())
+            except Exception:
+                logging.exception("Failed writing samples to {}".format(self.path))
+
+
+__all__ = ["SampleRing", "NpyAppender", "SensorRecorder"]
@@ -1,12 +1,13 @@
 import datetime
 import logging
 import multiprocessing as mp
+import os
 import threading
 import wave
 from enum import Enum
 from multiprocessing import Process
 from os.path import dirname
-from typing import Dict, List
+from typing import Dict, List, Optional
 import scipy
 import numpy as np
 import pandas as pd
@@ -18,6 +19,7 @@ import hipsterplot
 from .arduino import Board
 from .configuration import config
 from .paths import *
+from .sensor_buffer import SensorRecorder
 from .utils import make_dirs, warn_user, stamp, pjoin
 
 class SensorParams:
@@ -86,6 +88,12 @@ class Sensor:
 
 
 class Microphone(Sensor):
+    """
+    Records the microphone into a ``SensorRecorder``, one record per buffer, with its timestamp.
+    ``save`` writes the timestamps.
+    The samples stay in ``microphone_log.npy`` until Results encodes them to FLAC.
+    A sound test (``test``) also writes them to the WAV file it was given.
+    """
 
     triggers = [SensorTrigger.EXPERIMENT_START, SensorTrigger.SOUND_TEST]
 
@@ -95,8 +103,8 @@ class Microphone(Sensor):
         self.coll = config.get_coll(self.params.output_dir)
         self._stream = None
         self._p = None
-        self._timestamps = None
-        self._frames = None
+        self._recorder = None  # type: Optional[SensorRecorder]
+        self.timestamps = None
         self.audio_format = pyaudio.paInt32
         self.channels = 1
         self.sample_rate = int(config.sensors["microphone.sample_rate"])
@@ -106,30 +114,35 @@ class Microphone(Sensor):
         self._thread = threading.Thread(target=self._record)
 
     def file_path(self) -> str:
-        # TODO
-        return self.coll.microphone_wav_path()
+        return str(self.coll.microphone_wav_path)
+
+    def samples_path(self) -> str:
+        return str(self.coll.microphone_samples_path)
 
     def timestamp_file_path(self) -> str:
-        # TODO
-        return self.coll.microphone_timestamps_path()
+        return str(self.coll.microphone_timestamps_path)
 
     def start(self, **kwargs) -> None:
-        logging.debug("Recording {} to {}".format(self.name(), self.file_path()))
-        self.log_file = self.file_path()
-        self._init()
+        logging.debug("Recording {} to {}".format(self.name(), self.samples_path()))
+        self.log_file = None
+        self._init(self.samples_path())
         self._thread.start()
 
     def test(self, **kwargs) -> None:
         log_file_path = kwargs["log_file_path"]
         self.log_file = log_file_path
         logging.debug("Recording {} to {}".format(self.name(), log_file_path))
-        self._init()
+        self._init(log_file_path + ".npy")
         self._record()
 
-    def _init(self):
-        make_dirs(dirname(self.log_file))
+    def _init(self, samples_path: str):
+        make_dirs(dirname(samples_path))
         self.timestamps = []
-        self.frames = []
+        # room for about 10 seconds of audio in case the writer falls behind
+        capacity = max(16, 10 * self.sample_rate // self.frames_per_buffer)
+        self._recorder = SensorRecorder(
+            samples_path, np.dtype(("<i4", (self.frames_per_buffer * self.channels,))), capacity
+        )
         try:
             self._p = pyaudio.PyAudio()
             self._stream = self._p.open(
@@ -143,6 +156,7 @@ class Microphone(Sensor):
             logging.exception("Failed to start microphone.")
             warn_user("Failed to start microphone.")
             raise e
+        self._recorder.start()
         self.should_kill = [False]
 
     def _record(self) -> None:
@@ -150,8 +164,7 @@ class Microphone(Sensor):
         try:
             while not self.should_kill[0]:
                 data = self._stream.read(self.frames_per_buffer)
-                self.frames.append(data)
-                self.timestamps.append(datetime.datetime.now())
+                self._recorder.put(np.frombuffer(data, dtype="<i4"))
         except Exception as e:
             logging.exception("Microphone failed while capturing")
             warn_user("Microphone failed while capturing")
@@ -165,32 +178,46 @@ class Microphone(Sensor):
     def save(self):
         try:
             logging.info("Writing microphone data...")
+            if self.should_kill[0]:
+                self._recorder.close()
+            else:
+                self._recorder.flush()
+            samples = SensorRecorder.load(self._recorder.path)
+            times = self._recorder.datetimes(samples["t_ns"])
+            self.timestamps = times.astype(datetime.datetime).tolist()
             logging.debug("Writing microphone timestamps")
             with open(self.timestamp_file_path(), "w") as f:
-                for ts in self.timestamps:
-                    f.write(stamp(ts) + "\n")
-            logging.debug("Writing microphone WAV data")
-            wf = wave.open(self.log_file, "wb")
-            try:
-                wf.setnchannels(self.channels)
-                wf.setsampwidth(self._p.get_sample_size(self.audio_format))
-                wf.setframerate(self.sample_rate)
-                wf.writeframes(b"".join(self.frames))
-            finally:
-                wf.close()
+                f.write("".join(t + "\n" for t in np.datetime_as_string(times, unit="us")))
+            if self.log_file is not None:
+                logging.debug("Writing microphone WAV data")
+                wf = wave.open(self.log_file, "wb")
+                try:
+                    wf.setnchannels(self.channels)
+                    wf.setsampwidth(pyaudio.get_sample_size(self.audio_format))
+                    wf.setframerate(self.sample_rate)
+                    for i in range(0, len(samples), 1024):
+                        wf.writeframes(samples["value"][i : i + 1024].tobytes())
+                finally:
+                    wf.close()
+                # the WAV has everything, as for the CSV of a CsvSensor
+                if self.should_kill[0]:
+                    del samples
+                    os.remove(self._recorder.path)
         except Exception as e:
-            warn_user("Microphone failed while writing the .wav file")
+            warn_user("Microphone failed while writing its data")
             raise e
         logging.info("Finished writing microphone data.")
 
     def plot(self):
         logging.info("Plotting microphone data (may take a couple minutes)...")
         logging.warning("Sometimes plotting the microphone data can crash the interpreter.")
-        from scipy.io import wavfile
+        if self._recorder is not None and os.path.exists(self._recorder.path):
+            data = SensorRecorder.load(self._recorder.path)["value"].ravel()
+        else:
+            from scipy.io import wavfile
 
-        with open(self.file_path(), "rb") as f:
-            sampling_rate, data = wavfile.read(f)
-            ms = np.array([i / sampling_rate * 1000 for i in range(0, len(data))])
+            with open(self.file_path() if self.log_file is None else self.log_file, "rb") as f:
+                sampling_rate, data = wavfile.read(f)
         low_x = self.timestamps[0].strftime("%H:%M:%S")
         high_x = self.timestamps[-1].strftime("%H:%M:%S")
         s = hipsterplot.plot(
@@ -226,28 +253,52 @@ class Microphone(Sensor):
 
 
 class CsvSensor(Sensor):
+    """
+    Records an analog pin into a ``SensorRecorder``, so the board's callback only copies the value.
+    The CSV is written by ``save``, which ``term`` calls.
+    """
+
+    def __init__(self, params: SensorParams) -> None:
+        super(CsvSensor, self).__init__(params)
+        self.board = None
+        self._recorder = None  # type: Optional[SensorRecorder]
+
+    def samples_path(self) -> str:
+        return os.path.splitext(self.file_path())[0] + ".npy"
+
     def _record(self, data) -> None:
-        self.vals.append((data[2], datetime.datetime.now()))
+        self._recorder.put(data[2])
 
     def start(self, **kwargs) -> None:
-        logging.debug("Recording {} to {}".format(self.name(), self.file_path()))
+        logging.debug("Recording {} to {}".format(self.name(), self.samples_path()))
         self.board = self._get_board(kwargs)
         make_dirs(dirname(self.file_path()))
+        self._recorder = SensorRecorder(self.samples_path(), np.dtype("<f8"), 65536)
+        self._recorder.start()
         self.board.register_sensor(self.pin, self._record)
 
     def test(self, **kwargs) -> None:
         self.start(**kwargs)
 
     def term(self):
-        self.save()
         if self.board is not None:  # None if it failed before initializing
             self.board.reset_sensor(self.pin)
+        if self._recorder is not None:
+            self._recorder.close()
+        self.save()
+        if self._recorder is not None and os.path.exists(self._recorder.path):
+            os.remove(self._recorder.path)
 
     def save(self):
         with open(self.file_path(), "w", encoding="utf8") as log_file:
             log_file.write("Value,Time\n")
-            for v, t in self.vals:
-                log_file.write("%s,%s\n" % (v, t))
+            if self._recorder is not None:
+                self._recorder.flush()
+                samples = SensorRecorder.load(self._recorder.path)
+                times = np.datetime_as_string(self._recorder.datetimes(samples["t_ns"]), unit="us")
+                for v, t in zip(samples["value"].tolist(), times):
+                    v = int(v) if v.is_integer() else v
+                    log_file.write("{},{}\n".format(v, t.replace("T", " ")))
         logging.info("Saved {} data".format(self.name()))
 
     def plot(self):
@@ -271,10 +322,8 @@ class Thermometer(CsvSensor):
 
     def __init__(self, params: SensorParams) -> None:
         super(Thermometer, self).__init__(params)
-        self.board = None
         self.params = params
         self.pin = int(config.sensors["analog_pins.thermometer"])
-        self.vals = []
 
     def file_path(self) -> str:
         return pjoin(self.params.output_dir, "sensors", "thermometer_log.csv")
@@ -287,7 +336,6 @@ class Photometer(CsvSensor):
         super(Photometer, self).__init__(params)
         self.params = params
         self.pin = int(config.sensors["analog_pins.photometer"])
-        self.vals = []
 
     def file_path(self) -> str:
         return pjoin(self.params.output_dir, "sensors", "photometer_log.csv")
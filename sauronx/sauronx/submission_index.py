@@ -0,0 +1,292 @@
+import json
+import logging
+import os
+import sqlite3
+import time
+from contextlib import contextmanager
+from enum import Enum
+from pathlib import Path
+from typing import Dict, Iterator, List, Optional, Set, Tuple, Union
+
+from .configuration import config
+from .paths import submission_index_file
+
+
+class LocalState(Enum):
+    """
+    Where a submission directory is in its local lifecycle, as recorded by Results.
+    This is separate from the status in Valar, which ``sauronx data`` still looks up.
+    """
+
+    INITIALIZED = 1
+    CAPTURED = 2
+    ENCODED = 3
+    UPLOADING = 4
+    UPLOADED = 5
+    FAILED_ENCODING = 6
+    FAILED_UPLOAD = 7
+
+
+class IndexedSubmission:
+    """
+    A row of the index: a submission directory and what was on disk the last time it changed.
+    """
+
+    def __init__(
+        self,
+        path: str,
+        submission_hash: str,
+        capture_completed: bool,
+        stimulus_completed: bool,
+        encoding_completed: bool,
+        recorded_state: Optional[LocalState],
+    ) -> None:
+        self.path = path
+        self.submission_hash = submission_hash
+        self.capture_completed = capture_completed
+        self.stimulus_completed = stimulus_completed
+        self.encoding_completed = encoding_completed
+        self.recorded_state = recorded_state
+
+    @property
+    def state(self) -> LocalState:
+        """The state Results recorded, or else the furthest state the files show."""
+        if self.recorded_state is not None:
+            return self.recorded_state
+        elif self.encoding_completed:
+            return LocalState.ENCODED
+        elif self.capture_completed and self.stimulus_completed:
+            return LocalState.CAPTURED
+        else:
+            return LocalState.INITIALIZED
+
+    @property
+    def is_uploaded(self) -> bool:
+        return self.state is LocalState.UPLOADED
+
+
+class SubmissionIndex:
+    """
+    A SQLite index of the submission directories on this machine and their local state,
+    so that listing them doesn't mean walking the output directories and checking each file again.
+
+    Results records state changes with ``record``,
+    and the runner and ``sauronx clean`` call ``forget`` when they delete a submission.
+    ``reconcile`` catches everything else (directories copied in, moved, or deleted by hand).
+    It relies on directory mtimes, which change when an entry is added, removed, or renamed:
+        - A directory that isn't a submission is listed again only if its mtime changed;
+          otherwise its subdirectories are taken from the index.
+        - A submission's files are checked again only if the mtime of the submission directory,
+          its timing directory, or its video directory changed, or if ``record`` was called since.
+    Each call opens and closes its own connection, so forked processes can use the index.
+    """
+
+    def __init__(self, path: Union[str, Path] = submission_index_file) -> None:
+        self.path = str(path)
+        with self._connect() as conn:
+            conn.executescript(
+                """
+                CREATE TABLE IF NOT EXISTS dirs (
+                    path TEXT PRIMARY KEY,
+                    mtime_ns INTEGER NOT NULL,
+                    is_submission INTEGER NOT NULL,
+                    children TEXT NOT NULL
+                );
+                CREATE TABLE IF NOT EXISTS submissions (
+                    path TEXT PRIMARY KEY,
+                    submission_hash TEXT NOT NULL,
+                    signature TEXT,
+                    capture_completed INTEGER NOT NULL DEFAULT 0,
+                    stimulus_completed INTEGER NOT NULL DEFAULT 0,
+                    encoding_completed INTEGER NOT NULL DEFAULT 0,
+                    state TEXT,
+                    state_changed REAL
+                );
+                CREATE INDEX IF NOT EXISTS submissions_hash ON submissions (submission_hash);
+                """
+            )
+
+    def reconcile(self, base_dir: str) -> List[IndexedSubmission]:
+        """
+        Updates the index with the submissions under ``base_dir`` and returns them, sorted.
+        A submission directory is one that contains ``submission_hash.txt``;
+        directories under it aren't searched.
+        """
+        base_dir = os.path.normpath(base_dir)
+        t0 = time.monotonic()
+        with self._connect() as conn:
+            dirs = {
+                row[0]: (row[1], bool(row[2]), json.loads(row[3]))
+                for row in conn.execute("SELECT path, mtime_ns, is_submission, children FROM dirs")
+            }  # type: Dict[str, Tuple[int, bool, List[str]]]
+            seen = set()  # type: Set[str]
+            found = list(self._walk(conn, dirs, seen, base_dir))
+            # remove anything under base_dir that no longer exists
+            prefix = base_dir.rstrip(os.sep) + os.sep
+            for table, keep in [("dirs", seen), ("submissions", set(found))]:
+                stale = [
+                    p
+                    for (p,) in conn.execute("SELECT path FROM {}".format(table))
+                    if (p == base_dir or p.startswith(prefix)) and p not in keep
+                ]
+                conn.executemany("DELETE FROM {} WHERE path=?".format(table), [(p,) for p in stale])
+            entries = [self._refresh(conn, path) for path in sorted(found)]
+        logging.debug(
+            "Reconciled {} submissions under {} in {:.2f}s".format(
+                len(entries), base_dir, time.monotonic() - t0
+            )
+        )
+        return [e for e in entries if e is not None]
+
+    def get(self, path: str) -> Optional[IndexedSubmission]:
+        with self._connect() as conn:
+            return self._fetch(conn, os.path.normpath(path))
+
+    def by_state(self, *states: LocalState) -> List[IndexedSubmission]:
+        """Gets the indexed submissions in any of ``states``, without checking the disk."""
+        with self._connect() as conn:
+            paths = [p for (p,) in conn.execute("SELECT path FROM submissions ORDER BY path")]
+            entries = [self._fetch(conn, p) for p in paths]
+        return [e for e in entries if e is not None and e.state in states]
+
+    def record(self, path: str, submission_hash: str, state: LocalState) -> None:
+        """
+        Records that the submission at ``path`` reached ``state``.
+        Its files will be checked again on the next ``reconcile``.
+        Never raises: the index is only a cache, so failing to write it shouldn't fail a run.
+        """
+        try:
+            with self._connect() as conn:
+                conn.execute(
+                    """
+                    INSERT INTO submissions (path, submission_hash, signature, state, state_changed)
+                    VALUES (?, ?, NULL, ?, ?)
+                    ON CONFLICT (path) DO UPDATE SET
+                        submission_hash=excluded.submission_hash, signature=NULL,
+                        state=excluded.state, state_changed=excluded.state_changed
+                    """,
+                    (os.path.normpath(path), submission_hash, state.name, time.time()),
+                )
+        except sqlite3.Error:
+            logging.exception("Failed to record state {} for {} in the index".format(state, path))
+
+    def forget(self, path: str) -> None:
+        """Removes a deleted submission directory from the index. Never raises."""
+        try:
+            with self._connect() as conn:
+                conn.execute("DELETE FROM submissions WHERE path=?", (os.path.normpath(path),))
+                conn.execute("DELETE FROM dirs WHERE path=?", (os.path.normpath(path),))
+        except sqlite3.Error:
+            logging.exception("Failed to remove {} from the index".format(path))
+
+    def _walk(self, conn: sqlite3.Connection, dirs, seen: Set[str], path: str) -> Iterator[str]:
+        if not os.path.isdir(path):
+            return
+        seen.add(path)
+        mtime_ns = os.stat(path).st_mtime_ns
+        if path in dirs and dirs[path][0] == mtime_ns:
+            _, is_submission, children = dirs[path]
+        else:
+            with os.scandir(path) as it:
+                entries = list(it)
+            is_submission = any(e.name == "submission_hash.txt" for e in entries)
+            children = (
+                []
+                if is_submission
+                else sorted(e.path for e in entries if e.is_dir(follow_symlinks=False))
+            )
+            conn.execute(
+                "INSERT OR REPLACE INTO dirs (path, mtime_ns, is_submission, children)"
+                " VALUES (?, ?, ?, ?)",
+                (path, mtime_ns, int(is_submission), json.dumps(children)),
+            )
+        if is_submission:
+            yield path
+        else:
+            for child in children:
+                yield from self._walk(conn, dirs, seen, child)
+
+    def _refresh(self, conn: sqlite3.Connection, path: str) -> Optional[IndexedSubmission]:
+        coll = config.get_coll(path)
+        signature = json.dumps(
+            [
+                self._mtime(path),
+                self._mtime(os.path.dirname(coll.snapshot_timing_log_file)),
+                self._mtime(os.path.dirname(coll.avi_file)),
+            ]
+        )
+        row = conn.execute("SELECT signature FROM submissions WHERE path=?", (path,)).fetchone()
+        if row is None or row[0] != signature:
+            try:
+                with open(os.path.join(path, "submission_hash.txt")) as f:
+                    submission_hash = f.read()
+            except OSError:
+                logging.warning("Skipping {}: can't read submission_hash.txt".format(path))
+                return None
+            conn.execute(
+                """
+                INSERT INTO submissions (path, submission_hash, signature,
+                    capture_completed, stimulus_completed, encoding_completed)
+                VALUES (?, ?, ?, ?, ?, ?)
+                ON CONFLICT (path) DO UPDATE SET
+                    submission_hash=excluded.submission_hash, signature=excluded.signature,
+                    capture_completed=excluded.capture_completed,
+                    stimulus_completed=excluded.stimulus_completed,
+                    encoding_completed=excluded.encoding_completed
+                """,
+                (
+                    path,
+                    submission_hash,
+                    signature,
+                    int(self._check(coll.snapshot_timing_exists)),
+                    int(self._check(coll.stimulus_timing_exists)),
+                    int(self._check(coll.avi_exists)),
+                ),
+            )
+        return self._fetch(conn, path)
+
+    def _fetch(self, conn: sqlite3.Connection, path: str) -> Optional[IndexedSubmission]:
+        row = conn.execute(
+            """
+            SELECT path, submission_hash,
+                capture_completed, stimulus_completed, encoding_completed, state
+            FROM submissions WHERE path=?
+            """,
+            (path,),
+        ).fetchone()
+        if row is None:
+            return None
+        return IndexedSubmission(
+            row[0],
+            row[1],
+            bool(row[2]),
+            bool(row[3]),
+            bool(row[4]),
+            None if row[5] is None else LocalState[row[5]],
+        )
+
+    def _check(self, exists) -> bool:
+        # a file that vanished or can't be read counts as missing; one submission mustn't stop ls
+        try:
+            return exists()
+        except OSError:
+            logging.debug("Failed checking files in submission", exc_info=True)
+            return False
+
+    def _mtime(self, path) -> int:
+        try:
+            return os.stat(path).st_mtime_ns
+        except FileNotFoundError:
+            return -1
+
+    @contextmanager
+    def _connect(self) -> Iterator[sqlite3.Connection]:
+        conn = sqlite3.connect(self.path, timeout=30)
+        try:
+            yield conn
+            conn.commit()
+        finally:
+            conn.close()
+
+
+__all__ = ["SubmissionIndex", "IndexedSubmission", "LocalState"]
@@ -0,0 +1,289 @@
+import hashlib
+import json
+import logging
+import os
+import shlex
+import subprocess
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Dict, List, Optional, Union
+
+from pocketutils.core.exceptions import BadCommandError
+
+from .utils import pexists, pjoin
+
+
+class _Throttle:
+    """Caps the total rate of bytes sent by all threads together."""
+
+    def __init__(self, bytes_per_second: Optional[float]) -> None:
+        self.bytes_per_second = bytes_per_second
+        self._next = time.monotonic()
+        self._lock = threading.Lock()
+
+    def wait(self, n_bytes: int) -> None:
+        if self.bytes_per_second is None:
+            return
+        with self._lock:
+            now = time.monotonic()
+            start = max(self._next, now)
+            self._next = start + n_bytes / self.bytes_per_second
+            delay = start - now
+        if delay > 0:
+            time.sleep(delay)
+
+
+class UploadProgress:
+    """
+    Per-file upload progress, saved as JSON after every chunk,
+    so that a later upload can pick up where this one stopped.
+    A file is sent again from the start if its size or mtime changed since.
+    """
+
+    def __init__(self, path: Union[str, Path]) -> None:
+        self.path = str(path)
+        self._lock = threading.Lock()
+        self.files = {}  # type: Dict[str, Dict[str, object]]
+        if pexists(self.path):
+            try:
+                with open(self.path, encoding="utf8") as f:
+                    self.files = json.load(f)
+            except ValueError:
+                logging.warning("Ignoring unreadable upload progress file {}".format(self.path))
+
+    def get(self, name: str, size: int, mtime_ns: int) -> Dict[str, object]:
+        with self._lock:
+            record = self.files.get(name)
+            if record is None or record["size"] != size or record["mtime_ns"] != mtime_ns:
+                record = dict(size=size, mtime_ns=mtime_ns, sha256=None, sent=0, done=False)
+                self.files[name] = record
+            return dict(record)
+
+    def update(self, name: str, **values) -> None:
+        with self._lock:
+            self.files[name].update(values)
+            tmp = self.path + ".tmp"
+            with open(tmp, "w", encoding="utf8") as f:
+                json.dump(self.files, f)
+            os.replace(tmp, self.path)
+
+    def delete(self) -> None:
+        if pexists(self.path):
+            os.remove(self.path)
+
+
+class Uploader:
+    """
+    Uploads a directory over SSH, several files at once.
+    Each file is appended to ``<name>.part`` on the remote in chunks, recording progress after each.
+    If an upload is interrupted, the next one truncates each ``.part`` to the last recorded chunk
+    and continues from there; files that were already finished are skipped.
+    Once a file is sent, its remote SHA-256 is checked against the local one
+    (from the ``.sha256`` file if it's current), and only then is it renamed to its real name.
+    Each worker thread has its own SSH master connection, reused for all of its commands and chunks,
+    so the files go over ``n_connections`` separate TCP connections and ssh processes
+    (rather than as channels of one, which would be limited to one stream's throughput).
+    The usage is:
+            Uploader("kale@valinor", "/shire/uploads/", progress_file).upload(output_dir)
+    """
+
+    def __init__(
+        self,
+        destination: str,
+        remote_dir: str,
+        progress_file: Union[str, Path],
+        n_connections: int = 4,
+        chunk_bytes: int = 64 * 1024 * 1024,
+        max_bytes_per_second: Optional[float] = None,
+    ) -> None:
+        if n_connections < 1:
+            raise ValueError("Need at least one connection")
+        self.destination = destination
+        self.remote_dir = remote_dir
+        self.progress = UploadProgress(progress_file)
+        self.n_connections = n_connections
+        self.chunk_bytes = chunk_bytes
+        self._throttle = _Throttle(max_bytes_per_second)
+        self._worker = threading.local()
+        self._n_workers = 0
+        self._worker_lock = threading.Lock()
+
+    def upload(self, local_dir: str) -> None:
+        """
+        Uploads ``local_dir`` to ``remote_dir/<name of local_dir>``, as ``scp -r`` would.
+        Raises a BadCommandError if any file fails; calling again resumes.
+        """
+        local_dir = os.path.normpath(local_dir)
+        remote_root = pjoin(self.remote_dir, os.path.basename(local_dir))
+        files = self._list(local_dir)
+        total = sum(os.path.getsize(pjoin(local_dir, f)) for f in files)
+        dirs = sorted({os.path.dirname(pjoin(remote_root, f)) for f in files} | {remote_root})
+        self._ssh("mkdir -p " + " ".join(shlex.quote(d) for d in dirs))
+        logging.info(
+            "Uploading {} files ({} bytes) to {}:{} over {} connections".format(
+                len(files), total, self.destination, remote_root, self.n_connections
+            )
+        )
+        t0 = time.monotonic()
+        # largest first, so that the small files fill in around them
+        files.sort(key=lambda f: -os.path.getsize(pjoin(local_dir, f)))
+        errors = []  # type: List[str]
+        with ThreadPoolExecutor(max_workers=self.n_connections) as executor:
+            futures = {
+                f: executor.submit(self._upload_file, pjoin(local_dir, f), f, pjoin(remote_root, f))
+                for f in files
+            }
+            for name, future in futures.items():
+                try:
+                    future.result()
+                except (BadCommandError, OSError) as e:
+                    logging.error("Failed to upload {}: {}".format(name, e))
+                    errors.append(name)
+        if len(errors) > 0:
+            raise BadCommandError(
+                "Failed to upload {} of {} files; the next attempt will resume".format(
+                    len(errors), len(files)
+                )
+            )
+        self.progress.delete()
+        logging.info("Uploaded {} in {}s".format(local_dir, round(time.monotonic() - t0, 1)))
+
+    def _upload_file(self, path: str, name: str, remote: str) -> None:
+        stat = os.stat(path)
+        size = stat.st_size
+        record = self.progress.get(name, size, stat.st_mtime_ns)
+        if record["done"]:
+            logging.debug("Skipping {}: already uploaded".format(name))
+            return
+        part = remote + ".part"
+        expected = record["sha256"]
+        if expected is None:
+            expected = self._local_sha256(path, size)
+            self.progress.update(name, sha256=expected)
+        # never trust more of the remote file than what was recorded
+        sent = int(
+            self._ssh(
+                "touch {p} && s=$(stat -c %s {p}) && n=$(( s < {n} ? s : {n} ))"
+                " && truncate -s $n {p} && echo $n".format(p=shlex.quote(part), n=record["sent"])
+            )
+        )
+        if sent > 0:
+            logging.info("Resuming {} at {} of {} bytes".format(name, sent, size))
+        while sent < size:
+            n = min(self.chunk_bytes, size - sent)
+            self._send_chunk(path, part, sent, n)
+            sent += n
+            self.progress.update(name, sent=sent)
+        remote_hash = self._ssh("sha256sum {} | cut -d' ' -f1".format(shlex.quote(part)))
+        if remote_hash != expected:
+            self._ssh("rm -f {}".format(shlex.quote(part)))
+            self.progress.update(name, sent=0)
+            raise BadCommandError(
+                "Remote SHA-256 {} of {} does not match {}".format(remote_hash, name, expected)
+            )
+        self._ssh("mv -f {} {}".format(shlex.quote(part), shlex.quote(remote)))
+        self.progress.update(name, done=True)
+
+    def _send_chunk(self, path: str, part: str, offset: int, n: int) -> None:
+        proc = subprocess.Popen(
+            self._ssh_command("cat >> {}".format(shlex.quote(part))),
+            stdin=subprocess.PIPE,
+            stdout=subprocess.DEVNULL,
+            stderr=subprocess.PIPE,
+        )
+        try:
+            with open(path, "rb") as f:
+                f.seek(offset)
+                remaining = n
+                while remaining > 0:
+                    block = f.read(min(1024 * 1024, remaining))
+                    if len(block) == 0:
+                        raise BadCommandError("{} shrank while uploading".format(path))
+                    self._throttle.wait(len(block))
+                    proc.stdin.write(block)
+                    remaining -= len(block)
+        except BrokenPipeError:
+            pass  # the exit code below has the reason
+        finally:
+            try:
+                proc.stdin.close()
+            except BrokenPipeError:
+                pass
+        err = proc.stderr.read()
+        if proc.wait() != 0:
+            raise BadCommandError(
+                "ssh exited with {} sending {}: {}".format(
+                    proc.returncode, path, err.decode("utf8", errors="replace")
+                )
+            )
+
+    def _local_sha256(self, path: str, size: int) -> str:
+        # the hash files written by write_hash_file cover the whole file
+        hash_file = path + ".sha256"
+        if pexists(hash_file) and os.path.getmtime(hash_file) >= os.path.getmtime(path):
+            with open(hash_file, encoding="utf8") as f:
+                return f.read().strip()
+        alg = hashlib.sha256()
+        with open(path, "rb") as f:
+            remaining = size
+            while remaining > 0:
+                block = f.read(min(1024 * 1024, remaining))
+                if len(block) == 0:
+                    break
+                alg.update(block)
+                remaining -= len(block)
+        return alg.hexdigest()
+
+    def _ssh(self, command: str) -> str:
+        result = subprocess.run(
+            self._ssh_command(command), stdout=subprocess.PIPE, stderr=subprocess.PIPE
+        )
+        if result.returncode != 0:
+            raise BadCommandError(
+                "ssh exited with {} running '{}': {}".format(
+                    result.returncode, command, result.stderr.decode("utf8", errors="replace")
+                )
+            )
+        return result.stdout.decode("utf8").strip()
+
+    def _ssh_command(self, command: str) -> List[str]:
+        return [
+            "ssh",
+            "-o",
+            "BatchMode=yes",
+            "-o",
+            "ControlMaster=auto",
+            "-o",
+            "ControlPath={}".format(self._control_path()),
+            "-o",
+            "ControlPersist=60",
+            self.destination,
+            command,
+        ]
+
+    def _control_path(self) -> str:
+        # one master per thread; the PID keeps concurrent uploads from sharing them
+        if not hasattr(self._worker, "index"):
+            with self._worker_lock:
+                self._worker.index = self._n_workers
+                self._n_workers += 1
+        return pjoin(
+            tempfile.gettempdir(),
+            "sauronx-ssh-{}-{}-%r@%h-%p".format(os.getpid(), self._worker.index),
+        )
+
+    def _list(self, local_dir: str) -> List[str]:
+        files = []
+        for root, _, names in os.walk(local_dir):
+            for name in names:
+                path = pjoin(root, name)
+                # skip broken symlinks
+                if os.path.isfile(path):
+                    files.append(os.path.relpath(path, local_dir))
+        return files
+
+
+__all__ = ["Uploader", "UploadProgress"]
@@ -0,0 +1,216 @@
+import logging
+import os
+import shutil
+import subprocess
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from pathlib import Path
+from typing import Callable, Dict, List, Optional, Tuple
+
+from pocketutils.core.exceptions import BadCommandError
+
+from .utils import make_dirs, pexists, pjoin
+
+# given (start_number, n_frames, output_path), returns the ffmpeg command
+SegmentCommand = Callable[[int, int, str], List[str]]
+
+
+class SegmentedEncoder:
+    """
+    Encodes raw frames into closed-GOP video segments, optionally while the camera is still writing them.
+    Segments lie on a fixed grid of ``segment_frames`` frames, starting at the first frame.
+    Each finished segment is written to a temp file and renamed to ``<start>-<n>.mkv``,
+    so the directory is the only state: another process (or ``sauronx continue``) can pick up where this left off.
+    A frame is considered complete once the frame after it exists.
+    The usage is:
+            encoder = SegmentedEncoder(frames_dir, segments_dir, command, 1500, 2)
+            encoder.follow()
+            # let the camera write
+            encoder.stop()
+            encoder.assemble([(first_kept, last_kept + 1)], video_file)
+    """
+
+    def __init__(
+        self,
+        frames_dir: str,
+        segments_dir: str,
+        command: SegmentCommand,
+        segment_frames: int,
+        n_workers: int,
+        poll_seconds: float = 2.0,
+    ) -> None:
+        if segment_frames < 1:
+            raise ValueError("Segments must contain at least one frame")
+        self.frames_dir = str(frames_dir)
+        self.segments_dir = str(segments_dir)
+        self.command = command
+        self.segment_frames = segment_frames
+        self.n_workers = n_workers
+        self.poll_seconds = poll_seconds
+        self._first_frame = None  # type: Optional[int]
+        self._next_segment = 0
+        self._stopping = threading.Event()
+        self._thread = None  # type: Optional[threading.Thread]
+        self._executor = None  # type: Optional[ThreadPoolExecutor]
+        self._futures = []  # type: List[Future]
+
+    def follow(self) -> None:
+        """Starts encoding segments in the background as frames are written."""
+        make_dirs(self.segments_dir)
+        self._stopping.clear()
+        self._executor = ThreadPoolExecutor(max_workers=self.n_workers)
+        self._thread = threading.Thread(target=self._follow, name="segment-follower", daemon=True)
+        self._thread.start()
+        logging.info(
+            "Encoding {}-frame segments with {} workers during capture".format(
+                self.segment_frames, self.n_workers
+            )
+        )
+
+    def stop(self) -> None:
+        """Stops following the frames directory and waits for segments that were already started."""
+        if self._thread is None:
+            return
+        self._stopping.set()
+        self._thread.join()
+        self._executor.shutdown(wait=True)
+        n_failed = sum(1 for f in self._futures if f.exception() is not None)
+        if n_failed > 0:
+            logging.error(
+                "{} segments failed during capture; they will be re-encoded".format(n_failed)
+            )
+        logging.info("Encoded {} segments during capture".format(len(self._futures) - n_failed))
+        self._thread, self._executor, self._futures = None, None, []
+
+    def first_frame(self) -> int:
+        first = self._find_first_frame()
+        if first is None:
+            raise ValueError("No frames were found in {}".format(self.frames_dir))
+        return first
+
+    def encode_range(self, start: int, stop: int, output: str) -> None:
+        """Encodes frames ``start`` (inclusive) to ``stop`` (exclusive) directly to ``output``."""
+        make_dirs(os.path.dirname(output))
+        tmp = pjoin(os.path.dirname(output), "." + os.path.basename(output) + ".tmp")
+        cmd = self.command(start, stop - start, tmp)
+        result = subprocess.run(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+        if result.returncode != 0:
+            if pexists(tmp):
+                os.remove(tmp)
+            raise BadCommandError(
+                "ffmpeg failed encoding frames {}–{}: {}".format(
+                    start, stop, result.stderr.decode("utf8", errors="replace")
+                )
+            )
+        os.replace(tmp, output)
+
+    def assemble(self, ranges: List[Tuple[int, int]], output: str) -> None:
+        """
+        Builds a video of the frames in ``ranges``, each a ``(start, stop)`` pair with ``stop`` exclusive, in order.
+        Reuses every grid segment that lies inside a range, encodes the missing ones and the partial ends in parallel,
+        and then concatenates them without re-encoding.
+        """
+        ranges = [(start, stop) for start, stop in ranges if stop > start]
+        if len(ranges) == 0:
+            raise ValueError("Cannot make a video with no frames")
+        first = self.first_frame()
+        pieces = [p for start, stop in ranges for p in self._pieces(first, start, stop)]
+        existing = self._existing_segments()
+        missing = [(s, e) for s, e in pieces if (s, e - s) not in existing]
+        logging.info(
+            "Assembling video from {} segments; {} were encoded during capture".format(
+                len(pieces), len(pieces) - len(missing)
+            )
+        )
+        t0 = time.monotonic()
+        with ThreadPoolExecutor(max_workers=self.n_workers) as executor:
+            futures = [executor.submit(self._encode_segment, s, e) for s, e in missing]
+            for future in futures:
+                future.result()
+        list_file = pjoin(self.segments_dir, "concat.txt")
+        with open(list_file, "w", encoding="utf8") as f:
+            for s, e in pieces:
+                f.write("file '{}'\n".format(self._segment_path(s, e - s)))
+        make_dirs(os.path.dirname(output))
+        cmd = ["ffmpeg", "-loglevel", "warning", "-nostdin", "-f", "concat", "-safe", "0"]
+        cmd += ["-i", list_file, "-c", "copy", "-y", str(output)]
+        result = subprocess.run(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+        if result.returncode != 0:
+            raise BadCommandError(
+                "ffmpeg failed concatenating segments into {}: {}".format(
+                    output, result.stderr.decode("utf8", errors="replace")
+                )
+            )
+        logging.info(
+            "Assembled {} after capture in {}s".format(output, round(time.monotonic() - t0, 1))
+        )
+
+    def delete_segments(self) -> None:
+        if pexists(self.segments_dir):
+            shutil.rmtree(self.segments_dir)
+
+    def _follow(self) -> None:
+        while not self._stopping.is_set():
+            # noinspection PyBroadException
+            try:
+                if self._first_frame is None:
+                    self._first_frame = self._find_first_frame()
+                if self._first_frame is not None:
+                    self._submit_completed()
+            except Exception:
+                logging.exception("Failed following {}".format(self.frames_dir))
+            self._stopping.wait(self.poll_seconds)
+
+    def _submit_completed(self) -> None:
+        existing = self._existing_segments()
+        while True:
+            start = self._first_frame + self._next_segment * self.segment_frames
+            stop = start + self.segment_frames
+            # the frame after the segment exists, so every frame in the segment is fully written
+            if not pexists(self._frame_path(stop)):
+                break
+            if (start, self.segment_frames) not in existing:
+                self._futures.append(self._executor.submit(self._encode_segment, start, stop))
+            self._next_segment += 1
+
+    def _encode_segment(self, start: int, stop: int) -> None:
+        self.encode_range(start, stop, self._segment_path(start, stop - start))
+        logging.debug("Encoded segment {}–{}".format(start, stop))
+
+    def _pieces(self, first: int, start: int, stop: int) -> List[Tuple[int, int]]:
+        # cut at every grid boundary strictly inside the range; only the two ends can be partial segments
+        n = self.segment_frames
+        boundary = first + -(-(start - first) // n) * n
+        cuts = [start, *[b for b in range(boundary, stop, n) if b > start], stop]
+        return list(zip(cuts, cuts[1:]))
+
+    def _existing_segments(self) -> Dict[Tuple[int, int], str]:
+        if not pexists(self.segments_dir):
+            return {}
+        found = {}
+        for name in os.listdir(self.segments_dir):
+            if not name.endswith(".mkv") or name.startswith("."):
+                continue
+            start, n = name[: -len(".mkv")].split("-")
+            found[(int(start), int(n))] = pjoin(self.segments_dir, name)
+        return found
+
+    def _segment_path(self, start: int, n: int) -> str:
+        return pjoin(self.segments_dir, "{:08d}-{:06d}.mkv".format(start, n))
+
+    def _frame_path(self, frame: int) -> str:
+        return pjoin(self.frames_dir, "{:08d}.raw".format(frame))
+
+    def _find_first_frame(self) -> Optional[int]:
+        if not pexists(self.frames_dir):
+            return None
+        frames = [
+            int(Path(f).stem)
+            for f in os.listdir(self.frames_dir)
+            if f.endswith(".raw") and not f.startswith(".")
+        ]
+        return min(frames) if len(frames) > 0 else None
+
+
+__all__ = ["SegmentedEncoder"]
@@ -19,6 +19,35 @@ class TestModel:
             valar.reconnect()
             assert list(Refs) is not None
 
+    def test_pooled(self):
+        from concurrent.futures import ThreadPoolExecutor
+
+        with Valar({**CONFIG_DATA, "pool": {"max_connections": 4}}) as valar:
+            from valarpy.model import Refs
+
+            assert valar.is_pooled
+
+            def names(_):
+                return [r.name for r in Refs.select()]
+
+            with ThreadPoolExecutor(4) as executor:
+                assert list(executor.map(names, range(8))) == [["ref_four"]] * 8
+            valar.reconnect(hard=True)
+            assert list(Refs) is not None
+
+    def test_read_retry(self):
+        with Valar({**CONFIG_DATA, "read_retries": 1}) as valar:
+            from valarpy.model import Refs
+
+            assert not valar.is_pooled
+            # simulate an idle timeout by closing the socket behind peewee's back
+            valar._db.connection().close()
+            assert [r.name for r in Refs.select()] == ["ref_four"]
+
+    def test_invalid_pool(self):
+        with pytest.raises(TypeError):
+            Valar({**CONFIG_DATA, "pool": 4})
+
     def test_config_dict(self):
         with Valar(CONFIG_DATA):
             from valarpy.model import Refs
@@ -190,6 +190,50 @@ class TestMetamodel:
         lines = Features.get_schema().split("\n")
         assert len(lines) == 6
 
+    def test_identity_map(self, setup):
+        from valarpy.model import IdentityMap, Refs
+
+        assert IdentityMap.current() is None
+        with IdentityMap.session() as identity_map:
+            ref = Refs.fetch("ref_four")
+            assert Refs.fetch(4) is ref
+            assert Refs.fetch_all([4, "ref_four"]) == [ref, ref]
+            assert Refs.fetch_all([4])[0] is ref
+            assert len(identity_map) == 1
+            identity_map.invalidate(Refs)
+            assert len(identity_map) == 0
+            assert Refs.fetch(4) is not ref
+        assert IdentityMap.current() is None
+        assert Refs.fetch(4) is not Refs.fetch(4)
+
+    def test_identity_map_per_thread(self):
+        from concurrent.futures import ThreadPoolExecutor
+
+        from valarpy.metamodel import IdentityMap
+
+        def other_session():
+            assert IdentityMap.current() is None
+            with IdentityMap.session() as other:
+                return other
+
+        with IdentityMap.session() as identity_map:
+            with ThreadPoolExecutor(1) as executor:
+                # the other thread's session ends without disabling this one
+                assert executor.submit(other_session).result() is not identity_map
+            assert IdentityMap.current() is identity_map
+        assert IdentityMap.current() is None
+
+    def test_prefetch(self, setup):
+        from valarpy.model import Experiments, Refs, ValarTableTypeError
+
+        assert Experiments.prefetch([], "project", "battery") == []
+        with pytest.raises(ValueError):
+            Experiments.prefetch([], "name")
+        with pytest.raises(ValueError):
+            Experiments.prefetch([], "project.nonexistent")
+        with pytest.raises(ValarTableTypeError):
+            Experiments.prefetch([Refs(id=4)], "project")
+
     def test_sstring(self, setup):
 
         from valarpy.model import ControlTypes
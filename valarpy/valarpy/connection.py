@@ -1,18 +1,127 @@
 import json
 import logging
 import os
+import re
 from contextlib import contextmanager
 from pathlib import Path
 from typing import Any, Dict, List, Mapping, Union, Generator, Type
 
 import peewee
 from peewee import _transaction as PeeweeTransaction
+from playhouse.pool import PooledMySQLDatabase
 
 logger = logging.getLogger("valarpy")
 
 
+class _ReadRetryMixin:
+    """
+    Retries reads that failed because the connection was dropped, after reconnecting.
+    Only statements that cannot modify data (``SELECT``, ``SHOW``, ``DESCRIBE``, and ``EXPLAIN``)
+    are retried, and only outside of transactions, where the lost state cannot be replayed.
+    """
+
+    # server has gone away, lost connection during query, lost connection before reading
+    _dropped_codes = {2006, 2013, 2055}
+    _read_pattern = re.compile(r"^\s*(?:SELECT|SHOW|DESCRIBE|DESC|EXPLAIN)\b", re.IGNORECASE)
+
+    def __init__(self, *args, read_retries: int = 1, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.read_retries = read_retries
+
+    def execute_sql(self, sql, *args, **kwargs):
+        attempt = 0
+        while True:
+            try:
+                return super().execute_sql(sql, *args, **kwargs)
+            except (peewee.OperationalError, peewee.InterfaceError) as e:
+                if attempt >= self.read_retries or not self._can_retry(sql, e):
+                    raise
+                attempt += 1
+                logger.warning(f"Lost connection ({e}); reconnecting (attempt {attempt})")
+                self._discard_connection()
+                self.connect()
+
+    def _can_retry(self, sql: str, e: Exception) -> bool:
+        # pymysql raises InterfaceError(0, "") when using a connection it already knows is closed
+        dropped = isinstance(e, peewee.InterfaceError) or (
+            len(e.args) > 0 and e.args[0] in self._dropped_codes
+        )
+        return dropped and not self.in_transaction() and self._read_pattern.match(sql) is not None
+
+    def _discard_connection(self) -> None:
+        try:
+            self.close()
+        except Exception:
+            logger.debug("Failed to close dropped connection", exc_info=True)
+            self._state.reset()
+
+
+class ValarMySQLDatabase(_ReadRetryMixin, peewee.MySQLDatabase):
+    """
+    A ``MySQLDatabase`` (one connection per thread) that retries reads after a dropped connection.
+    """
+
+
+class _ReturningAtomic(peewee._callable_context_manager):
+    """
+    Wraps ``atomic`` to return a connection that it checked out once the outermost block exits.
+    """
+
+    def __init__(self, db: peewee.Database, atomic) -> None:
+        self.db = db
+        self.atomic = atomic
+        self._checked_out = False
+
+    def __enter__(self):
+        self._checked_out = self.db.is_closed()
+        if self._checked_out:
+            self.db.connect()
+        return self.atomic.__enter__()
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        try:
+            return self.atomic.__exit__(exc_type, exc_val, exc_tb)
+        finally:
+            if self._checked_out and not self.db.in_transaction():
+                self.db.close()
+
+
+class PooledValarMySQLDatabase(_ReadRetryMixin, PooledMySQLDatabase):
+    """
+    A thread-safe pool of MySQL connections that retries reads after a dropped connection.
+    A thread that isn't holding a connection checks one out for each statement or ``atomic`` block
+    and returns it afterward, so idle (or finished) threads never hold one.
+    A thread that calls ``connect`` keeps its connection until it calls ``close``.
+    Rows are fetched before the connection is returned, which requires a buffered cursor
+    (the pymysql default).
+    Idle connections are pinged before checkout, and replaced if the server closed them.
+    """
+
+    def execute_sql(self, sql, *args, **kwargs):
+        if not self.is_closed():
+            return super().execute_sql(sql, *args, **kwargs)
+        try:
+            return super().execute_sql(sql, *args, **kwargs)
+        finally:
+            if not self.is_closed() and not self.in_transaction():
+                self.close()
+
+    def atomic(self, *args, **kwargs):
+        return _ReturningAtomic(self, super().atomic(*args, **kwargs))
+
+    def _discard_connection(self) -> None:
+        # don't return the broken connection to the pool
+        try:
+            self.manual_close()
+        except Exception:
+            logger.debug("Failed to close dropped connection", exc_info=True)
+            self._state.reset()
+
+
 class GlobalConnection:  # pragma: no cover
     _peewee_database: peewee.Database = None
+    # models are bound to the proxy, so re-opening with a different config re-binds them
+    _database_proxy: peewee.DatabaseProxy = peewee.DatabaseProxy()
     _write_enabled: bool = False
 
     @classmethod
@@ -56,6 +165,13 @@ class Valar:
                 If a dict, used as-is. If a path or str, attempts to read JSON from that path.
                 If a list of paths, strs, and Nones, reads from the first extant file found in the list.
                 If None, attempts to read JSON from the ``VALARPY_CONFIG`` environment variable, if set.
+                Two optional keys are not passed to peewee:
+                    - ``pool``: ``true`` or a dict of ``max_connections`` (default 20),
+                      ``stale_timeout`` (seconds before an idle connection is recycled),
+                      and ``timeout`` (seconds to wait for a free connection; default 60)
+                      to use a thread-safe pool of connections instead of one per thread
+                    - ``read_retries``: The number of times to retry a read after the connection
+                      was dropped, such as after an idle timeout (default 1)
 
         Raises:
             FileNotFoundError: If a path was supplied but does not point to a file
@@ -85,6 +201,12 @@ class Valar:
         # make a copy! Otherwise we'll pop the passed argument, which could cause problems
         self._config: Dict[str, Union[str, int]] = {k: v for k, v in config.items()}
         self._db_name = self._config.pop("database")
+        self._pool = self._config.pop("pool", False)
+        self._read_retries = int(self._config.pop("read_retries", 1))
+        if self._pool is True:
+            self._pool = {}
+        elif self._pool is not False and not isinstance(self._pool, Mapping):
+            raise TypeError(f"Invalid pool config {self._pool}")
 
     @property
     def backend(self) -> Type[GlobalConnection]:
@@ -140,15 +262,16 @@ class Valar:
             A peewee Transaction type; this should generally not be used
         """
         # noinspection PyBroadException
-        try:
-            with self._db.atomic() as t:
+        # roll back inside the block, while the (possibly pooled) connection is still checked out
+        with self._db.atomic() as t:
+            try:
                 yield t
-        except BaseException:
-            logger.debug("Failed on transaction. Rolling back.")
-            raise
-        finally:
-            logger.debug("Succeeded on transaction. Rolling back.")
-            t.rollback()
+            except BaseException:
+                logger.debug("Failed on transaction. Rolling back.")
+                raise
+            finally:
+                logger.debug("Succeeded on transaction. Rolling back.")
+                t.rollback()
 
     @contextmanager
     def atomic(self) -> Generator[PeeweeTransaction, None, None]:
@@ -201,26 +324,47 @@ class Valar:
         else:
             GlobalConnection._peewee_database.connect(reuse_if_open=True)
 
+    @property
+    def is_pooled(self) -> bool:
+        return self._pool is not False
+
     def open(self) -> None:
         """
         Opens the database connection.
         This is already called by ``__enter__``.
         """
-        logging.info(f"Opening connection to {self._db_name}")
-        GlobalConnection._peewee_database = peewee.MySQLDatabase(
-            self._db_name, autorollback=True, **self._config
-        )
+        logging.info(f"Opening {'pooled ' if self.is_pooled else ''}connection to {self._db_name}")
+        if self.is_pooled:
+            db = PooledValarMySQLDatabase(
+                self._db_name,
+                autorollback=True,
+                read_retries=self._read_retries,
+                **{"timeout": 60, **self._pool},
+                **self._config,
+            )
+        else:
+            db = ValarMySQLDatabase(
+                self._db_name, autorollback=True, read_retries=self._read_retries, **self._config
+            )
+        GlobalConnection._peewee_database = db
+        GlobalConnection._database_proxy.initialize(db)
         GlobalConnection._peewee_database.connect()
         if self._db.in_transaction():
             raise AssertionError("In transaction on open() but should not be")
+        if self.is_pooled:
+            # only checked that it works; statements check connections out as needed
+            GlobalConnection._peewee_database.close()
 
     def close(self) -> None:
         """
         Closes the connection.
+        With a pool, also closes the idle connections of other threads.
         This is already called by ``__exit__``.
         """
         logging.info(f"Closing connection to {self._db_name}")
         GlobalConnection._peewee_database.close()
+        if isinstance(GlobalConnection._peewee_database, PooledMySQLDatabase):
+            GlobalConnection._peewee_database.close_all()
 
     def __enter__(self):
         self.open()
@@ -245,4 +389,18 @@ class Valar:
         return json.loads(Path(path).read_text(encoding="utf8"))
 
 
-__all__ = ["GlobalConnection", "Valar"]
+def _forget_connections_after_fork() -> None:  # pragma: no cover
+    # a forked child shares the parent's sockets; using or closing them would corrupt the parent's
+    db = GlobalConnection._peewee_database
+    if db is not None:
+        db._state.reset()
+        if isinstance(db, PooledMySQLDatabase):
+            db._connections = []
+            db._in_use = {}
+
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_forget_connections_after_fork)
+
+
+__all__ = ["GlobalConnection", "PooledValarMySQLDatabase", "Valar", "ValarMySQLDatabase"]
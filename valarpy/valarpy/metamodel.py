@@ -1,7 +1,22 @@
 from __future__ import annotations
 from collections import defaultdict
+from contextlib import contextmanager
+from contextvars import ContextVar
 from numbers import Integral
-from typing import Any, Callable, Dict, Iterable, List, Mapping, Optional, Sequence, Union
+from typing import (
+    Any,
+    Callable,
+    Dict,
+    Generator,
+    Iterable,
+    List,
+    Mapping,
+    Optional,
+    Sequence,
+    Tuple,
+    Type,
+    Union,
+)
 
 import pandas as pd
 import peewee
@@ -15,7 +30,7 @@ from valarpy import (
 )
 from valarpy.connection import GlobalConnection
 
-database = GlobalConnection._peewee_database
+database = GlobalConnection._database_proxy
 
 
 # noinspection PyProtectedMember
@@ -55,6 +70,131 @@ class UnknownField(object):  # pragma: no cover
         pass
 
 
+class IdentityMap:
+    """
+    Rows that were already fetched, keyed by (table, ID) and by (table, unique column, value).
+    ``BaseModel.fetch_or_none``, ``fetch``, ``fetch_all_or_none``, and ``fetch_all`` consult it
+    for exact lookups (not with ``like``, ``regex``, or a ``join_fn``) and add the rows they find.
+    Misses are not recorded.
+    Writes through ``BaseModel`` invalidate the affected rows (or the whole table, for bulk writes),
+    but changes made by other connections are not seen until ``invalidate`` or ``clear`` is called.
+    Every lookup that hits the map returns the same instance, so a change made to a row by one caller
+    is seen by every other caller that fetched it (in the same session).
+
+    It is off by default. Enable it for a block of code::
+
+        with IdentityMap.session():
+            for stim in stimuli:
+                Stimuli.fetch(stim)  # queries only once per distinct stimulus
+
+    Or for the rest of the thread with ``IdentityMap.enable()``.
+    The enabled map is held in a ``ContextVar``, so each thread (and asyncio task) has its own,
+    and a session in one thread never affects another.
+    New threads start with the map disabled.
+    """
+
+    _current: ContextVar[Optional[IdentityMap]] = ContextVar("valarpy_identity_map", default=None)
+
+    def __init__(self):
+        self._rows: Dict[Tuple[str, int], peewee.Model] = {}
+        self._ids: Dict[Tuple[str, str, Any], int] = {}
+
+    @classmethod
+    def current(cls) -> Optional[IdentityMap]:
+        """
+        Returns:
+            The enabled identity map, or None if it is disabled
+        """
+        return cls._current.get()
+
+    @classmethod
+    def enable(cls) -> IdentityMap:
+        """
+        Enables the identity map for this thread, keeping the current one if it is already enabled.
+
+        Returns:
+            The enabled identity map
+        """
+        if cls._current.get() is None:
+            cls._current.set(IdentityMap())
+        return cls._current.get()
+
+    @classmethod
+    def disable(cls) -> None:
+        """
+        Disables and discards the identity map for this thread.
+        """
+        cls._current.set(None)
+
+    @classmethod
+    @contextmanager
+    def session(cls) -> Generator[IdentityMap, None, None]:
+        """
+        Context manager that enables the identity map, and disables it on exit if it was disabled.
+
+        Yields:
+            The enabled identity map
+        """
+        was_enabled = cls._current.get() is not None
+        try:
+            yield cls.enable()
+        finally:
+            if not was_enabled:
+                cls.disable()
+
+    def get(self, model: Type[BaseModel], thing: Union[Integral, str]) -> Optional[peewee.Model]:
+        """
+        Gets a row by ID or by a value of any of its unique string columns.
+
+        Returns:
+            The row, or None if it was not fetched before
+        """
+        table = model._meta.table_name
+        if isinstance(thing, Integral):
+            return self._rows.get((table, int(thing)))
+        for col in model.get_indexing_cols():
+            row = self._rows.get((table, self._ids.get((table, col, thing))))
+            # the value might have changed since it was put
+            if row is not None and getattr(row, col) == thing:
+                return row
+        return None
+
+    def put(self, row: peewee.Model) -> None:
+        """
+        Adds or replaces a row.
+        """
+        table = row._meta.table_name
+        self._rows[(table, row.id)] = row
+        for col in row.get_indexing_cols():
+            value = getattr(row, col)
+            if value is not None:
+                self._ids[(table, col, value)] = row.id
+
+    def invalidate(self, model: Type[BaseModel], *ids: int) -> None:
+        """
+        Removes rows of a table.
+
+        Args:
+            model: The table
+            ids: The IDs of rows to remove; if none are passed, removes every row of the table
+        """
+        table = model._meta.table_name
+        if len(ids) == 0:
+            ids = [i for t, i in self._rows.keys() if t == table]
+        for i in ids:
+            self._rows.pop((table, i), None)
+
+    def clear(self) -> None:
+        """
+        Removes every row.
+        """
+        self._rows.clear()
+        self._ids.clear()
+
+    def __len__(self) -> int:
+        return len(self._rows)
+
+
 class TableDescriptionFrame(pd.DataFrame):
     """
     A Pandas DataFrame subclass that contains the columns::
@@ -83,15 +223,18 @@ class BaseModel(Model):
 
     def save(self, force_insert=False, only=None) -> Union[bool, int]:
         self._ensure_write()
+        self._forget(self.id)
         return super().save(force_insert, only)
 
     def delete_instance(self, recursive=False, delete_nullable=False) -> Any:
         self._ensure_write()
+        self._forget(self.id)
         return super().delete_instance(recursive, delete_nullable)
 
     @classmethod
     def update(cls, __data=None, **update) -> peewee.ModelUpdate:
         cls._ensure_write()
+        cls._forget()
         return super().update(__data, **update)
 
     @classmethod
@@ -112,11 +255,13 @@ class BaseModel(Model):
     @classmethod
     def replace(cls, __data=None, **insert) -> Optional[Any]:
         cls._ensure_write()
+        cls._forget()
         return super().replace(__data, **insert)
 
     @classmethod
     def replace_many(cls, rows, fields=None) -> Optional[Any]:
         cls._ensure_write()
+        cls._forget()
         return super().replace_many(rows, fields)
 
     @classmethod
@@ -126,6 +271,7 @@ class BaseModel(Model):
     @classmethod
     def delete(cls) -> peewee.ModelDelete:
         cls._ensure_write()
+        cls._forget()
         return super().delete()
 
     @classmethod
@@ -141,16 +287,19 @@ class BaseModel(Model):
     @classmethod
     def bulk_update(cls, model_list, fields, batch_size=None) -> int:
         cls._ensure_write()
+        cls._forget(*[m.id for m in model_list])
         return super().bulk_update(model_list, fields, batch_size)
 
     @classmethod
     def set_by_id(cls, key, value) -> Any:
         cls._ensure_write()
+        cls._forget(key)
         return super().set_by_id(key, value)
 
     @classmethod
     def delete_by_id(cls, pk) -> Any:
         cls._ensure_write()
+        cls._forget(pk)
         return super().delete_by_id(pk)
 
     @classmethod
@@ -166,6 +315,13 @@ class BaseModel(Model):
     def truncate_table(cls, **options) -> None:
         raise UnsupportedOperationError(f"Cannot truncate {cls}: not supported")
 
+    @classmethod
+    def _forget(cls, *ids: int) -> None:
+        # rows modified through a query can't be known, so forget the whole table
+        identity_map = IdentityMap.current()
+        if identity_map is not None:
+            identity_map.invalidate(cls, *[i for i in ids if i is not None])
+
     @classmethod
     def _ensure_write(cls):
         if not GlobalConnection._write_enabled:
@@ -347,15 +503,26 @@ class BaseModel(Model):
             raise ValarTableTypeError(
                 f"Fetching a {thing.__class__.__name__} on class {cls.__name__}"
             )
-        elif isinstance(thing, Integral) or isinstance(thing, float):
+        identity_map = IdentityMap.current()
+        if isinstance(thing, float):
+            thing = int(thing)
+        if identity_map is not None and not like and not regex:
+            if isinstance(thing, (Integral, str)):
+                found = identity_map.get(cls, thing)
+                if found is not None:
+                    return found
+        if isinstance(thing, Integral):
             # noinspection PyUnresolvedReferences
-            return cls.get_or_none(cls.id == int(thing))
+            found = cls.get_or_none(cls.id == int(thing))
         elif isinstance(thing, str) and len(cls.__indexing_cols()) > 0:
-            return cls.get_or_none(cls._build_or_query([thing], like=like, regex=regex))
+            found = cls.get_or_none(cls._build_or_query([thing], like=like, regex=regex))
         else:
             raise TypeError(
                 f"Fetching with unknown type {thing.__class__.__name__} on class {cls.__name__}"
             )
+        if found is not None and identity_map is not None:
+            identity_map.put(found)
+        return found
 
     @classmethod
     def fetch(
@@ -507,12 +674,25 @@ class BaseModel(Model):
         # unfortunately right now we have to do 2 queries (ID and names), or we'll get type a mismatch error
         int_things = make_dct(Integral)
         str_things = make_dct(str)
+        # rows from the identity map don't have the joined tables, so only use it without join_fn
+        identity_map = None if has_join_fn else IdentityMap.current()
+        if identity_map is not None:
+            for dct in [int_things, str_things]:
+                for thing in list(dct.keys()):
+                    found = identity_map.get(cls, thing)
+                    if found is not None:
+                        for ind in dct.pop(thing):
+                            index_to_match[ind] = found
         if len(int_things) > 0:
             for match in do_q().where(cls.id << {int(t) for t, ilist in int_things.items()}):
+                if identity_map is not None:
+                    identity_map.put(match)
                 for ind in int_things[match.id]:
                     index_to_match[ind] = match
         if len(str_things) > 0:
             for match in do_q().where(cls._build_or_query(list(set(str_things.keys())))):
+                if identity_map is not None:
+                    identity_map.put(match)
                 for col in cls.__indexing_cols():
                     my_attr = getattr(match, col)
                     if my_attr in str_things:
@@ -520,6 +700,77 @@ class BaseModel(Model):
                             index_to_match[ind] = match
         return [index_to_match.get(i, None) for i in range(0, len(things))]
 
+    @classmethod
+    def prefetch(
+        cls, rows: Iterable[peewee.Model], *paths: str, chunk_size: int = 1000
+    ) -> Sequence[peewee.Model]:
+        """
+        Loads the rows that foreign keys of ``rows`` point to, with one query per foreign key.
+        Accessing the foreign keys afterward does not query.
+        Without this, each access to an unloaded foreign key (``run.experiment``) performs a query,
+        so a loop over 1000 runs performs 1000 queries.
+        Rows already in the enabled ``IdentityMap`` are not queried again.
+
+        Examples:
+            runs = Runs.prefetch(runs, "experiment.project", "experiment.battery")
+            print({r.experiment.project.name for r in runs})  # 0 queries
+
+        Args:
+            rows: Instances of this class
+            paths: Foreign key names, with nested foreign keys separated by ``.``
+            chunk_size: The maximum number of IDs per ``IN`` query
+
+        Returns:
+            ``rows``, as a list
+
+        Raises:
+            ValarTableTypeError: If an element of ``rows`` is not an instance of this class
+            ValueError: If a path contains a name that is not a foreign key
+        """
+        rows = list(rows)
+        bad = {r.__class__.__name__ for r in rows if not isinstance(r, cls)}
+        if len(bad) > 0:
+            raise ValarTableTypeError(f"Prefetching on class {cls.__name__} with rows of {bad}")
+        for path in paths:
+            model, level = cls, rows
+            for name in path.split("."):
+                field = model._meta.fields.get(name)
+                if not isinstance(field, ForeignKeyField):
+                    raise ValueError(f"{name} in {path} is not a foreign key of {model.__name__}")
+                level = field.rel_model._prefetch_level(level, field, chunk_size)
+                model = field.rel_model
+        return rows
+
+    @classmethod
+    def _prefetch_level(
+        cls, rows: Sequence[peewee.Model], field: ForeignKeyField, chunk_size: int
+    ) -> Sequence[peewee.Model]:
+        # load field for each of rows, which are instances of field.model; returns the loaded rows
+        identity_map = IdentityMap.current()
+        by_id = {}
+        for row in rows:
+            if field.name in row.__rel__:
+                found = row.__rel__[field.name]
+                by_id[found.id] = found
+        missing = {row.__data__.get(field.name) for row in rows} - set(by_id.keys()) - {None}
+        if identity_map is not None:
+            for i in list(missing):
+                found = identity_map.get(cls, i)
+                if found is not None:
+                    by_id[i] = found
+                    missing.remove(i)
+        for chunk in peewee.chunked(sorted(missing), chunk_size):
+            for found in cls.select().where(cls.id << chunk):
+                by_id[found.id] = found
+                if identity_map is not None:
+                    identity_map.put(found)
+        for row in rows:
+            i = row.__data__.get(field.name)
+            if i in by_id:
+                # setting __rel__ directly instead of the attribute keeps the row clean
+                row.__rel__[field.name] = by_id[i]
+        return list(by_id.values())
+
     @classmethod
     def fetch_to_query(
         cls,
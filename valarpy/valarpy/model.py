@@ -9,7 +9,7 @@ from typing import Union as __Union
 import peewee
 from peewee import *
 
-from valarpy.metamodel import BaseModel, EnumField
+from valarpy.metamodel import BaseModel, EnumField, IdentityMap
 
 # for convenience with prior code
 from valarpy.micromodels import (